@@ -1,11 +1,64 @@
 DIGEST_SQL = "digest(%s, 'sha512')"
 HMAC_SQL = "hmac(%s, '{}', 'sha512')"
+BLIND_INDEX_SQL = "hmac(lower(btrim(%s::text)), '{}', 'sha256')"
 
-PGP_PUB_ENCRYPT_SQL_WITH_NULLIF = "pgp_pub_encrypt(nullif(%s, NULL)::text, dearmor('{}'))"
-PGP_SYM_ENCRYPT_SQL_WITH_NULLIF = "pgp_sym_encrypt(nullif(%s, NULL)::text, '{}')"
+PGP_PUB_KEY_SQL = "dearmor('{}')"
+PGP_SYM_KEY_SQL = "'{}'"
 
-PGP_PUB_ENCRYPT_SQL = "pgp_pub_encrypt(%s, dearmor('{}'))"
-PGP_SYM_ENCRYPT_SQL = "pgp_sym_encrypt(%s, '{}')"
+PGP_PUB_ENCRYPT_SQL_WITH_NULLIF = "pgp_pub_encrypt(nullif(%s, NULL)::text, {})"
+PGP_SYM_ENCRYPT_SQL_WITH_NULLIF = "pgp_sym_encrypt(nullif(%s, NULL)::text, {})"
 
-PGP_PUB_DECRYPT_SQL = "pgp_pub_decrypt(%s, dearmor('{}'))::%s"
-PGP_SYM_DECRYPT_SQL = "pgp_sym_decrypt(%s, '{}')::%s"
+PGP_PUB_ENCRYPT_SQL = "pgp_pub_encrypt(%s, {})"
+PGP_SYM_ENCRYPT_SQL = "pgp_sym_encrypt(%s, {})"
+
+PGP_PUB_DECRYPT_SQL = "pgp_pub_decrypt(%s, {})::%s"
+PGP_SYM_DECRYPT_SQL = "pgp_sym_decrypt(%s, {})::%s"
+
+# Wrappers installed by the `0002_add_pgcrypto_fields_functions` migration which
+# read the key set for the session by `pgcrypto.signals.set_session_key`.
+# `PGP_SYM_ENCRYPT_SESSION_SQL` is formatted with the options argument, if any.
+PGP_SYM_ENCRYPT_SESSION_SQL = "pgcrypto_fields.sym_encrypt(%s::text{})"
+PGP_SYM_DECRYPT_SESSION_SQL = "pgcrypto_fields.sym_decrypt(%s)::%s"
+
+# Envelope encryption with the data key of the row, installed by the
+# `0008_add_envelope_functions` migration. Formatted with the data key column and the
+# private key sql (or the array of the key ring), followed by the public key sql
+# and the options to encrypt. Without a data key the public key is used.
+PGP_ENVELOPE_ENCRYPT_SQL = "pgcrypto_fields.envelope_encrypt(nullif(%s, NULL)::text, {})"
+PGP_ENVELOPE_DECRYPT_SQL = "pgcrypto_fields.envelope_decrypt(%s, {})::%s"
+
+# AES-256-CBC functions installed by the `0005_add_aes_functions` migration. The
+# value is stored as a random IV followed by the ciphertext.
+AES_KEY_SQL = "digest('{}', 'sha256')"
+AES_ENCRYPT_SQL = (
+    "pgcrypto_fields.aes_encrypt(convert_to(nullif(%s, NULL)::text, 'utf8'), {})"
+)
+AES_DECRYPT_SQL = "convert_from(pgcrypto_fields.aes_decrypt(%s, {}), 'utf8')::%s"
+
+# Deterministic AES-256-CBC, installed by the `0006_add_aes_deterministic_function`
+# migration. The IV is a HMAC of the value so equal values have equal ciphertexts.
+AES_DETERMINISTIC_ENCRYPT_SQL = (
+    "pgcrypto_fields.aes_encrypt_deterministic("
+    "convert_to(nullif(%s, NULL)::text, 'utf8'), {})"
+)
+
+# Key ring functions installed by the `0007_add_key_ring_functions` migration,
+# formatted with the array of keys, followed by the key id or the array of the key
+# ids for symmetric keys. Symmetric messages are prefixed with the configured id of
+# their key and public key messages carry the id of their key.
+PGP_PUB_DECRYPT_KEY_RING_SQL = "pgcrypto_fields.pub_decrypt_key_ring(%s, {})::%s"
+PGP_SYM_ENCRYPT_KEY_ID_SQL = "pgcrypto_fields.sym_encrypt_key_id(%s::text, {})"
+PGP_SYM_DECRYPT_KEY_RING_SQL = "pgcrypto_fields.sym_decrypt_key_ring(%s, {})::%s"
+
+# Conditions formatted with a column, true when its value is encrypted with the
+# current key, or the id of the current key, bound as a parameter.
+PGP_PUB_CURRENT_KEY_SQL = "pgp_key_id({}) = pgp_key_id(%s)"
+PGP_SYM_CURRENT_KEY_SQL = "substring({} for 5) = '\\x01'::bytea || int4send(%s::integer)"
+
+# Without key ids, a symmetric message is encrypted with the current key when it
+# decrypts with it, and is decrypted with the first key of the array which can, by
+# the functions of the `0009_add_rotation_functions` migration.
+PGP_SYM_DECRYPTS_SQL = "pgcrypto_fields.sym_decrypts({}, %s)"
+PGP_SYM_DECRYPT_ANY_SQL = "pgcrypto_fields.sym_decrypt_any(%s, {})::%s"
+
+default_app_config = 'pgcrypto.apps.PGCryptoConfig'
@@ -0,0 +1,28 @@
+from django.apps import AppConfig
+from django.core import checks
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.test.signals import setting_changed
+
+
+class PGCryptoConfig(AppConfig):
+    """Connect the signals used by `pgcrypto`."""
+    name = 'pgcrypto'
+
+    def ready(self):
+        """Set the session key and the binding of the keys on new connections.
+
+        Clear caches on new settings, repair the rows read with values of old keys
+        at the end of requests and register the checks of the settings.
+        """
+        from pgcrypto.checks import check_key_ids, check_options
+        from pgcrypto.signals import (
+            clear_sql_cache, flush_repairs, install_key_binding, set_session_key,
+        )
+
+        connection_created.connect(set_session_key)
+        connection_created.connect(install_key_binding)
+        setting_changed.connect(clear_sql_cache)
+        request_finished.connect(flush_repairs)
+        checks.register(check_options)
+        checks.register(check_key_ids)
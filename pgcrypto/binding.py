@@ -0,0 +1,89 @@
+import re
+
+from psycopg2.extensions import adapt
+
+# Name of the CTE holding the keys bound once per statement.
+KEYS_CTE = 'pgcrypto_keys'
+# Placeholders of psycopg2 and escaped percent signs, in the order of the params.
+PLACEHOLDER_RE = re.compile(r'%[%s]')
+# Statements which can start with a CTE, and the `WITH` of those having one.
+STATEMENT_RE = re.compile(
+    r'\s*(?:(WITH(?:\s+RECURSIVE)?\s)|SELECT\s|INSERT\s|UPDATE\s|DELETE\s)', re.I
+)
+
+
+class BoundKey:
+    """Key sent as a query parameter with `PGCRYPTO_BIND_KEYS`.
+
+    `bind_keys_once` sends each distinct key once per statement. Elsewhere the key
+    is adapted by psycopg2 like the value it wraps.
+    """
+
+    def __init__(self, key):
+        """Init the parameter with the key, its text, bytes or list of keys."""
+        self.key = key
+
+    def __eq__(self, other):
+        """Compare the keys."""
+        return isinstance(other, BoundKey) and self.key == other.key
+
+    def __hash__(self):
+        """Hash the key, a key ring as a tuple."""
+        if isinstance(self.key, list):
+            return hash(tuple(self.key))
+        return hash(self.key)
+
+    def __conform__(self, protocol):
+        """Adapt the key itself for psycopg2."""
+        return adapt(self.key)
+
+
+def bind_keys_once(sql, params):
+    """Get `sql` and `params` sending each `BoundKey` of `params` only once.
+
+    The keys are selected by a `pgcrypto_keys` CTE added to the statement and each
+    of their placeholders reads its key from it. Statements which can't start
+    with a CTE are returned as they are.
+    """
+    if not isinstance(params, (list, tuple)):
+        return sql, params
+    if not any(isinstance(param, BoundKey) for param in params):
+        return sql, params
+
+    match = STATEMENT_RE.match(sql)
+    placeholders = [p for p in PLACEHOLDER_RE.findall(sql) if p == '%s']
+    if match is None or len(placeholders) != len(params):
+        return sql, params
+
+    names, new_params = {}, []
+    param_iter = iter(params)
+
+    def replace(placeholder):
+        if placeholder.group() == '%%':
+            return '%%'
+        param = next(param_iter)
+        if not isinstance(param, BoundKey):
+            new_params.append(param)
+            return '%s'
+        if param not in names:
+            names[param] = 'key{}'.format(len(names))
+        return '(SELECT {} FROM {})'.format(names[param], KEYS_CTE)
+
+    sql = PLACEHOLDER_RE.sub(replace, sql)
+    # A text key would have an unknown type in the CTE.
+    cte = '{} AS (SELECT {})'.format(KEYS_CTE, ', '.join(
+        '%s{} AS {}'.format('::text' if isinstance(key.key, str) else '', name)
+        for key, name in names.items()
+    ))
+    if match.group(1):
+        sql = '{}{}, {}'.format(sql[:match.end()], cte, sql[match.end():])
+    else:
+        sql = 'WITH {} {}'.format(cte, sql)
+    return sql, [*names, *new_params]
+
+
+def execute_bound_keys(execute, sql, params, many, context):
+    """Execute wrapper sending the keys of a statement once."""
+    if not many:
+        sql, params = bind_keys_once(sql, params)
+    return execute(sql, params, many, context)
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core import checks
+from django.db import connections
+
+from pgcrypto.mixins import get_key_ring_ids, get_options_errors, get_setting
+
+# Key ids are written with `int4send()`.
+MAX_KEY_ID = 2 ** 31 - 1
+
+
+def check_options(app_configs, **kwargs):
+    """Check the `PGCRYPTO_OPTIONS` settings are valid pgcrypto options."""
+    options = [('settings.PGCRYPTO_OPTIONS', getattr(settings, 'PGCRYPTO_OPTIONS', None))]
+    for alias, database in settings.DATABASES.items():
+        setting = "DATABASES['{}']['PGCRYPTO_OPTIONS']".format(alias)
+        options.append((setting, database.get('PGCRYPTO_OPTIONS')))
+
+    return [
+        checks.Error(
+            'Invalid {}: {}'.format(setting, error),
+            id='pgcrypto.E003',
+        )
+        for setting, value in options if value
+        for error in get_options_errors(value)
+    ]
+
+
+def check_key_ids(app_configs, **kwargs):
+    """Check the ids of the symmetric keys of the key ring of each database."""
+    errors = []
+    for alias in settings.DATABASES:
+        connection = connections[alias]
+        if not get_setting(connection, 'PGCRYPTO_KEY_IDS', False):
+            continue
+
+        key_ids = get_key_ring_ids(connection)
+        if key_ids[0] is None:
+            errors.append(checks.Error(
+                "PGCRYPTO_KEY_ID isn't set for the database '{}'.".format(alias),
+                hint='Set it to the id of PGCRYPTO_KEY, written into the messages.',
+                id='pgcrypto.E005',
+            ))
+        key_ids = [key_id for key_id in key_ids if key_id is not None]
+        errors.extend(
+            checks.Error(
+                "Invalid key id {!r} for the database '{}'.".format(key_id, alias),
+                hint='Key ids are integers between 0 and {}.'.format(MAX_KEY_ID),
+                id='pgcrypto.E005',
+            )
+            for key_id in key_ids
+            if isinstance(key_id, bool) or not isinstance(key_id, int) or not (
+                0 <= key_id <= MAX_KEY_ID
+            )
+        )
+        if len(set(key_ids)) != len(key_ids):
+            errors.append(checks.Error(
+                "The keys of the database '{}' share a key id.".format(alias),
+                hint='Give each key of PGCRYPTO_KEY a new PGCRYPTO_KEY_ID.',
+                id='pgcrypto.E005',
+            ))
+    return errors
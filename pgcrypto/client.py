@@ -0,0 +1,201 @@
+"""OpenPGP and AES encryption in python compatible with the pgcrypto functions.
+
+Requires `pgpy` (`pip install django-pgcrypto-fields[client]`).
+"""
+import hashlib
+import hmac
+import os
+import re
+from datetime import date, time
+from decimal import Decimal
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+
+try:
+    import pgpy
+    from pgpy.constants import CompressionAlgorithm
+except ImportError:  # pragma: no cover
+    pgpy = None
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import algorithms, Cipher, modes
+except ImportError:  # pragma: no cover
+    Cipher = None
+
+AES_BLOCK_SIZE = 16
+
+
+def get_pgpy():
+    """Get the `pgpy` module or raise `ImproperlyConfigured` if it is missing."""
+    if pgpy is None:
+        raise ImproperlyConfigured(
+            '`pgpy` is required to encrypt or decrypt values in python. '
+            'Install it with `pip install django-pgcrypto-fields[client]`.'
+        )
+    return pgpy
+
+
+@lru_cache(maxsize=None)
+def load_key(armored_key):
+    """Get the `pgpy` key of an ASCII armored PGP key, once per process."""
+    key, _ = get_pgpy().PGPKey.from_blob(armored_key)
+    return key
+
+
+def to_text(value):
+    """Get the text of a value the way postgres casts it to `text`.
+
+    The text is cast back to the `cast_type` of the field when decrypted.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+def parse_bool(text):
+    """Get the boolean of a text the way postgres casts it to `BOOL`."""
+    return text.strip().lower() in ('t', 'true', 'y', 'yes', 'on', '1')
+
+
+CASTS = {
+    'TEXT': str,
+    'INT4': int,
+    'BIGINT': int,
+    'DOUBLE PRECISION': float,
+    'BOOL': parse_bool,
+    'DATE': parse_date,
+    'TIMESTAMPTZ': parse_datetime,
+    'TIME': parse_time,
+}
+NUMERIC_RE = re.compile(r'NUMERIC\((?P<max_digits>\d+), (?P<decimal_places>\d+)\)')
+
+
+def from_text(text, cast_type):
+    """Get the python value of a decrypted text cast to `cast_type` by postgres."""
+    if text is None:
+        return None
+
+    match = NUMERIC_RE.match(cast_type)
+    if match:
+        return Decimal(text).quantize(Decimal(10) ** -int(match['decimal_places']))
+    return CASTS[cast_type](text)
+
+
+def new_message(text):
+    """Get an uncompressed text message like the one built by pgcrypto."""
+    return get_pgpy().PGPMessage.new(
+        text.encode(),
+        format='t',
+        compression=CompressionAlgorithm.Uncompressed,
+    )
+
+
+def pgp_pub_encrypt(text, public_key):
+    """Encrypt `text` with an armored public key, readable by `pgp_pub_decrypt`."""
+    message = load_key(public_key).encrypt(new_message(text))
+    return bytes(message)
+
+
+def pgp_sym_encrypt(text, password):
+    """Encrypt `text` with a password, readable by `pgp_sym_decrypt`."""
+    message = new_message(text).encrypt(password)
+    return bytes(message)
+
+
+def get_text(message):
+    """Get the text of a decrypted message.
+
+    The contents of a text (`t`) literal packet are decoded as latin-1 by `pgpy`
+    while postgres stores them in the encoding of the database, UTF-8.
+    """
+    contents = message.message
+    if isinstance(contents, (bytes, bytearray)):
+        return bytes(contents).decode()
+    try:
+        return contents.encode('latin-1').decode()
+    except UnicodeError:
+        return contents
+
+
+def pgp_pub_decrypt(data, private_key):
+    """Decrypt the `bytea` of `pgp_pub_encrypt` with an armored private key."""
+    message = get_pgpy().PGPMessage.from_blob(bytes(data))
+    return get_text(load_key(private_key).decrypt(message))
+
+
+def pgp_sym_decrypt(data, password):
+    """Decrypt the `bytea` of `pgp_sym_encrypt` with a password."""
+    message = get_pgpy().PGPMessage.from_blob(bytes(data))
+    return get_text(message.decrypt(password))
+
+
+# Keys of a worker process by setting name, sent once by the initializer of its pool.
+worker_keys = {}
+
+
+def set_worker_keys(keys):
+    """Keep the keys sent to a worker process by the initializer of its pool."""
+    worker_keys.update(keys)
+
+
+def decrypt_many(decrypt, key, values):
+    """Decrypt each value with `decrypt` and `key`."""
+    return [None if value is None else decrypt(value, key) for value in values]
+
+
+def decrypt_many_in_worker(decrypt, key_setting, values):
+    """Decrypt each value with `decrypt` and the worker key of `key_setting`."""
+    return decrypt_many(decrypt, worker_keys[key_setting], values)
+
+
+def get_aes_cipher(key, iv):
+    """Get the AES-256-CBC cipher of `encrypt_iv` for the key of an AES field."""
+    if Cipher is None:
+        raise ImproperlyConfigured(
+            '`cryptography` is required to encrypt or decrypt values in python. '
+            'Install it with `pip install django-pgcrypto-fields[client]`.'
+        )
+
+    key = hashlib.sha256(key.encode()).digest()
+    return Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+
+
+def aes_encrypt(text, key, iv=None):
+    """Encrypt `text` as stored by the AES fields: the IV and the ciphertext.
+
+    A random IV is used unless one is given.
+    """
+    if iv is None:
+        iv = os.urandom(AES_BLOCK_SIZE)
+    encryptor = get_aes_cipher(key, iv).encryptor()
+    padder = padding.PKCS7(AES_BLOCK_SIZE * 8).padder()
+    data = padder.update(text.encode()) + padder.finalize()
+    return iv + encryptor.update(data) + encryptor.finalize()
+
+
+def aes_encrypt_deterministic(text, key):
+    """Encrypt `text` as stored by the deterministic AES fields.
+
+    The IV is the HMAC of the text like `pgcrypto_fields.aes_encrypt_deterministic`.
+    """
+    key_digest = hashlib.sha256(key.encode()).digest()
+    iv_key = hmac.new(key_digest, b'siv', hashlib.sha256).digest()
+    iv = hmac.new(iv_key, text.encode(), hashlib.sha256).digest()[:AES_BLOCK_SIZE]
+    return aes_encrypt(text, key, iv)
+
+
+def aes_decrypt(data, key):
+    """Decrypt the IV and the ciphertext stored by the AES fields."""
+    data = bytes(data)
+    decryptor = get_aes_cipher(key, data[:AES_BLOCK_SIZE]).decryptor()
+    padded = decryptor.update(data[AES_BLOCK_SIZE:]) + decryptor.finalize()
+    unpadder = padding.PKCS7(AES_BLOCK_SIZE * 8).unpadder()
+    return (unpadder.update(padded) + unpadder.finalize()).decode()
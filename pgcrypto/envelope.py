@@ -0,0 +1,70 @@
+from django.db import connections, DEFAULT_DB_ALIAS, transaction
+
+from pgcrypto import PGP_SYM_ENCRYPT_SQL_WITH_NULLIF
+
+
+def get_data_key_field(model):
+    """Get the `DataKeyField` of `model`, if any."""
+    for field in model._meta.local_concrete_fields:
+        if getattr(field, 'is_data_key', False):
+            return field
+    return None
+
+
+def wrap_data_keys(model, using=DEFAULT_DB_ALIAS, batch_size=1000, progress=None):
+    """Give a data key to the rows of `model` saved before its `DataKeyField`.
+
+    The public key fields of these rows are encrypted with the public key. The
+    rows are updated `batch_size` at a time, each batch by a single `UPDATE`
+    generating a data key for each row, decrypting the values with the private
+    key and encrypting them with the data key. `progress` is called with the model
+    and the number of rows of each batch.
+    """
+    data_key_field = get_data_key_field(model)
+    if data_key_field is None:
+        return
+
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    opts = model._meta
+    table = quote_name(opts.db_table)
+    pk = quote_name(opts.pk.column)
+    data_key = quote_name(data_key_field.column)
+
+    sql, key_params = data_key_field.get_encrypt_fragment(connection)
+    sets = ['{} = {}'.format(
+        data_key, sql % (('batch.data_key',) + ('%s',) * len(key_params))
+    )]
+    params = list(key_params)
+    for field in opts.local_concrete_fields:
+        if getattr(field, 'data_key_field', None) is not data_key_field:
+            continue
+        column = '{}.{}'.format(table, quote_name(field.column))
+        # The DataKeyField decrypts with the private key alone.
+        decrypt_sql = data_key_field.get_decrypt_sql(connection) % (column, 'TEXT')
+        encrypt_sql = PGP_SYM_ENCRYPT_SQL_WITH_NULLIF.format(
+            'batch.data_key' + field.get_options_sql(connection)
+        )
+        sets.append('{} = {}'.format(
+            quote_name(field.column), encrypt_sql % decrypt_sql
+        ))
+        params.extend(data_key_field.get_decrypt_params(connection))
+
+    sql = (
+        'WITH batch AS ('
+        "SELECT {pk}, encode(gen_random_bytes(32), 'hex') AS data_key FROM {table} "
+        'WHERE {data_key} IS NULL ORDER BY {pk} LIMIT %s) '
+        'UPDATE {table} SET {sets} FROM batch '
+        'WHERE {table}.{pk} = batch.{pk} AND {table}.{data_key} IS NULL '
+        'RETURNING {table}.{pk}'
+    ).format(pk=pk, table=table, data_key=data_key, sets=', '.join(sets))
+
+    while True:
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [batch_size] + params)
+                count = len(cursor.fetchall())
+        if not count:
+            return
+        if progress is not None:
+            progress(model, count)
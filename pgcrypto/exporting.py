@@ -0,0 +1,109 @@
+import queue
+import threading
+
+from django.db import connections
+
+from pgcrypto.binding import bind_keys_once
+
+# Formats of `COPY` the rows can be exported in.
+COPY_FORMATS = ('csv', 'text', 'binary')
+# Number of chunks read by `COPY` kept until they are consumed by `iter_export`.
+MAX_CHUNKS = 64
+
+
+def get_copy_sql(queryset, fields=None, format='csv', header=True):
+    """Get the `COPY ... TO STDOUT` of the decrypted values of a queryset.
+
+    The select is the one of `values_list(*fields)`, decrypting the encrypted
+    fields in postgres. `fields` are all the concrete fields by default.
+    """
+    if format not in COPY_FORMATS:
+        raise ValueError(
+            '`format` must be one of {}, not {!r}.'.format(
+                ', '.join(COPY_FORMATS), format
+            )
+        )
+
+    if not fields:
+        fields = [field.attname for field in queryset.model._meta.concrete_fields]
+    queryset = queryset.values_list(*fields)
+    connection = connections[queryset.db]
+    quote_name = connection.ops.quote_name
+
+    sql, params = bind_keys_once(*queryset.query.sql_with_params())
+    with connection.cursor() as cursor:
+        # `COPY` cannot have parameters so they are inlined, keys included.
+        select_sql = cursor.mogrify(sql, params).decode()
+
+    options = 'FORMAT {}'.format(format)
+    if header and format == 'csv':
+        options += ', HEADER'
+    return 'COPY (SELECT * FROM ({}) AS export ({})) TO STDOUT WITH ({})'.format(
+        select_sql, ', '.join(quote_name(name) for name in fields), options
+    )
+
+
+def export(queryset, file, fields=None, format='csv', header=True):
+    """Write the decrypted values of a queryset to `file` with `COPY`.
+
+    No model instances are created: postgres decrypts the rows and writes them
+    in `format` (`csv`, `text` or `binary`) to the file as they are read.
+    A `binary` export needs a file opened in binary mode.
+    """
+    sql = get_copy_sql(queryset, fields, format, header)
+    with connections[queryset.db].cursor() as cursor:
+        cursor.copy_expert(sql, file)
+
+
+class ChunkWriter:
+    """File-like object putting the chunks written by `COPY` in a queue."""
+
+    def __init__(self, chunks):
+        """Init the writer with the queue of the chunks."""
+        self.chunks = chunks
+
+    def write(self, data):
+        """Queue a chunk, waiting for room in the queue."""
+        self.chunks.put(bytes(data))
+
+
+def iter_export(queryset, fields=None, format='csv', header=True):
+    """Yield the decrypted values of a queryset exported with `COPY` as bytes.
+
+    Like `export` but `COPY` runs in a thread writing the chunks to a bounded
+    queue, so at most `MAX_CHUNKS` chunks are held in memory. Closing the
+    generator before the end cancels the `COPY`.
+    """
+    sql = get_copy_sql(queryset, fields, format, header)
+    connection = connections[queryset.db]
+    chunks = queue.Queue(maxsize=MAX_CHUNKS)
+    errors = []
+
+    # The cursor is created in this thread, Django connections can't be shared.
+    cursor = connection.cursor()
+
+    def copy():
+        try:
+            cursor.copy_expert(sql, ChunkWriter(chunks))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            chunks.put(None)
+
+    thread = threading.Thread(target=copy, daemon=True)
+    thread.start()
+    finished = False
+    try:
+        for chunk in iter(chunks.get, None):
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            connection.connection.cancel()
+            for _ in iter(chunks.get, None):
+                pass
+        thread.join()
+        cursor.close()
+
+    if errors:
+        raise errors[0]
@@ -1,41 +1,395 @@
+import hashlib
+import hmac
+import math
+import secrets
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core import checks
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
+from django.db.models import F
+from django.db.models.expressions import Col
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 from pgcrypto import (
+    BLIND_INDEX_SQL,
     DIGEST_SQL,
     HMAC_SQL,
     PGP_PUB_ENCRYPT_SQL_WITH_NULLIF,
     PGP_SYM_ENCRYPT_SQL_WITH_NULLIF,
 )
 from pgcrypto.lookups import (
+    BlindIndexExact,
+    BlindIndexIExact,
+    BlindIndexIn,
+    BucketIndexRange,
+    DeterministicExact,
+    DeterministicIn,
+    HashInLookup,
     HashLookup,
+    NgramIndexContains,
+    NgramIndexIContains,
+    NgramIndexIStartsWith,
+    NgramIndexStartsWith,
 )
 from pgcrypto.mixins import (
+    AESFieldMixin,
     DecimalPGPFieldMixin,
+    DeterministicAESFieldMixin,
+    EncryptedValue,
     get_setting,
     HashMixin,
     PGPPublicKeyFieldMixin,
     PGPSymmetricKeyFieldMixin,
+    RecordPGPFieldMixin,
 )
 
 
+def to_bytea_text(value):
+    """Get the text representation of `bytea` used by postgres."""
+    return '\\x' + value.hex()
+
+
 class TextDigestField(HashMixin, models.TextField):
     """Text digest field for postgres."""
     encrypt_sql = DIGEST_SQL
 
-    def get_encrypt_sql(self, connection):
-        """Get encrypt sql."""
-        return self.encrypt_sql.format(get_setting(connection, 'PGCRYPTO_KEY'))
+    def get_hash(self, value, connection):
+        """Get the sha512 digest of `value` like `digest()`."""
+        value = self.get_db_prep_value(value, connection)
+        return to_bytea_text(hashlib.sha512(value.encode()).digest())
 
 
 TextDigestField.register_lookup(HashLookup)
+TextDigestField.register_lookup(HashInLookup)
 
 
 class TextHMACField(HashMixin, models.TextField):
     """Text HMAC field for postgres."""
     encrypt_sql = HMAC_SQL
 
+    def get_hmac_key(self, connection):
+        """Get the key of the HMAC.
+
+        The HMACs were keyed with the literal `'{}'` before `PGCRYPTO_LEGACY_HMAC_KEY`
+        existed, which is kept by default so the saved HMACs still match.
+        """
+        if get_setting(connection, 'PGCRYPTO_LEGACY_HMAC_KEY', True):
+            return '{}'
+        return get_setting(connection, 'PGCRYPTO_KEY')
+
+    def get_encrypt_sql(self, connection):
+        """Get encrypt sql."""
+        return self.encrypt_sql.format(self.get_hmac_key(connection))
+
+    def get_hash(self, value, connection):
+        """Get the sha512 HMAC of `value` like `hmac()`."""
+        value = self.get_db_prep_value(value, connection)
+        key = self.get_hmac_key(connection)
+        return to_bytea_text(hmac.new(key.encode(), value.encode(), 'sha512').digest())
+
 
 TextHMACField.register_lookup(HashLookup)
+TextHMACField.register_lookup(HashInLookup)
+
+
+class BlindIndexField(HashMixin, models.TextField):
+    """Blind index of a PGP text field for postgres.
+
+    Keyed hash of the trimmed and lower case value of the `original` field, used by
+    the `exact`, `iexact` and `in` lookups of the PGP text field.
+    """
+    encrypt_sql = BLIND_INDEX_SQL
+    is_blind_index = True
+
+    def __init__(self, original=None, *args, **kwargs):
+        """Index the blind index and keep it out of forms by default."""
+        kwargs.setdefault('db_index', True)
+        kwargs.setdefault('editable', False)
+
+        super(BlindIndexField, self).__init__(original, *args, **kwargs)
+
+    def get_encrypt_sql(self, connection):
+        """Get encrypt sql."""
+        return self.encrypt_sql.format(get_setting(connection, 'PGCRYPTO_KEY'))
+
+    def get_hash(self, value, connection):
+        """Get the sha256 HMAC of the trimmed and lower case `value`.
+
+        `str.lower()` can lower non-ASCII letters unlike the `lower()` of postgres,
+        depending on the collation of the database.
+        """
+        value = self.get_db_prep_value(value, connection).strip(' ').lower()
+        key = get_setting(connection, 'PGCRYPTO_KEY')
+        return to_bytea_text(hmac.new(key.encode(), value.encode(), 'sha256').digest())
+
+    def check(self, **kwargs):
+        """Check the lookups of the original field can use the blind index."""
+        return [
+            *super(BlindIndexField, self).check(**kwargs),
+            *self._check_original(),
+        ]
+
+    def _check_original(self):
+        original = self.original_field
+        if original is None or isinstance(original, TEXT_FIELDS):
+            return []
+
+        return [
+            checks.Warning(
+                "'{}' isn't used by the lookups of '{}'.".format(
+                    self.name, self.original
+                ),
+                hint=(
+                    'Only the lookups of the text PGP and AES fields use a blind index, '
+                    'other values have many texts (e.g. 1.0 and 1.00).'
+                ),
+                obj=self,
+                id='pgcrypto.W003',
+            )
+        ]
+
+    @cached_property
+    def original_field(self):
+        """Get the field of the model indexed by this field."""
+        try:
+            return self.model._meta.get_field(self.original)
+        except FieldDoesNotExist:
+            return None
+
+
+class BucketIndexField(BlindIndexField):
+    """Bucket index of a PGP date, datetime or number field for postgres.
+
+    Keyed hash of the bucket of the value of the `original` field, used by the
+    `range` lookup of the PGP field. `width` is `'day'`, `'week'`, `'month'` or
+    `'year'` for dates and datetimes (in UTC) and a number for numbers.
+    """
+    is_blind_index = False
+    is_bucket_index = True
+    date_widths = ('day', 'week', 'month', 'year')
+    # A range covering more buckets than this only decrypts every row.
+    max_buckets = 1000
+
+    def __init__(self, original=None, *args, width=None, **kwargs):
+        """Init the width of the buckets."""
+        self.width = width
+
+        super(BucketIndexField, self).__init__(original, *args, **kwargs)
+
+    def deconstruct(self):
+        """Add `width` to the field arguments."""
+        name, path, args, kwargs = super(BucketIndexField, self).deconstruct()
+        kwargs['width'] = self.width
+        return name, path, args, kwargs
+
+    def check(self, **kwargs):
+        """Check the width suits the original field."""
+        return [
+            *super(BucketIndexField, self).check(**kwargs),
+            *self._check_width(),
+        ]
+
+    def _check_original(self):
+        return []
+
+    def _check_width(self):
+        original = self.original_field
+        if original is None:
+            return []
+
+        if isinstance(original, models.DateField):
+            if self.width in self.date_widths:
+                return []
+            expected = 'one of {}'.format(', '.join(map(repr, self.date_widths)))
+        else:
+            is_number = isinstance(self.width, (int, float, Decimal))
+            if is_number and not isinstance(self.width, bool) and self.width > 0:
+                return []
+            expected = 'a positive number'
+
+        return [
+            checks.Error(
+                "'width' of '{}' must be {}.".format(self.name, expected),
+                obj=self,
+                id='pgcrypto.E004',
+            )
+        ]
+
+    def pre_save(self, model_instance, add):
+        """Save the bucket of the original value."""
+        value = self.from_original(getattr(model_instance, self.original))
+        setattr(model_instance, self.attname, value)
+        return value
+
+    def from_original(self, value):
+        """Get the bucket of a value of the `original` field."""
+        return self.get_bucket(value)
+
+    def to_bucket(self, value):
+        """Get the start of the bucket of a date or the number of a number bucket."""
+        if not isinstance(value, date):
+            return math.floor(Decimal(str(value)) / Decimal(str(self.width)))
+
+        if isinstance(value, datetime):
+            # Naive datetimes are in the current time zone, like when they are saved.
+            if settings.USE_TZ and timezone.is_naive(value):
+                value = timezone.make_aware(value, timezone.get_current_timezone())
+            if timezone.is_aware(value):
+                value = value.astimezone(timezone.utc)
+            value = value.date()
+        if self.width == 'week':
+            return value - timedelta(days=value.weekday())
+        if self.width == 'month':
+            return value.replace(day=1)
+        if self.width == 'year':
+            return value.replace(month=1, day=1)
+        return value
+
+    def next_bucket(self, bucket):
+        """Get the bucket following `bucket`."""
+        if not isinstance(bucket, date):
+            return bucket + 1
+        if self.width == 'week':
+            return bucket + timedelta(days=7)
+        if self.width == 'month':
+            return (bucket + timedelta(days=31)).replace(day=1)
+        if self.width == 'year':
+            return bucket.replace(year=bucket.year + 1)
+        return bucket + timedelta(days=1)
+
+    def get_bucket(self, value):
+        """Get the text of the bucket of a value of the original field."""
+        value = self.original_field.to_python(value)
+        if value is None:
+            return None
+        return str(self.to_bucket(value))
+
+    def get_buckets(self, start, end):
+        """Get the text of the buckets from `start` to `end` included.
+
+        `None` is returned when there are more than `max_buckets`.
+        """
+        bucket = self.to_bucket(self.original_field.to_python(start))
+        last = self.to_bucket(self.original_field.to_python(end))
+        buckets = []
+        while bucket <= last:
+            if len(buckets) == self.max_buckets:
+                return None
+            buckets.append(str(bucket))
+            bucket = self.next_bucket(bucket)
+        return buckets
+
+
+class NgramIndexField(ArrayField):
+    """N-gram index of a PGP text field for postgres.
+
+    Array of keyed hashes of the n-grams of the lower case value of the `original`
+    field, used by the `contains`, `icontains`, `startswith` and `istartswith`
+    lookups of the PGP field. Index it with a `GinIndex`.
+    """
+    is_ngram_index = True
+    # Marks the start of the value so prefixes have their own n-grams.
+    start_marker = '\x02'
+    # Length of the hex HMAC kept for each n-gram.
+    token_length = 16
+
+    def __init__(self, original=None, *args, n=3, **kwargs):
+        """Init the length of the n-grams and keep the index out of forms."""
+        self.original = original
+        self.n = n
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('default', list)
+        kwargs.pop('base_field', None)
+
+        super(NgramIndexField, self).__init__(models.TextField(), *args, **kwargs)
+
+    def deconstruct(self):
+        """Replace `base_field` with `n` in the field arguments."""
+        name, path, args, kwargs = super(NgramIndexField, self).deconstruct()
+        del kwargs['base_field']
+        kwargs['n'] = self.n
+        return name, path, args, kwargs
+
+    def get_ngrams(self, value, prefix=True):
+        """Get the distinct n-grams of the lower case `value`.
+
+        The n-grams of a prefix start with `start_marker`.
+        """
+        text = value.lower()
+        if prefix:
+            text = self.start_marker + text
+        ngrams = {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+        return sorted(ngrams)
+
+    def pre_save(self, model_instance, add):
+        """Save the n-grams of the original value."""
+        ngrams = self.from_original(getattr(model_instance, self.original))
+        setattr(model_instance, self.attname, ngrams)
+        return ngrams
+
+    def from_original(self, value):
+        """Get the n-grams of a value of the `original` field."""
+        return [] if value is None else self.get_ngrams(str(value))
+
+    def get_db_prep_save(self, value, connection):
+        """Hash each n-gram with `PGCRYPTO_KEY`."""
+        if value is None:
+            return None
+
+        key = get_setting(connection, 'PGCRYPTO_KEY').encode()
+        return [
+            hmac.new(key, ngram.encode(), 'sha256').hexdigest()[:self.token_length]
+            for ngram in value
+        ]
+
+
+class DataKeyField(PGPPublicKeyFieldMixin, models.TextField):
+    """Data key of the envelope encryption of the public key fields of a model.
+
+    A random key is generated for each row and encrypted with the public key.
+    The other public key fields of the model are encrypted with this key so a
+    row needs one public key decryption instead of one for each field.
+    """
+    is_data_key = True
+
+    def __init__(self, *args, **kwargs):
+        """Keep the data key out of forms by default."""
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('null', True)
+
+        super(DataKeyField, self).__init__(*args, **kwargs)
+
+    def get_data_key(self, model_instance, add):
+        """Get the data key of the instance, generating one for a new row.
+
+        The data key of a saved row is only known in postgres.
+        """
+        data_key = model_instance.__dict__.get('_pgcrypto_data_key')
+        if data_key is None and add:
+            data_key = secrets.token_hex(32)
+            model_instance.__dict__['_pgcrypto_data_key'] = data_key
+        return data_key
+
+    def pre_save(self, model_instance, add):
+        """Encrypt the data key of a new row and keep the one of a saved row."""
+        if not add:
+            return F(self.attname)
+        return EncryptedValue(self.get_data_key(model_instance, add), self)
+
+    def get_placeholder(self, value=None, compiler=None, connection=None):
+        """Keep the column as it is when the data key of a saved row is kept."""
+        if hasattr(value, 'as_sql'):
+            return '%s'
+        return super(DataKeyField, self).get_placeholder(value, compiler, connection)
+
+    def get_col(self, alias, output_field=None):
+        """Get the encrypted data key, decrypted by the fields using it."""
+        return Col(alias, self, output_field)
 
 
 class EmailPGPPublicKeyField(PGPPublicKeyFieldMixin, models.EmailField):
@@ -154,3 +508,170 @@ class TimePGPSymmetricKeyField(PGPSymmetricKeyFieldMixin, models.TimeField):
     """Float PGP symmetric key encrypted field for postgres."""
     encrypt_sql = PGP_SYM_ENCRYPT_SQL_WITH_NULLIF
     cast_type = 'TIME'
+
+
+class RecordPGPPublicKeyField(RecordPGPFieldMixin,
+                              PGPPublicKeyFieldMixin, models.TextField):
+    """Record PGP public key encrypted field for postgres."""
+
+
+class RecordPGPSymmetricKeyField(RecordPGPFieldMixin,
+                                 PGPSymmetricKeyFieldMixin, models.TextField):
+    """Record PGP symmetric key encrypted field for postgres."""
+
+
+class EmailAESField(AESFieldMixin, models.EmailField):
+    """Email AES encrypted field for postgres."""
+
+
+class IntegerAESField(AESFieldMixin, models.IntegerField):
+    """Integer AES encrypted field for postgres."""
+    cast_type = 'INT4'
+
+
+class BigIntegerAESField(AESFieldMixin, models.IntegerField):
+    """BigInteger AES encrypted field for postgres."""
+    cast_type = 'BIGINT'
+
+
+class TextAESField(AESFieldMixin, models.TextField):
+    """Text AES encrypted field for postgres."""
+
+
+class CharAESField(AESFieldMixin, models.CharField):
+    """Char AES encrypted field for postgres."""
+
+
+class DateAESField(AESFieldMixin, models.DateField):
+    """Date AES encrypted field for postgres."""
+    cast_type = 'DATE'
+
+
+class DateTimeAESField(AESFieldMixin, models.DateTimeField):
+    """DateTime AES encrypted field for postgres."""
+    cast_type = 'TIMESTAMPTZ'
+
+
+class BooleanAESField(AESFieldMixin, models.BooleanField):
+    """Boolean AES encrypted field for postgres."""
+    cast_type = 'BOOL'
+
+
+class DecimalAESField(DecimalPGPFieldMixin, AESFieldMixin, models.DecimalField):
+    """Decimal AES encrypted field for postgres."""
+
+
+class FloatAESField(AESFieldMixin, models.FloatField):
+    """Float AES encrypted field for postgres."""
+    cast_type = 'DOUBLE PRECISION'
+
+
+class TimeAESField(AESFieldMixin, models.TimeField):
+    """Time AES encrypted field for postgres."""
+    cast_type = 'TIME'
+
+
+class EmailDeterministicAESField(DeterministicAESFieldMixin, models.EmailField):
+    """Email deterministic AES encrypted field for postgres."""
+
+
+class IntegerDeterministicAESField(DeterministicAESFieldMixin, models.IntegerField):
+    """Integer deterministic AES encrypted field for postgres."""
+    cast_type = 'INT4'
+
+
+class BigIntegerDeterministicAESField(DeterministicAESFieldMixin,
+                                      models.IntegerField):
+    """BigInteger deterministic AES encrypted field for postgres."""
+    cast_type = 'BIGINT'
+
+
+class TextDeterministicAESField(DeterministicAESFieldMixin, models.TextField):
+    """Text deterministic AES encrypted field for postgres."""
+
+
+class CharDeterministicAESField(DeterministicAESFieldMixin, models.CharField):
+    """Char deterministic AES encrypted field for postgres."""
+
+
+class DateDeterministicAESField(DeterministicAESFieldMixin, models.DateField):
+    """Date deterministic AES encrypted field for postgres."""
+    cast_type = 'DATE'
+
+
+PGP_FIELDS = (
+    EmailPGPPublicKeyField,
+    IntegerPGPPublicKeyField,
+    BigIntegerPGPPublicKeyField,
+    TextPGPPublicKeyField,
+    CharPGPPublicKeyField,
+    DatePGPPublicKeyField,
+    DateTimePGPPublicKeyField,
+    BooleanPGPPublicKeyField,
+    DecimalPGPPublicKeyField,
+    FloatPGPPublicKeyField,
+    TimePGPPublicKeyField,
+    EmailPGPSymmetricKeyField,
+    IntegerPGPSymmetricKeyField,
+    BigIntegerPGPSymmetricKeyField,
+    TextPGPSymmetricKeyField,
+    CharPGPSymmetricKeyField,
+    DatePGPSymmetricKeyField,
+    DateTimePGPSymmetricKeyField,
+    BooleanPGPSymmetricKeyField,
+    DecimalPGPSymmetricKeyField,
+    FloatPGPSymmetricKeyField,
+    TimePGPSymmetricKeyField,
+)
+
+AES_FIELDS = (
+    EmailAESField,
+    IntegerAESField,
+    BigIntegerAESField,
+    TextAESField,
+    CharAESField,
+    DateAESField,
+    DateTimeAESField,
+    BooleanAESField,
+    DecimalAESField,
+    FloatAESField,
+    TimeAESField,
+)
+
+TEXT_FIELDS = (
+    EmailPGPPublicKeyField,
+    TextPGPPublicKeyField,
+    CharPGPPublicKeyField,
+    EmailPGPSymmetricKeyField,
+    TextPGPSymmetricKeyField,
+    CharPGPSymmetricKeyField,
+    EmailAESField,
+    TextAESField,
+    CharAESField,
+)
+
+DETERMINISTIC_AES_FIELDS = (
+    EmailDeterministicAESField,
+    IntegerDeterministicAESField,
+    BigIntegerDeterministicAESField,
+    TextDeterministicAESField,
+    CharDeterministicAESField,
+    DateDeterministicAESField,
+)
+
+for pgp_field in PGP_FIELDS + AES_FIELDS:
+    pgp_field.register_lookup(BucketIndexRange)
+
+# Other values have many texts (e.g. 1.0 and 1.00) which don't have the same hash.
+for text_field in TEXT_FIELDS:
+    text_field.register_lookup(BlindIndexExact)
+    text_field.register_lookup(BlindIndexIExact)
+    text_field.register_lookup(BlindIndexIn)
+    text_field.register_lookup(NgramIndexContains)
+    text_field.register_lookup(NgramIndexIContains)
+    text_field.register_lookup(NgramIndexStartsWith)
+    text_field.register_lookup(NgramIndexIStartsWith)
+
+for deterministic_field in DETERMINISTIC_AES_FIELDS:
+    deterministic_field.register_lookup(DeterministicExact)
+    deterministic_field.register_lookup(DeterministicIn)
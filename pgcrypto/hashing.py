@@ -0,0 +1,49 @@
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+
+from pgcrypto.mixins import HashMixin, HashOf
+
+
+def get_recomputed_fields(model):
+    """Get the hash fields of `model` computed from their `original` text field.
+
+    The bucket indexes are left out, their bucket is computed in python. So are the
+    hashes of other values, saved with the text of their python value (e.g. `True`)
+    which isn't the text of the value in postgres (e.g. `true`).
+    """
+    return [
+        field for field in model._meta.local_concrete_fields
+        if isinstance(field, HashMixin) and field.original and (
+            not getattr(field, 'is_bucket_index', False)
+        ) and isinstance(
+            model._meta.get_field(field.original), (models.CharField, models.TextField)
+        )
+    ]
+
+
+def recompute_hashes(model, using=DEFAULT_DB_ALIAS, batch_size=1000, progress=None):
+    """Compute the hash fields of `model` again from their `original` field.
+
+    The rows are updated `batch_size` at a time ordered by primary key, each batch
+    by a single `UPDATE` decrypting and hashing the values in postgres, so the
+    hashes left stale by `QuerySet.update()`, `bulk_create()` or a key change are
+    fixed without loading the instances. `progress` is called with the model and
+    the number of rows of each batch.
+    """
+    fields = get_recomputed_fields(model)
+    if not fields:
+        return
+
+    queryset = model._base_manager.using(using).order_by('pk')
+    values = {field.name: HashOf(field.original, field) for field in fields}
+    after = None
+    while True:
+        batch = queryset if after is None else queryset.filter(pk__gt=after)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+
+        with transaction.atomic(using=using):
+            queryset.filter(pk__in=pks).update(**values)
+        after = pks[-1]
+        if progress is not None:
+            progress(model, len(pks))
@@ -0,0 +1,174 @@
+import io
+import json
+from itertools import islice
+
+from django.db import connections, router, transaction
+
+from pgcrypto import client, PGP_SYM_ENCRYPT_SQL_WITH_NULLIF
+from pgcrypto.mixins import EncryptedValue, HashMixin, PGPMixin
+
+# Name of the temporary table the rows are copied to, formatted with the table.
+STAGING_TABLE = 'pgcrypto_load_{}'
+
+
+def escape_copy_text(text):
+    """Escape a value for the text format of `COPY`."""
+    return (
+        text.replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def to_array_text(values):
+    """Get the text of a postgres array of values."""
+    items = [
+        'NULL' if value is None else '"{}"'.format(
+            client.to_text(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for value in values
+    ]
+    return '{' + ','.join(items) + '}'
+
+
+def to_copy_text(value):
+    """Get the text format of `COPY` of a value prepared for the database."""
+    value = getattr(value, 'adapted', value)
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        text = '\\x' + bytes(value).hex()
+    elif isinstance(value, (list, tuple)):
+        text = to_array_text(value)
+    elif isinstance(value, dict):
+        text = json.dumps(value)
+    else:
+        text = client.to_text(value)
+    return escape_copy_text(text)
+
+
+class Loader:
+    """Copy rows of a model to a staging table and insert them encrypted.
+
+    The values are copied as plain text and the encrypt and hash sql of the fields
+    is applied by a single `INSERT ... SELECT` for each batch.
+    """
+
+    def __init__(self, model, using):
+        """Init the loader of `model` for the database `using`."""
+        self.model = model
+        self.connection = connections[using]
+        opts = model._meta
+        self.fields = [
+            field for field in opts.concrete_fields if field is not opts.auto_field
+        ]
+
+        quote_name = self.connection.ops.quote_name
+        self.table = quote_name(opts.db_table)
+        self.staging_table = quote_name(STAGING_TABLE.format(opts.db_table))
+        self.columns = ', '.join(quote_name(field.column) for field in self.fields)
+
+    def get_select_sql(self, field):
+        """Get the sql inserting the staged column of `field`, and its params."""
+        quote_name = self.connection.ops.quote_name
+        column = quote_name(field.column)
+
+        if isinstance(field, PGPMixin):
+            if field.data_key_field is not None:
+                # The staged data key is the plain text one of the row.
+                data_key = quote_name(field.data_key_field.column)
+                options_sql = field.get_options_sql(self.connection)
+                sql = PGP_SYM_ENCRYPT_SQL_WITH_NULLIF.format(data_key + options_sql)
+                return sql % column, []
+            sql, key_params = field.get_encrypt_fragment(self.connection)
+            return sql % ((column,) + ('%s',) * len(key_params)), list(key_params)
+
+        if isinstance(field, HashMixin) and not field.hash_in_python(self.connection):
+            return field.get_encrypt_sql(self.connection) % column, []
+
+        return '{}::{}'.format(column, field.cast_db_type(self.connection)), []
+
+    def get_insert_sql(self):
+        """Get the `INSERT ... SELECT` of the staged rows and its params."""
+        selects, params = [], []
+        for field in self.fields:
+            sql, field_params = self.get_select_sql(field)
+            selects.append(sql)
+            params.extend(field_params)
+
+        sql = 'INSERT INTO {} ({}) SELECT {} FROM {}'.format(
+            self.table, self.columns, ', '.join(selects), self.staging_table
+        )
+        return sql, params
+
+    def get_values(self, obj):
+        """Get the values of an instance to copy, as stored before encryption."""
+        values = []
+        for field in self.fields:
+            value = field.pre_save(obj, True)
+            if isinstance(value, EncryptedValue):
+                value = value.value
+            value = field.get_db_prep_save(value, connection=self.connection)
+            if isinstance(field, PGPMixin):
+                value = client.to_text(value)
+            values.append(value)
+        return values
+
+    def copy(self, cursor, objs):
+        """Copy the rows of a batch of instances to the staging table."""
+        buffer = io.StringIO()
+        for obj in objs:
+            values = self.get_values(obj)
+            buffer.write('\t'.join(to_copy_text(value) for value in values) + '\n')
+        buffer.seek(0)
+
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN'.format(self.staging_table, self.columns), buffer
+        )
+
+    def load(self, rows, batch_size, progress=None):
+        """Load the rows `batch_size` at a time and return their number."""
+        rows = iter(rows)
+        insert_sql, insert_params = self.get_insert_sql()
+        columns_sql = ', '.join(
+            '{} text'.format(self.connection.ops.quote_name(field.column))
+            for field in self.fields
+        )
+
+        count = 0
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE {} ({})'.format(self.staging_table, columns_sql)
+            )
+            while True:
+                objs = [
+                    row if isinstance(row, self.model) else self.model(**row)
+                    for row in islice(rows, batch_size)
+                ]
+                if not objs:
+                    break
+
+                self.copy(cursor, objs)
+                cursor.execute(insert_sql, insert_params)
+                cursor.execute('TRUNCATE {}'.format(self.staging_table))
+                count += len(objs)
+                if progress is not None:
+                    progress(count)
+            cursor.execute('DROP TABLE {}'.format(self.staging_table))
+        return count
+
+
+def bulk_load(model, rows, batch_size=10000, using=None, progress=None):
+    """Insert many rows of `model` with `COPY`, encrypting them in postgres.
+
+    `rows` are model instances or dicts of field values, consumed `batch_size` at
+    a time. `progress` is called with the number of rows loaded after each batch.
+    All the rows are loaded in one transaction. Signals aren't sent and the
+    primary keys of the instances aren't set, like `bulk_create`.
+    """
+    if using is None:
+        using = router.db_for_write(model)
+
+    with transaction.atomic(using=using, savepoint=False):
+        return Loader(model, using).load(rows, batch_size, progress)
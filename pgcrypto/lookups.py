@@ -1,4 +1,17 @@
-from django.db.models.lookups import Lookup
+from django.core.exceptions import EmptyResultSet
+from django.db.models.expressions import Col
+from django.db.models.lookups import (
+    Contains,
+    Exact,
+    FieldGetDbPrepValueIterableMixin,
+    IContains,
+    IExact,
+    In,
+    IStartsWith,
+    Lookup,
+    Range,
+    StartsWith,
+)
 
 
 class HashLookup(Lookup):
@@ -6,6 +19,9 @@ class HashLookup(Lookup):
 
     `HashLookup` is hashing the value on the right hand side with
     the function specified in `encrypt_sql`.
+
+    The hash is cast to text, the way it is stored, so an index on the column
+    can be used.
     """
     lookup_name = 'hash_of'
 
@@ -16,7 +32,268 @@ class HashLookup(Lookup):
         to a hash.
         """
         lhs, lhs_params = self.process_lhs(qn, connection)
+        field = self.lhs.output_field
+        if field.hash_in_python(connection) and not hasattr(self.rhs, 'as_sql'):
+            rhs_params = [field.get_hash(self.rhs, connection)]
+            return '{} = %s'.format(lhs), lhs_params + rhs_params
+
         rhs, rhs_params = self.process_rhs(qn, connection)
         params = lhs_params + rhs_params
-        rhs = self.lhs.field.encrypt_sql % rhs
-        return ('{}::bytea = {}'.format(lhs, rhs)), params
+        rhs = field.get_encrypt_sql(connection) % rhs
+        return ('{} = ({})::text'.format(lhs, rhs)), params
+
+
+class HashInLookup(FieldGetDbPrepValueIterableMixin, Lookup):
+    """Lookup to filter hashed values against a list of values.
+
+    `HashInLookup` hashes each distinct value on the right hand side once with
+    the function specified in `encrypt_sql` and compares the column with all the
+    hashes at once. Hashed in postgres, the values are split in arrays of at most
+    `chunk_size` hashes.
+    """
+    lookup_name = 'hash_of_in'
+    chunk_size = 1000
+
+    def as_sql(self, qn, connection):
+        """Compare the column with an array of hashes."""
+        lhs, lhs_params = self.process_lhs(qn, connection)
+        values = list(dict.fromkeys(value for value in self.rhs if value is not None))
+        if not values:
+            raise EmptyResultSet
+
+        field = self.lhs.output_field
+        if field.hash_in_python(connection):
+            hashes = [field.get_hash(value, connection) for value in values]
+            return '{} = ANY(%s)'.format(lhs), lhs_params + [hashes]
+
+        encrypt_sql = field.get_encrypt_sql(connection)
+        conditions, params = [], []
+        for offset in range(0, len(values), self.chunk_size):
+            chunk = values[offset:offset + self.chunk_size]
+            sqls, rhs_params = self.batch_process_rhs(qn, connection, chunk)
+            hashes = ', '.join('({})::text'.format(encrypt_sql % sql) for sql in sqls)
+            conditions.append('{} = ANY(ARRAY[{}])'.format(lhs, hashes))
+            params.extend([*lhs_params, *rhs_params])
+        if len(conditions) == 1:
+            return conditions[0], params
+        return '({})'.format(' OR '.join(conditions)), params
+
+
+def or_index_is_null(index, index_sql, index_params, sql, params):
+    """Keep the rows whose nullable index isn't computed yet, e.g. saved before it.
+
+    Returns the sql of the condition `sql` on the index and its params.
+    """
+    if not index.null:
+        return sql, list(params)
+    sql = '({} OR {} IS NULL)'.format(sql, index_sql)
+    return sql, [*params, *index_params]
+
+
+def get_index_sql(qn, connection, index, alias, values):
+    """Get the sql comparing a hash index with the hash of each value."""
+    index_sql, index_params = qn.compile(index.get_col(alias))
+    values = [index.get_db_prep_value(value, connection) for value in values]
+    if index.hash_in_python(connection):
+        values = [index.get_hash(value, connection) for value in values]
+        hash_sql = '%s'
+    else:
+        hash_sql = '({})::text'.format(index.get_encrypt_sql(connection))
+    sql = '{} IN ({})'.format(index_sql, ', '.join([hash_sql] * len(values)))
+    return or_index_is_null(
+        index, index_sql, index_params, sql, [*index_params, *values]
+    )
+
+
+class BlindIndexLookupMixin:
+    """Filter on the blind index of an encrypted field before decrypting it.
+
+    When the model has a `BlindIndexField` for the field, the indexed hash of each
+    value is compared first so only matching rows are decrypted to check the
+    lookup itself.
+    """
+
+    def get_blind_index_values(self):
+        """Get the values to hash for the blind index."""
+        return [self.rhs]
+
+    def as_sql(self, qn, connection):
+        """Prepend the comparison with the blind index to the lookup."""
+        sql, params = super().as_sql(qn, connection)
+
+        target = getattr(self.lhs, 'target', None)
+        blind_index = getattr(target, 'blind_index_field', None)
+        if blind_index is None or hasattr(self.rhs, 'resolve_expression'):
+            return sql, params
+
+        index_sql, index_params = get_index_sql(
+            qn, connection, blind_index, self.lhs.alias, self.get_blind_index_values()
+        )
+        return '{} AND {}'.format(index_sql, sql), index_params + params
+
+
+class BlindIndexExact(BlindIndexLookupMixin, Exact):
+    """`exact` lookup using the blind index of the field."""
+
+
+class BlindIndexIExact(BlindIndexLookupMixin, IExact):
+    """`iexact` lookup using the blind index of the field."""
+
+
+class BlindIndexIn(BlindIndexLookupMixin, In):
+    """`in` lookup using the blind index of the field."""
+
+    def get_blind_index_values(self):
+        """Get the values to hash for the blind index."""
+        return [value for value in self.rhs if value is not None]
+
+
+class BucketIndexRange(Range):
+    """`range` lookup using the bucket index of the field.
+
+    When the model has a `BucketIndexField` for the field, the rows of the buckets
+    covering the range are selected with the index first and only those rows are
+    decrypted to check the range itself.
+    """
+
+    def as_sql(self, qn, connection):
+        """Prepend the comparison with the bucket index to the lookup."""
+        sql, params = super().as_sql(qn, connection)
+
+        target = getattr(self.lhs, 'target', None)
+        bucket_index = getattr(target, 'bucket_index_field', None)
+        if bucket_index is None or not self.rhs_is_direct_value() or any(
+            value is None or hasattr(value, 'resolve_expression') for value in self.rhs
+        ):
+            return sql, params
+
+        buckets = bucket_index.get_buckets(*self.rhs)
+        if buckets is None:
+            return sql, params
+        if not buckets:
+            raise EmptyResultSet
+
+        index_sql, index_params = get_index_sql(
+            qn, connection, bucket_index, self.lhs.alias, buckets
+        )
+        return '{} AND {}'.format(index_sql, sql), index_params + list(params)
+
+
+class NgramIndexLookupMixin:
+    """Filter on the n-gram index of an encrypted field before decrypting it.
+
+    When the model has a `NgramIndexField` for the field, the rows whose index
+    contains all the n-grams of the value are selected first and only those rows
+    are decrypted to check the lookup itself.
+    """
+    prefix = False
+
+    def as_sql(self, qn, connection):
+        """Prepend the comparison with the n-gram index to the lookup."""
+        sql, params = super().as_sql(qn, connection)
+
+        target = getattr(self.lhs, 'target', None)
+        ngram_index = getattr(target, 'ngram_index_field', None)
+        if ngram_index is None or not isinstance(self.rhs, str):
+            return sql, params
+
+        ngrams = ngram_index.get_ngrams(self.rhs, prefix=self.prefix)
+        if not ngrams:
+            return sql, params
+
+        index_sql, index_params = qn.compile(ngram_index.get_col(self.lhs.alias))
+        tokens = ngram_index.get_db_prep_save(ngrams, connection)
+        index_sql, index_params = or_index_is_null(
+            ngram_index, index_sql, index_params,
+            '{} @> %s::text[]'.format(index_sql), [*index_params, tokens],
+        )
+        return '{} AND {}'.format(index_sql, sql), index_params + list(params)
+
+
+class NgramIndexContains(NgramIndexLookupMixin, Contains):
+    """`contains` lookup using the n-gram index of the field."""
+
+
+class NgramIndexIContains(NgramIndexLookupMixin, IContains):
+    """`icontains` lookup using the n-gram index of the field."""
+
+
+class NgramIndexStartsWith(NgramIndexLookupMixin, StartsWith):
+    """`startswith` lookup using the n-gram index of the field."""
+    prefix = True
+
+
+class NgramIndexIStartsWith(NgramIndexLookupMixin, IStartsWith):
+    """`istartswith` lookup using the n-gram index of the field."""
+    prefix = True
+
+
+class DeterministicLookupMixin:
+    """Compare the stored bytes of a deterministic field instead of decrypting it.
+
+    Equal values have equal ciphertexts so the values on the right hand side are
+    encrypted and compared with the column, which can use an index.
+    """
+
+    def get_ciphertext_col(self, expression):
+        """Get the column of a deterministic field without decryption, if any."""
+        target = getattr(expression, 'target', None)
+        if not getattr(target, 'deterministic', False):
+            return None
+        return Col(expression.alias, target)
+
+    def encrypt_rhs(self, value, connection):
+        """Get the encryption of a value of the right hand side."""
+        field = self.lhs.target
+        if field.encrypt_in_python(connection):
+            return '%s', [field.get_ciphertext(value, connection)]
+
+        sql, key_params = field.get_encrypt_fragment(connection)
+        value = field.get_db_prep_save(value, connection=connection)
+        return sql, [value] + list(key_params)
+
+
+class DeterministicExact(DeterministicLookupMixin, Exact):
+    """`exact` lookup comparing the ciphertexts of a deterministic field."""
+
+    def as_sql(self, qn, connection):
+        """Compare the column with the ciphertext of the value or another column."""
+        lhs = self.get_ciphertext_col(self.lhs)
+        if lhs is None:
+            return super().as_sql(qn, connection)
+
+        if hasattr(self.rhs, 'resolve_expression'):
+            rhs = self.get_ciphertext_col(self.rhs)
+            if rhs is None:
+                return super().as_sql(qn, connection)
+            rhs_sql, rhs_params = qn.compile(rhs)
+        else:
+            rhs_sql, rhs_params = self.encrypt_rhs(self.rhs, connection)
+
+        lhs_sql, lhs_params = qn.compile(lhs)
+        return '{} = {}'.format(lhs_sql, rhs_sql), list(lhs_params) + list(rhs_params)
+
+
+class DeterministicIn(DeterministicLookupMixin, In):
+    """`in` lookup comparing the ciphertexts of a deterministic field."""
+
+    def as_sql(self, qn, connection):
+        """Compare the column with the ciphertext of each distinct value."""
+        lhs = self.get_ciphertext_col(self.lhs)
+        if lhs is None or not self.rhs_is_direct_value() or any(
+            hasattr(value, 'resolve_expression') for value in self.rhs
+        ):
+            return super().as_sql(qn, connection)
+
+        values = list(dict.fromkeys(value for value in self.rhs if value is not None))
+        if not values:
+            raise EmptyResultSet
+
+        lhs_sql, params = qn.compile(lhs)
+        params = list(params)
+        sqls = []
+        for value in values:
+            sql, value_params = self.encrypt_rhs(value, connection)
+            sqls.append(sql)
+            params.extend(value_params)
+        return '{} IN ({})'.format(lhs_sql, ', '.join(sqls)), params
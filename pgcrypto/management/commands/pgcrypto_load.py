@@ -0,0 +1,64 @@
+import csv
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from pgcrypto.loading import bulk_load
+
+
+class Command(BaseCommand):
+    """Load the rows of a CSV file into a model with encrypted fields."""
+    help = (
+        'Load a CSV file with a header of field names into a model, encrypting '
+        'the values in postgres.'
+    )
+
+    def add_arguments(self, parser):
+        """Add the model, the file and the batch size arguments."""
+        parser.add_argument('model', help='Model to load, as app_label.ModelName.')
+        parser.add_argument('path', help='CSV file to load.')
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Number of rows copied at once.',
+        )
+        parser.add_argument(
+            '--database', default=None,
+            help='Database to load the rows into.',
+        )
+
+    def handle(self, *args, **options):
+        """Load the file and report the progress after each batch."""
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        def progress(count):
+            self.stdout.write('Loaded {} rows'.format(count))
+
+        with open(options['path'], newline='') as csv_file:
+            rows = self.get_rows(model, csv.DictReader(csv_file))
+            count = bulk_load(
+                model,
+                rows,
+                batch_size=options['batch_size'],
+                using=options['database'],
+                progress=progress,
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            'Loaded {} rows into {}'.format(count, model._meta.label)
+        ))
+
+    def get_rows(self, model, reader):
+        """Get the field values of each row, empty values of null fields are `None`."""
+        null_fields = {
+            name
+            for field in model._meta.concrete_fields if field.null
+            for name in (field.name, field.attname)
+        }
+        for row in reader:
+            yield {
+                name: None if value == '' and name in null_fields else value
+                for name, value in row.items()
+            }
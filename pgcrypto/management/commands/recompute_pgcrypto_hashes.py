@@ -0,0 +1,54 @@
+from django.db import connections, router
+
+from pgcrypto.hashing import get_recomputed_fields, recompute_hashes
+from pgcrypto.management.commands.rotate_pgcrypto_keys import Command as RotateCommand
+
+
+class Command(RotateCommand):
+    """Compute the hash fields again from their original field."""
+    help = (
+        'Compute the digest, HMAC and blind index fields again from their original '
+        'field, in batches updated by postgres.'
+    )
+
+    def add_arguments(self, parser):
+        """Add the models, the databases and the batch size arguments."""
+        parser.add_argument(
+            'models', nargs='*',
+            help='Apps or models to recompute, as app_label or app_label.ModelName.',
+        )
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Database to recompute, all the postgres databases by default.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows updated at once.',
+        )
+
+    def handle(self, *args, **options):
+        """Recompute the hashes of each model in each database."""
+        models = self.get_models(options['models'])
+        databases = options['databases'] or [
+            alias for alias in connections
+            if connections[alias].vendor == 'postgresql'
+        ]
+
+        def progress(model, count):
+            self.stdout.write(
+                'Recomputed {} rows of {}'.format(count, model._meta.label)
+            )
+
+        for using in databases:
+            for model in models:
+                if not router.allow_migrate_model(using, model):
+                    continue
+                if not get_recomputed_fields(model):
+                    continue
+
+                recompute_hashes(
+                    model, using, batch_size=options['batch_size'], progress=progress
+                )
+                self.stdout.write(self.style.SUCCESS(
+                    'Recomputed {} in {}'.format(model._meta.label, using)
+                ))
@@ -0,0 +1,113 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from pgcrypto.rotation import (
+    check_rotated_fields,
+    Checkpoint,
+    get_old_keys,
+    get_rotated_fields,
+    KeyRotation,
+)
+
+
+class Command(BaseCommand):
+    """Encrypt the PGP fields again with the current keys."""
+    help = (
+        'Decrypt the PGP fields with the keys of PGCRYPTO_OLD_KEYS and encrypt them '
+        'with the current keys, in batches which can be resumed.'
+    )
+
+    def add_arguments(self, parser):
+        """Add the models, the databases and the batching arguments."""
+        parser.add_argument(
+            'models', nargs='*',
+            help='Apps or models to rotate, as app_label or app_label.ModelName.',
+        )
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Database to rotate, all the postgres databases by default.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows updated at once.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of threads rotating disjoint ranges of primary keys.',
+        )
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help='Maximum number of rows rotated per second.',
+        )
+        parser.add_argument(
+            '--checkpoint', default='pgcrypto_rotation.json',
+            help='File saving the progress, read to resume the rotation.',
+        )
+
+    def handle(self, *args, **options):
+        """Rotate the keys of each model in each database."""
+        models = self.get_models(options['models'])
+        databases = options['databases'] or [
+            alias for alias in connections
+            if connections[alias].vendor == 'postgresql'
+        ]
+        checkpoint = Checkpoint(options['checkpoint'])
+
+        def progress(model, count):
+            self.stdout.write('Rotated {} rows of {}'.format(count, model._meta.label))
+
+        for using in databases:
+            self.check_models(models, using)
+
+        for using in databases:
+            old_keys = get_old_keys(connections[using])
+            for model in models:
+                if not router.allow_migrate_model(using, model):
+                    continue
+                if not get_rotated_fields(model, old_keys):
+                    continue
+
+                KeyRotation(model, using, old_keys, checkpoint).rotate(
+                    batch_size=options['batch_size'],
+                    workers=options['workers'],
+                    rate=options['rate'],
+                    progress=progress,
+                )
+                self.stdout.write(self.style.SUCCESS(
+                    'Rotated {} in {}'.format(model._meta.label, using)
+                ))
+
+    def check_models(self, models, using):
+        """Check the fields of `models` can be rotated before rotating any."""
+        connection = connections[using]
+        old_keys = get_old_keys(connection)
+        if not old_keys:
+            raise CommandError(
+                'Set PGCRYPTO_OLD_KEYS for the database {!r} to the keys the '
+                'fields are encrypted with.'.format(using)
+            )
+
+        for model in models:
+            if not router.allow_migrate_model(using, model):
+                continue
+            try:
+                check_rotated_fields(model, connection, old_keys)
+            except ValueError as error:
+                raise CommandError(error)
+
+    def get_models(self, labels):
+        """Get the concrete models of the given apps or models, all by default."""
+        if not labels:
+            models = apps.get_models()
+        else:
+            models = []
+            for label in labels:
+                try:
+                    if '.' in label:
+                        models.append(apps.get_model(label))
+                    else:
+                        models.extend(apps.get_app_config(label).get_models())
+                except LookupError as e:
+                    raise CommandError(str(e))
+        return [model for model in models if not model._meta.proxy]
@@ -0,0 +1,54 @@
+from django.db import connections, router
+
+from pgcrypto.envelope import get_data_key_field, wrap_data_keys
+from pgcrypto.management.commands.rotate_pgcrypto_keys import Command as RotateCommand
+
+
+class Command(RotateCommand):
+    """Give a data key to the rows saved before the `DataKeyField` of their model."""
+    help = (
+        'Generate a data key for the rows without one and encrypt their public key '
+        'fields with it, in batches updated by postgres.'
+    )
+
+    def add_arguments(self, parser):
+        """Add the models, the databases and the batch size arguments."""
+        parser.add_argument(
+            'models', nargs='*',
+            help='Apps or models to update, as app_label or app_label.ModelName.',
+        )
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Database to update, all the postgres databases by default.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows updated at once.',
+        )
+
+    def handle(self, *args, **options):
+        """Wrap the data keys of each model in each database."""
+        models = self.get_models(options['models'])
+        databases = options['databases'] or [
+            alias for alias in connections
+            if connections[alias].vendor == 'postgresql'
+        ]
+
+        def progress(model, count):
+            self.stdout.write(
+                'Wrapped {} data keys of {}'.format(count, model._meta.label)
+            )
+
+        for using in databases:
+            for model in models:
+                if not router.allow_migrate_model(using, model):
+                    continue
+                if get_data_key_field(model) is None:
+                    continue
+
+                wrap_data_keys(
+                    model, using, batch_size=options['batch_size'], progress=progress
+                )
+                self.stdout.write(self.style.SUCCESS(
+                    'Wrapped the data keys of {} in {}'.format(model._meta.label, using)
+                ))
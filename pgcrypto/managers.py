@@ -0,0 +1,479 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.db import connections, models
+from django.db.models.query import ModelIterable
+from django.db.models.sql import InsertQuery
+from django.db.models.sql.compiler import SQLInsertCompiler
+
+from pgcrypto import client, repair
+from pgcrypto.mixins import Ciphertext, get_setting, PGPMixin, StaleKey
+
+# Prefix of the annotations holding the ciphertexts of `decrypt_client_side`.
+CIPHERTEXT_PREFIX = 'pgcrypto_ciphertext_'
+# Annotation telling a row fetched by `repair_stale` has values of old keys.
+STALE_ANNOTATION = 'pgcrypto_stale'
+
+
+# Pools of the processes decrypting in python, by process, size and keys.
+decrypt_pools = {}
+decrypt_pools_lock = threading.Lock()
+
+
+def get_decrypt_pool(workers, keys):
+    """Get the pool of `workers` processes decrypting with `keys`.
+
+    The pool is created on first use and reused by the following querysets. The
+    keys are sent once to each process by the initializer of the pool rather than
+    with each batch. A forked process creates its own pools.
+    """
+    pool_key = (os.getpid(), workers, tuple(sorted(keys.items())))
+    with decrypt_pools_lock:
+        pool = decrypt_pools.get(pool_key)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=client.set_worker_keys,
+                initargs=(keys,),
+            )
+            decrypt_pools[pool_key] = pool
+    return pool_key, pool
+
+
+def discard_decrypt_pool(pool_key):
+    """Forget a broken pool, the next queryset creates a new one."""
+    with decrypt_pools_lock:
+        pool = decrypt_pools.pop(pool_key, None)
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+class ClientDecryptIterable(ModelIterable):
+    """Yield model instances with the PGP fields decrypted in python.
+
+    Rows are decrypted `batch_size` at a time by a pool of processes.
+    """
+
+    def __init__(self, *args, batch_size=1000, **kwargs):
+        """Init the iterable with the number of rows to decrypt at once."""
+        self.batch_size = batch_size
+
+        super().__init__(*args, **kwargs)
+
+    def __iter__(self):
+        """Decrypt the rows by batch."""
+        queryset = self.queryset
+        connection = connections[queryset.db]
+        fields = [
+            queryset.model._meta.get_field(name[len(CIPHERTEXT_PREFIX):])
+            for name in queryset.query.annotations
+            if name.startswith(CIPHERTEXT_PREFIX)
+        ]
+        workers = get_setting(connection, 'PGCRYPTO_CLIENT_WORKERS', None)
+        keys = {
+            field.decrypt_key_setting: get_setting(connection, field.decrypt_key_setting)
+            for field in fields
+        }
+        pool_key, executor = get_decrypt_pool(workers, keys)
+
+        try:
+            batch = []
+            for obj in super().__iter__():
+                batch.append(obj)
+                if len(batch) == self.batch_size:
+                    yield from self.decrypt(batch, fields, executor, connection)
+                    batch = []
+            yield from self.decrypt(batch, fields, executor, connection)
+        except BrokenProcessPool:
+            discard_decrypt_pool(pool_key)
+            raise
+
+    def decrypt(self, batch, fields, executor, connection):
+        """Decrypt the fields of a batch of instances in the worker processes."""
+        futures = []
+        for field in fields:
+            # psycopg2 returns `memoryview` which cannot be sent to a process.
+            values = [getattr(obj, CIPHERTEXT_PREFIX + field.attname) for obj in batch]
+            futures.append(executor.submit(
+                client.decrypt_many_in_worker,
+                field.client_decrypt,
+                field.decrypt_key_setting,
+                [None if value is None else bytes(value) for value in values],
+            ))
+
+        for field, future in zip(fields, futures):
+            for obj, text in zip(batch, future.result()):
+                delattr(obj, CIPHERTEXT_PREFIX + field.attname)
+                setattr(obj, field.attname, field.from_text(text, connection))
+        return batch
+
+
+class LazyDecryption:
+    """Decrypt a field for all the instances of a queryset at once.
+
+    Used by `LazyDecryptedAttribute`, set on the model by
+    `PGPMixin.contribute_to_class`, on the first access to a field of an instance
+    fetched by `EncryptedQuerySet.decrypt_lazily`.
+    """
+
+    def __init__(self, model, fields, db, client_side):
+        """Init the decryption of the instances of a queryset."""
+        self.model = model
+        self.fields = fields
+        self.db = db
+        self.client_side = client_side
+        self.objs = []
+
+    def load(self, field):
+        """Set the decrypted value of `field` on all the instances."""
+        objs = [obj for obj in self.objs if field.attname not in obj.__dict__]
+        if self.client_side:
+            values = self.decrypt(field, objs)
+        else:
+            values = self.fetch(field, objs)
+
+        for obj, value in zip(objs, values):
+            obj.__dict__[field.attname] = value
+
+    def decrypt(self, field, objs):
+        """Decrypt the ciphertexts of `field` in python."""
+        connection = connections[self.db]
+        name = CIPHERTEXT_PREFIX + field.attname
+        ciphertexts = [obj.__dict__.pop(name) for obj in objs]
+        texts = client.decrypt_many(
+            field.client_decrypt,
+            get_setting(connection, field.decrypt_key_setting),
+            [None if value is None else bytes(value) for value in ciphertexts],
+        )
+        return [field.from_text(text, connection) for text in texts]
+
+    def fetch(self, field, objs):
+        """Fetch the values of `field` decrypted by postgres in one query."""
+        values = dict(
+            self.model._base_manager.using(self.db)
+            .filter(pk__in=[obj.pk for obj in objs])
+            .values_list('pk', field.attname)
+        )
+        return [values.get(obj.pk) for obj in objs]
+
+
+class LazyDecryptIterable(ModelIterable):
+    """Yield model instances decrypting their PGP fields on first access."""
+
+    def __init__(self, *args, fields=(), client_side=False, **kwargs):
+        """Init the iterable with the fields to decrypt lazily."""
+        self.fields = fields
+        self.client_side = client_side
+
+        super().__init__(*args, **kwargs)
+
+    def __iter__(self):
+        """Share the lazy decryption between the instances."""
+        lazy = LazyDecryption(
+            self.queryset.model, self.fields, self.queryset.db, self.client_side
+        )
+        for obj in super().__iter__():
+            lazy.objs.append(obj)
+            obj._pgcrypto_lazy = lazy
+            yield obj
+
+
+class RepairIterable(ModelIterable):
+    """Yield model instances and schedule the repair of the ones of old keys.
+
+    The rows are selected with whether they have values of old keys, only while
+    iterating model instances so `values()` doesn't return it.
+    """
+
+    def __iter__(self):
+        """Collect the primary keys of the rows to encrypt again."""
+        queryset = self.queryset._chain()
+        fields = repair.get_repaired_fields(queryset.model, connections[queryset.db])
+        queryset.query.add_annotation(
+            StaleKey(*[field.name for field in fields]), STALE_ANNOTATION,
+        )
+        rows = ModelIterable(queryset, self.chunked_fetch, self.chunk_size)
+
+        stale = []
+        try:
+            for obj in rows:
+                if obj.__dict__.pop(STALE_ANNOTATION, False):
+                    stale.append(obj.pk)
+                yield obj
+        finally:
+            if stale:
+                repair.schedule(queryset.model, queryset.db, stale)
+
+
+class UpsertCompiler(SQLInsertCompiler):
+    """Insert compiler updating the conflicting rows instead of ignoring them."""
+
+    def as_sql(self):
+        """Replace the `ON CONFLICT DO NOTHING` of the insert."""
+        ops = self.connection.ops
+        do_nothing = ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)
+        return [
+            (sql.replace(do_nothing, self.query.on_conflict_sql), params)
+            for sql, params in super().as_sql()
+        ]
+
+
+class UpsertQuery(InsertQuery):
+    """Insert query with the `ON CONFLICT ... DO UPDATE` clause of `bulk_create`."""
+
+    def __init__(self, *args, on_conflict_sql, **kwargs):
+        """Init the query with its `ON CONFLICT` clause."""
+        self.on_conflict_sql = on_conflict_sql
+
+        super().__init__(*args, ignore_conflicts=True, **kwargs)
+
+    def get_compiler(self, using=None, connection=None):
+        """Get the compiler writing the `ON CONFLICT` clause."""
+        if using:
+            connection = connections[using]
+        return UpsertCompiler(self, connection, using)
+
+
+class EncryptedQuerySet(models.QuerySet):
+    """QuerySet with helpers for the hash and encrypted fields."""
+    # Set by `bulk_create` to update the conflicting rows.
+    _on_conflict_sql = None
+
+    def bulk_create(self, objs, *args, update_conflicts=False, update_fields=None,
+                    unique_fields=None, **kwargs):
+        """Encrypt the values of the PGP fields in parallel before inserting them.
+
+        Only the fields encrypted in python (`PGCRYPTO_CLIENT_ENCRYPTION`) are
+        encrypted ahead, by a pool of `PGCRYPTO_CLIENT_WORKERS` threads.
+
+        With `update_conflicts`, the rows conflicting on `unique_fields` get the
+        values of `update_fields` instead. A PGP field in `unique_fields` stands for
+        its unique `BlindIndexField`. Like with `ignore_conflicts`, the primary keys
+        of the objects aren't set.
+        """
+        objs = list(objs)
+        self._for_write = True
+        self.encrypt_in_python(objs)
+        if not update_conflicts:
+            return super().bulk_create(objs, *args, **kwargs)
+
+        if kwargs.get('ignore_conflicts'):
+            raise ValueError(
+                'ignore_conflicts and update_conflicts are mutually exclusive.'
+            )
+        queryset = self._chain()
+        queryset._on_conflict_sql = self.get_on_conflict_sql(update_fields, unique_fields)
+        kwargs['ignore_conflicts'] = True
+        return super(EncryptedQuerySet, queryset).bulk_create(objs, *args, **kwargs)
+
+    def get_on_conflict_sql(self, update_fields, unique_fields):
+        """Get the `ON CONFLICT ... DO UPDATE` clause of `bulk_create`."""
+        if not update_fields:
+            raise ValueError(
+                'Fields that will be updated when a row insertion fails on '
+                'conflicts must be provided.'
+            )
+        if not unique_fields:
+            raise ValueError(
+                'Unique fields that can trigger the upsert must be provided.'
+            )
+
+        opts = self.model._meta
+        quote_name = connections[self.db].ops.quote_name
+        conflict_columns = []
+        for name in unique_fields:
+            field = opts.get_field(name)
+            if isinstance(field, PGPMixin) and not getattr(field, 'deterministic', False):
+                blind_index = field.blind_index_field
+                if blind_index is None or not blind_index.unique:
+                    raise ValueError(
+                        "'{}' needs a unique BlindIndexField to be one of the "
+                        'unique fields.'.format(name)
+                    )
+                field = blind_index
+            conflict_columns.append(quote_name(field.column))
+
+        fields = [opts.get_field(name) for name in update_fields]
+        if any(getattr(field, 'data_key_field', None) is not None for field in fields):
+            raise ValueError(
+                'Fields encrypted with a data key cannot be updated on conflicts.'
+            )
+        # The hashes and indexes of an updated field are updated with it.
+        fields += self.get_companions({field.name for field in fields})
+        columns = dict.fromkeys(quote_name(field.column) for field in fields)
+        return 'ON CONFLICT ({}) DO UPDATE SET {}'.format(
+            ', '.join(conflict_columns),
+            ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in columns),
+        )
+
+    def get_companions(self, names):
+        """Get the hash and index fields computed from one of the fields `names`."""
+        return [
+            field for field in self.model._meta.concrete_fields
+            if getattr(field, 'original', None) in names
+        ]
+
+    def get_companion_value(self, field, value):
+        """Get the value of the hash or index `field` for a value of its original."""
+        if hasattr(value, 'resolve_expression'):
+            raise ValueError(
+                "'{}' can't be updated with an expression, '{}' is computed from its "
+                'value in python.'.format(field.original, field.name)
+            )
+        return field.from_original(value)
+
+    def update(self, **kwargs):
+        """Update the hashes and indexes of the updated fields with them.
+
+        They get the value `save()` would give them, so the lookups using them
+        still find the rows.
+        """
+        for field in self.get_companions(kwargs):
+            if field.name not in kwargs:
+                kwargs[field.name] = self.get_companion_value(
+                    field, kwargs[field.original]
+                )
+        return super().update(**kwargs)
+    update.alters_data = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """Update the hashes and indexes of the updated fields with them."""
+        companions = [
+            field for field in self.get_companions(fields) if field.name not in fields
+        ]
+        if companions:
+            objs = list(objs)
+            for obj in objs:
+                for field in companions:
+                    value = getattr(obj, field.original)
+                    setattr(obj, field.attname, self.get_companion_value(field, value))
+            fields = [*fields, *(field.name for field in companions)]
+        return super().bulk_update(objs, fields, batch_size=batch_size)
+    bulk_update.alters_data = True
+
+    def _insert(self, objs, fields, *args, **kwargs):
+        """Insert the rows with the `ON CONFLICT` clause of `bulk_create`, if any."""
+        if self._on_conflict_sql is None:
+            return super()._insert(objs, fields, *args, **kwargs)
+
+        self._for_write = True
+        query = UpsertQuery(self.model, on_conflict_sql=self._on_conflict_sql)
+        query.insert_values(fields, objs, raw=kwargs.get('raw', False))
+        return query.get_compiler(using=kwargs.get('using') or self.db).execute_sql()
+    _insert.alters_data = True
+    _insert.queryset_only = False
+
+    def encrypt_in_python(self, objs):
+        """Compute the ciphertexts of the objects to insert in a worker pool."""
+        connection = connections[self.db]
+        fields = [
+            field for field in self.model._meta.concrete_fields
+            if hasattr(field, 'encrypt_in_python') and field.encrypt_in_python(connection)
+        ]
+        values = [
+            (obj, field, getattr(obj, field.attname))
+            for obj in objs for field in fields
+            if getattr(obj, field.attname) is not None
+        ]
+        if not values:
+            return
+
+        def encrypt(value):
+            obj, field, plaintext = value
+            return field.get_ciphertext(plaintext, connection)
+
+        workers = get_setting(connection, 'PGCRYPTO_CLIENT_WORKERS', None)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            ciphertexts = executor.map(encrypt, values)
+            for (obj, field, plaintext), ciphertext in zip(values, ciphertexts):
+                computed = obj.__dict__.setdefault('_pgcrypto_ciphertexts', {})
+                computed[field.attname] = (plaintext, ciphertext)
+
+    def _loaded_pgp_fields(self):
+        """Get the PGP fields loaded by the queryset which can be decrypted in python.
+
+        Fields using the envelope encryption of a `DataKeyField` or key ids are
+        left out.
+        """
+        connection = connections[self.db]
+        loaded = self.query.get_loaded_field_names().get(self.model)
+        fields = [
+            field for field in self.model._meta.concrete_fields
+            if isinstance(field, PGPMixin) and (loaded is None or field.attname in loaded)
+        ]
+        return [
+            field for field in fields
+            if not field.is_data_key and field.data_key_field is None and (
+                not field.key_ids(connection)
+            )
+        ]
+
+    def _with_ciphertexts(self, fields):
+        """Select the ciphertexts of `fields` instead of decrypting them."""
+        return self.defer(*[field.name for field in fields]).annotate(**{
+            CIPHERTEXT_PREFIX + field.attname: Ciphertext(field.name)
+            for field in fields
+        })
+
+    def decrypt_client_side(self, batch_size=1000):
+        """Fetch the ciphertexts of the PGP fields and decrypt them in python.
+
+        The rows are decrypted `batch_size` at a time in a pool of
+        `PGCRYPTO_CLIENT_WORKERS` processes instead of by postgres.
+        """
+        queryset = self._with_ciphertexts(self._loaded_pgp_fields())
+        queryset._iterable_class = partial(ClientDecryptIterable, batch_size=batch_size)
+        return queryset
+
+    def decrypt_lazily(self, client_side=False):
+        """Decrypt the PGP fields only when they are first accessed.
+
+        The first access to a field decrypts it for all the instances of the
+        queryset at once, with one query or in python when `client_side` is set.
+        """
+        fields = self._loaded_pgp_fields()
+        if client_side:
+            queryset = self._with_ciphertexts(fields)
+        else:
+            queryset = self.defer(*[field.name for field in fields])
+        queryset._iterable_class = partial(
+            LazyDecryptIterable, fields=fields, client_side=client_side
+        )
+        return queryset
+
+    def repair_stale(self):
+        """Encrypt again the fetched rows with values of old keys of the key ring.
+
+        The rows are updated at the end of the transaction, or of the request
+        outside of a transaction, or once `PGCRYPTO_REPAIR_BATCH_SIZE` rows are
+        pending, with the values of their fields encrypted with the current keys by
+        postgres. Only the key of a value is checked, not its encryption options.
+        """
+        queryset = self._chain()
+        if repair.get_repaired_fields(self.model, connections[self.db]):
+            queryset._iterable_class = RepairIterable
+        return queryset
+
+    def hash_in_bulk(self, values, field_name, batch_size=1000):
+        """Return a dictionary mapping each value to the object matching its hash.
+
+        Like `in_bulk` for a `TextDigestField` or `TextHMACField`: each distinct
+        value is hashed once and the values are matched `batch_size` at a time.
+        """
+        field = self.model._meta.get_field(field_name)
+        connection = connections[self.db]
+        values = list(dict.fromkeys(values))
+
+        objects = {}
+        for offset in range(0, len(values), batch_size):
+            batch = values[offset:offset + batch_size]
+            hashes = dict(zip(field.get_hashes(batch, connection), batch))
+            for obj in self.filter(**{'{}__in'.format(field_name): list(hashes)}):
+                objects[hashes[getattr(obj, field.attname)]] = obj
+        return objects
+
+
+EncryptedManager = models.Manager.from_queryset(EncryptedQuerySet)
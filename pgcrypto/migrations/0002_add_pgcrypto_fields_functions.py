@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pgcrypto', '0001_add_pgcrypto_extension'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                'CREATE SCHEMA IF NOT EXISTS pgcrypto_fields',
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.sym_encrypt(text)
+                RETURNS bytea AS $$
+                    SELECT pgp_sym_encrypt($1, current_setting('pgcrypto_fields.key'))
+                $$ LANGUAGE SQL VOLATILE
+                """,
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.sym_decrypt(bytea)
+                RETURNS text AS $$
+                    SELECT pgp_sym_decrypt($1, current_setting('pgcrypto_fields.key'))
+                $$ LANGUAGE SQL STABLE STRICT
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS pgcrypto_fields.sym_decrypt(bytea)',
+                'DROP FUNCTION IF EXISTS pgcrypto_fields.sym_encrypt(text)',
+                'DROP SCHEMA IF EXISTS pgcrypto_fields',
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pgcrypto', '0002_add_pgcrypto_fields_functions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                # The data key of the last row is kept for the transaction so the
+                # fields of a row only decrypt it once.
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.data_key(bytea, bytea)
+                RETURNS text AS $$
+                DECLARE
+                    wrapped_key text := md5($1);
+                    cached text := current_setting('pgcrypto_fields.data_key', true);
+                    data_key text;
+                BEGIN
+                    IF split_part(cached, ':', 1) = wrapped_key THEN
+                        RETURN split_part(cached, ':', 2);
+                    END IF;
+
+                    data_key := pgp_pub_decrypt($1, $2);
+                    PERFORM set_config(
+                        'pgcrypto_fields.data_key', wrapped_key || ':' || data_key, true
+                    );
+                    RETURN data_key;
+                END;
+                $$ LANGUAGE plpgsql VOLATILE STRICT
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS pgcrypto_fields.data_key(bytea, bytea)',
+            ],
+        ),
+    ]
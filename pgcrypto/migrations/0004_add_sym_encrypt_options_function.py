@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pgcrypto', '0003_add_data_key_function'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.sym_encrypt(text, text)
+                RETURNS bytea AS $$
+                    SELECT pgp_sym_encrypt(
+                        $1, current_setting('pgcrypto_fields.key'), $2
+                    )
+                $$ LANGUAGE SQL VOLATILE
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS pgcrypto_fields.sym_encrypt(text, text)',
+            ],
+        ),
+    ]
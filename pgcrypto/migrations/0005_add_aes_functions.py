@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pgcrypto', '0004_add_sym_encrypt_options_function'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.aes_encrypt(bytea, bytea)
+                RETURNS bytea AS $$
+                    SELECT iv || encrypt_iv($1, $2, iv, 'aes-cbc/pad:pkcs')
+                    FROM gen_random_bytes(16) AS iv
+                $$ LANGUAGE SQL VOLATILE STRICT
+                """,
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.aes_decrypt(bytea, bytea)
+                RETURNS bytea AS $$
+                    SELECT decrypt_iv(
+                        substring($1 from 17), $2, substring($1 for 16), 'aes-cbc/pad:pkcs'
+                    )
+                $$ LANGUAGE SQL IMMUTABLE STRICT
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS pgcrypto_fields.aes_decrypt(bytea, bytea)',
+                'DROP FUNCTION IF EXISTS pgcrypto_fields.aes_encrypt(bytea, bytea)',
+            ],
+        ),
+    ]
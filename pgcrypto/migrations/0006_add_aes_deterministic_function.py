@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pgcrypto', '0005_add_aes_functions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                # The IV is the HMAC of the value with a key derived from the AES key
+                # so the ciphertext only depends on the value and the key.
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.aes_encrypt_deterministic(bytea, bytea)
+                RETURNS bytea AS $$
+                    SELECT iv || encrypt_iv($1, $2, iv, 'aes-cbc/pad:pkcs')
+                    FROM substring(
+                        hmac($1, hmac('siv'::bytea, $2, 'sha256'), 'sha256') for 16
+                    ) AS iv
+                $$ LANGUAGE SQL IMMUTABLE STRICT
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.aes_encrypt_deterministic(bytea, bytea)',
+            ],
+        ),
+    ]
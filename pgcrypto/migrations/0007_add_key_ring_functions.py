@@ -0,0 +1,85 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pgcrypto', '0006_add_aes_deterministic_function'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                # The private key of the key ring with the id of the key the message
+                # was encrypted with, or the current key.
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.pub_key_of(bytea, bytea[])
+                RETURNS bytea AS $$
+                    SELECT coalesce(
+                        (
+                            SELECT key FROM unnest($2) AS key
+                            WHERE pgp_key_id(key) = pgp_key_id($1)
+                            LIMIT 1
+                        ),
+                        $2[1]
+                    )
+                $$ LANGUAGE SQL IMMUTABLE STRICT
+                """,
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.pub_decrypt_key_ring(bytea, bytea[])
+                RETURNS text AS $$
+                    SELECT pgp_pub_decrypt($1, pgcrypto_fields.pub_key_of($1, $2))
+                $$ LANGUAGE SQL IMMUTABLE STRICT
+                """,
+                # A symmetric message is prefixed with the byte 1, which never starts
+                # an OpenPGP packet, and the 4 bytes of the configured id of the key.
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.sym_encrypt_key_id(text, text, integer)
+                RETURNS bytea AS $$
+                    SELECT '\\x01'::bytea || int4send($3) || pgp_sym_encrypt($1, $2)
+                $$ LANGUAGE SQL VOLATILE STRICT
+                """,
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.sym_encrypt_key_id(text, text, integer, text)
+                RETURNS bytea AS $$
+                    SELECT '\\x01'::bytea || int4send($3)
+                        || pgp_sym_encrypt($1, $2, $4)
+                $$ LANGUAGE SQL VOLATILE STRICT
+                """,
+                # The keys are followed by their ids, `NULL` for the old keys without
+                # one. Messages without a key id were encrypted before the key ring,
+                # with its oldest key.
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.sym_decrypt_key_ring(bytea, text[], integer[])
+                RETURNS text AS $$
+                    SELECT CASE WHEN get_byte($1, 0) = 1 THEN pgp_sym_decrypt(
+                        substring($1 from 6),
+                        coalesce(
+                            (
+                                SELECT ring.key FROM unnest($2, $3) AS ring(key, id)
+                                WHERE int4send(ring.id) = substring($1 from 2 for 4)
+                                LIMIT 1
+                            ),
+                            $2[1]
+                        )
+                    ) ELSE pgp_sym_decrypt($1, $2[array_upper($2, 1)]) END
+                $$ LANGUAGE SQL IMMUTABLE STRICT
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.sym_decrypt_key_ring(bytea, text[], integer[])',
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.sym_encrypt_key_id(text, text, integer, text)',
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.sym_encrypt_key_id(text, text, integer)',
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.pub_decrypt_key_ring(bytea, bytea[])',
+                'DROP FUNCTION IF EXISTS pgcrypto_fields.pub_key_of(bytea, bytea[])',
+            ],
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pgcrypto', '0007_add_key_ring_functions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                # Rows saved before the `DataKeyField` was added have no data key,
+                # their values are encrypted with the public key.
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.envelope_encrypt(text, bytea, bytea, bytea, text)
+                RETURNS bytea AS $$
+                DECLARE
+                    encrypted bytea;
+                BEGIN
+                    IF $1 IS NULL THEN
+                        RETURN NULL;
+                    ELSIF $2 IS NULL AND $5 IS NULL THEN
+                        encrypted := pgp_pub_encrypt($1, $4);
+                    ELSIF $2 IS NULL THEN
+                        encrypted := pgp_pub_encrypt($1, $4, $5);
+                    ELSIF $5 IS NULL THEN
+                        encrypted := pgp_sym_encrypt($1, pgcrypto_fields.data_key($2, $3));
+                    ELSE
+                        encrypted := pgp_sym_encrypt(
+                            $1, pgcrypto_fields.data_key($2, $3), $5
+                        );
+                    END IF;
+
+                    IF encrypted IS NULL THEN
+                        RAISE EXCEPTION 'pgcrypto_fields: no key to encrypt the value';
+                    END IF;
+                    RETURN encrypted;
+                END;
+                $$ LANGUAGE plpgsql VOLATILE
+                """,
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.envelope_encrypt(text, bytea, bytea[], bytea, text)
+                RETURNS bytea AS $$
+                    SELECT pgcrypto_fields.envelope_encrypt(
+                        $1, $2, pgcrypto_fields.pub_key_of($2, $3), $4, $5
+                    )
+                $$ LANGUAGE SQL VOLATILE
+                """,
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.envelope_decrypt(bytea, bytea, bytea)
+                RETURNS text AS $$
+                    SELECT CASE WHEN $2 IS NULL THEN pgp_pub_decrypt($1, $3)
+                        ELSE pgp_sym_decrypt($1, pgcrypto_fields.data_key($2, $3)) END
+                $$ LANGUAGE SQL VOLATILE
+                """,
+                """
+                CREATE OR REPLACE FUNCTION
+                    pgcrypto_fields.envelope_decrypt(bytea, bytea, bytea[])
+                RETURNS text AS $$
+                    SELECT CASE
+                        WHEN $2 IS NULL
+                            THEN pgcrypto_fields.pub_decrypt_key_ring($1, $3)
+                        ELSE pgp_sym_decrypt($1, pgcrypto_fields.data_key(
+                            $2, pgcrypto_fields.pub_key_of($2, $3)
+                        )) END
+                $$ LANGUAGE SQL VOLATILE
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.envelope_decrypt(bytea, bytea, bytea[])',
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.envelope_decrypt(bytea, bytea, bytea)',
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.envelope_encrypt(text, bytea, bytea[], bytea, text)',
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.envelope_encrypt(text, bytea, bytea, bytea, text)',
+            ],
+        ),
+    ]
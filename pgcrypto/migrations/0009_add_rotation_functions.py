@@ -0,0 +1,51 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pgcrypto', '0008_add_envelope_functions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                # Without key ids, the key of a symmetric message is only known by
+                # trying to decrypt it. pgcrypto raises its errors with the
+                # `external_routine_invocation_exception` code.
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.sym_decrypts(bytea, text)
+                RETURNS boolean AS $$
+                BEGIN
+                    PERFORM pgp_sym_decrypt_bytea($1, $2);
+                    RETURN true;
+                EXCEPTION WHEN external_routine_invocation_exception THEN
+                    RETURN false;
+                END;
+                $$ LANGUAGE plpgsql IMMUTABLE STRICT
+                """,
+                """
+                CREATE OR REPLACE FUNCTION pgcrypto_fields.sym_decrypt_any(bytea, text[])
+                RETURNS text AS $$
+                DECLARE
+                    ring_key text;
+                BEGIN
+                    FOREACH ring_key IN ARRAY $2 LOOP
+                        BEGIN
+                            RETURN pgp_sym_decrypt($1, ring_key);
+                        EXCEPTION WHEN external_routine_invocation_exception THEN
+                            NULL;
+                        END;
+                    END LOOP;
+                    RAISE EXCEPTION 'pgcrypto_fields: none of the keys decrypts the value';
+                END;
+                $$ LANGUAGE plpgsql IMMUTABLE STRICT
+                """,
+            ],
+            reverse_sql=[
+                'DROP FUNCTION IF EXISTS '
+                'pgcrypto_fields.sym_decrypt_any(bytea, text[])',
+                'DROP FUNCTION IF EXISTS pgcrypto_fields.sym_decrypts(bytea, text)',
+            ],
+        ),
+    ]
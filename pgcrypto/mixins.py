@@ -1,21 +1,178 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+from functools import lru_cache
+
 from django.conf import settings
-from django.db.models.expressions import Col
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import BinaryField, BooleanField, F, UniqueConstraint
+from django.db.models.expressions import Col, Expression
+from django.utils import timezone
 from django.utils.functional import cached_property
 
 from pgcrypto import (
+    AES_DECRYPT_SQL,
+    AES_DETERMINISTIC_ENCRYPT_SQL,
+    AES_ENCRYPT_SQL,
+    AES_KEY_SQL,
+    client,
+    PGP_ENVELOPE_DECRYPT_SQL,
+    PGP_ENVELOPE_ENCRYPT_SQL,
+    PGP_PUB_CURRENT_KEY_SQL,
+    PGP_PUB_DECRYPT_KEY_RING_SQL,
     PGP_PUB_DECRYPT_SQL,
     PGP_PUB_ENCRYPT_SQL,
+    PGP_PUB_KEY_SQL,
+    PGP_SYM_CURRENT_KEY_SQL,
+    PGP_SYM_DECRYPT_ANY_SQL,
+    PGP_SYM_DECRYPT_KEY_RING_SQL,
+    PGP_SYM_DECRYPT_SESSION_SQL,
     PGP_SYM_DECRYPT_SQL,
+    PGP_SYM_DECRYPTS_SQL,
+    PGP_SYM_ENCRYPT_KEY_ID_SQL,
+    PGP_SYM_ENCRYPT_SESSION_SQL,
     PGP_SYM_ENCRYPT_SQL,
+    PGP_SYM_ENCRYPT_SQL_WITH_NULLIF,
+    PGP_SYM_KEY_SQL,
 )
+from pgcrypto.binding import BoundKey
+
+NOT_SET = object()
+# Stands for the column while splitting the decrypt sql around it.
+COLUMN_MARKER = '\x00'
+# Stands for the column of the `DataKeyField` in the cached sql of a field.
+DATA_KEY_MARKER = '\x01'
+
+
+# Options of `pgp_sym_encrypt` and `pgp_pub_encrypt` with their valid values.
+PGP_OPTIONS = {
+    'cipher-algo': {'bf', 'aes128', 'aes192', 'aes256', '3des', 'cast5'},
+    'compress-algo': {'0', '1', '2'},
+    'compress-level': {str(level) for level in range(10)},
+    'convert-crlf': {'0', '1'},
+    'disable-mdc': {'0', '1'},
+    'sess-key': {'0', '1'},
+    's2k-mode': {'0', '1', '3'},
+    's2k-count': None,  # Between 1024 and 65011712.
+    's2k-digest-algo': {'md5', 'sha1'},
+    's2k-cipher-algo': {'bf', 'aes', 'aes128', 'aes192', 'aes256'},
+    'unicode-mode': {'0', '1'},
+}
 
 
-def get_setting(connection, key):
+def get_options_errors(options):
+    """Get the errors of pgcrypto options, e.g. `'s2k-mode=1, compress-algo=0'`."""
+    errors = []
+    for option in options.split(','):
+        name, _, value = (part.strip() for part in option.partition('='))
+        if name not in PGP_OPTIONS:
+            errors.append("Unknown option '{}'.".format(name))
+        elif name == 's2k-count':
+            if not value.isdigit() or not 1024 <= int(value) <= 65011712:
+                errors.append("'s2k-count' must be between 1024 and 65011712.")
+        elif value not in PGP_OPTIONS[name]:
+            errors.append("'{}' must be one of {}.".format(
+                name, ', '.join(sorted(PGP_OPTIONS[name]))
+            ))
+    return errors
+
+
+def get_setting(connection, key, default=NOT_SET):
     """Get key from connection or default to settings."""
     if key in connection.settings_dict:
         return connection.settings_dict[key]
-    else:
+    elif default is NOT_SET:
         return getattr(settings, key)
+    else:
+        return getattr(settings, key, default)
+
+
+def get_key_items(keys):
+    """Get the `(key id, key)` pairs of the old keys of a setting, the newest first.
+
+    The old keys of a setting are a key, a list of keys or a dict of keys by key id.
+    The keys which aren't in a dict have no id.
+    """
+    if isinstance(keys, str):
+        return [(None, keys)]
+    if isinstance(keys, dict):
+        return list(keys.items())
+    return [(None, key) for key in keys]
+
+
+def get_key_ring(connection, key_setting):
+    """Get the current key of `key_setting` followed by its `PGCRYPTO_OLD_KEYS`."""
+    old_keys = get_setting(connection, 'PGCRYPTO_OLD_KEYS', {}).get(key_setting, [])
+    return [get_setting(connection, key_setting), *(
+        key for _, key in get_key_items(old_keys)
+    )]
+
+
+def get_key_ring_ids(connection):
+    """Get the ids of the key ring of `PGCRYPTO_KEY`, `None` for a key without one.
+
+    The id of the current key is `PGCRYPTO_KEY_ID`.
+    """
+    old_keys = get_setting(connection, 'PGCRYPTO_OLD_KEYS', {}).get('PGCRYPTO_KEY', [])
+    return [get_setting(connection, 'PGCRYPTO_KEY_ID', None), *(
+        key_id for key_id, _ in get_key_items(old_keys)
+    )]
+
+
+@lru_cache(maxsize=None)
+def dearmor(armored_key):
+    """Return the binary form of an ASCII armored PGP key.
+
+    This is the python equivalent of pgcrypto's `dearmor()` so a key only needs
+    to be dearmored once per process instead of once per value.
+    """
+    lines = iter(armored_key.strip().splitlines()[1:])
+    # Skip the armor headers (`Version: ...`) which end with an empty line.
+    for line in lines:
+        if not line.strip():
+            break
+
+    body = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('=') or line.startswith('-----'):
+            break
+        body.append(line)
+
+    return base64.b64decode(''.join(body))
+
+
+class SQLCache:
+    """Cache of the sql fragments a field builds for each database alias.
+
+    Every cache is emptied by `clear_all` when a setting changes.
+    """
+    generation = 0
+
+    def __init__(self):
+        """Init the cache."""
+        self.fragments = {}
+        self.seen_generation = SQLCache.generation
+
+    @classmethod
+    def clear_all(cls):
+        """Invalidate all the caches."""
+        cls.generation += 1
+
+    def get(self, key, build):
+        """Get the cached fragment for `key` or cache the result of `build()`."""
+        if self.seen_generation != SQLCache.generation:
+            self.fragments = {}
+            self.seen_generation = SQLCache.generation
+
+        try:
+            return self.fragments[key]
+        except KeyError:
+            fragment = self.fragments[key] = build()
+            return fragment
 
 
 class DecryptedCol(Col):
@@ -30,8 +187,156 @@ class DecryptedCol(Col):
     def as_sql(self, compiler, connection):
         """Build SQL with decryption and casting."""
         sql, params = super(DecryptedCol, self).as_sql(compiler, connection)
-        sql = self.target.get_decrypt_sql(connection) % (sql, self.target.get_cast_sql())
-        return sql, params
+        head, tail, key_params = self.target.get_decrypt_fragment(connection)
+        tail = self.target.with_data_key(tail, compiler, self.alias)
+        return head + sql + tail, params + list(key_params)
+
+
+class EncryptedValue(Expression):
+    """Provide encryption of a saved value with the key as a query parameter.
+
+    `PGPMixin.pre_save` wraps the value so the key can be bound when
+    `PGCRYPTO_BIND_KEYS` is set, something `get_placeholder` cannot do.
+    """
+
+    def __init__(self, value, target, ciphertext=NOT_SET):
+        """Init the encryption."""
+        self.value = value
+        self.target = target
+        self.ciphertext = ciphertext
+        # Set by `PGPPublicKeyFieldMixin.pre_save` for envelope encryption.
+        self.data_key = None
+
+        super(EncryptedValue, self).__init__(output_field=target)
+
+    def as_sql(self, compiler, connection):
+        """Build SQL with encryption."""
+        if self.ciphertext is not NOT_SET:
+            return '%s', [self.ciphertext]
+        if self.target.encrypt_in_python(connection):
+            return '%s', [self.target.get_ciphertext(self.value, connection)]
+
+        value = self.target.get_db_prep_save(self.value, connection=connection)
+        if self.data_key is not None:
+            options_sql = self.target.get_options_sql(connection)
+            sql = PGP_SYM_ENCRYPT_SQL_WITH_NULLIF.format('%s' + options_sql)
+            return sql, [value, self.data_key]
+
+        sql, key_params = self.target.get_encrypt_fragment(connection)
+        sql = self.target.with_data_key(sql, compiler)
+        return sql, [value] + list(key_params)
+
+
+class Ciphertext(Expression):
+    """Select the `bytea` of an encrypted field without decrypting it."""
+
+    def __init__(self, name):
+        """Init the expression with the name of the encrypted field."""
+        self.name = name
+
+        super(Ciphertext, self).__init__(output_field=BinaryField())
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None,
+                           summarize=False, for_save=False):
+        """Resolve the column of the encrypted field."""
+        clone = self.copy()
+        col = F(self.name).resolve_expression(
+            query, allow_joins, reuse, summarize, for_save
+        )
+        clone.col = Col(col.alias, col.target, self.output_field)
+        return clone
+
+    def as_sql(self, compiler, connection):
+        """Build SQL of the column itself."""
+        return compiler.compile(self.col)
+
+
+class StaleKey(Expression):
+    """Select whether a value of the encrypted fields has an old key.
+
+    Only the fields whose `get_current_key_sql` can tell are checked.
+    """
+
+    def __init__(self, *names):
+        """Init the expression with the names of the encrypted fields."""
+        self.names = names
+
+        super(StaleKey, self).__init__(output_field=BooleanField())
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None,
+                           summarize=False, for_save=False):
+        """Resolve the columns of the encrypted fields."""
+        clone = self.copy()
+        clone.cols = []
+        for name in self.names:
+            col = F(name).resolve_expression(
+                query, allow_joins, reuse, summarize, for_save
+            )
+            clone.cols.append(Col(col.alias, col.target, BinaryField()))
+        return clone
+
+    def as_sql(self, compiler, connection):
+        """Build SQL true when one of the values has another key."""
+        conditions, params = [], []
+        for col in self.cols:
+            col_sql, col_params = compiler.compile(col)
+            sql, key_params = col.target.get_current_key_sql(connection)
+            conditions.append('NOT ({})'.format(sql.format(col_sql)))
+            params.extend([*col_params, *key_params])
+        return 'coalesce({}, false)'.format(' OR '.join(conditions)), params
+
+
+class HashOf(Expression):
+    """Hash the value of a field in postgres the way a hash field stores it.
+
+    A PGP field is decrypted first, so `QuerySet.update()` can compute the hash
+    fields again from their `original` without loading the rows. Only the hashes of
+    text fields are the same as the ones computed when saving.
+    """
+
+    def __init__(self, name, target):
+        """Init the expression with the name of the hashed field and the hash field."""
+        self.name = name
+        self.target = target
+
+        super(HashOf, self).__init__(output_field=target)
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None,
+                           summarize=False, for_save=False):
+        """Resolve the column of the hashed field, decrypted if needed."""
+        clone = self.copy()
+        clone.col = F(self.name).resolve_expression(
+            query, allow_joins, reuse, summarize, for_save
+        )
+        return clone
+
+    def as_sql(self, compiler, connection):
+        """Build SQL hashing the value of the column."""
+        col_sql, params = compiler.compile(self.col)
+        sql = self.target.get_encrypt_sql(connection) % col_sql
+        return '({})::text'.format(sql), params
+
+
+class LazyDecryptedAttribute:
+    """Decrypt the value of a field fetched lazily on first access.
+
+    Wraps the descriptor Django sets for the field on the model.
+    """
+
+    def __init__(self, field, descriptor):
+        """Init the attribute of `field`."""
+        self.field = field
+        self.descriptor = descriptor
+
+    def __get__(self, instance, cls=None):
+        """Decrypt the value for all the instances fetched with this instance."""
+        if instance is not None and self.field.attname not in instance.__dict__:
+            lazy = instance.__dict__.get('_pgcrypto_lazy')
+            if lazy is not None and self.field in lazy.fields:
+                lazy.load(self.field)
+                return instance.__dict__[self.field.attname]
+
+        return self.descriptor.__get__(instance, cls)
 
 
 class HashMixin:
@@ -50,11 +355,33 @@ class HashMixin:
     def pre_save(self, model_instance, add):
         """Save the original_value."""
         if self.original:
-            original_value = getattr(model_instance, self.original)
+            original_value = self.from_original(getattr(model_instance, self.original))
             setattr(model_instance, self.attname, original_value)
 
         return super(HashMixin, self).pre_save(model_instance, add)
 
+    def from_original(self, value):
+        """Get the value saved for a value of the `original` field."""
+        return value
+
+    def hash_in_python(self, connection):
+        """Return `True` when values are hashed in python instead of postgres."""
+        return get_setting(connection, 'PGCRYPTO_PYTHON_HASHES', False)
+
+    def get_hash(self, value, connection):
+        """Get the hash of `value` as stored by postgres, computed in python."""
+        raise NotImplementedError('The `get_hash` needs to be implemented.')
+
+    def get_db_prep_save(self, value, connection):
+        """Hash the value in python when `PGCRYPTO_PYTHON_HASHES` is set."""
+        value = super(HashMixin, self).get_db_prep_save(value, connection)
+        if not self.hash_in_python(connection):
+            return value
+        if value is None or value.startswith('\\x'):
+            return value
+
+        return self.get_hash(value, connection)
+
     def get_placeholder(self, value=None, compiler=None, connection=None):
         """
         Tell postgres to encrypt this field with a hashing function.
@@ -63,8 +390,9 @@ class HashMixin:
         the current value.
 
         `compiler` and `connection` is ignored here as we don't need custom operators.
+        Expressions (e.g. `HashOf`) build their own sql.
         """
-        if value is None or value.startswith('\\x'):
+        if value is None or hasattr(value, 'as_sql') or value.startswith('\\x'):
             return '%s'
 
         return self.get_encrypt_sql(connection)
@@ -73,6 +401,63 @@ class HashMixin:
         """Get encrypt sql. This may be overidden by some implementations."""
         return self.encrypt_sql
 
+    def get_hashes(self, values, connection):
+        """Get the hash of each value the way it is stored, in one query."""
+        values = [self.get_db_prep_value(value, connection) for value in values]
+        if self.hash_in_python(connection):
+            return [self.get_hash(value, connection) for value in values]
+        if not values:
+            return []
+
+        hash_sql = '({})::text'.format(self.get_encrypt_sql(connection))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT {}'.format(', '.join([hash_sql] * len(values))),
+                values
+            )
+            return list(cursor.fetchone())
+
+    def check(self, **kwargs):
+        """Check the field can be used by the `hash_of` lookup efficiently."""
+        return [
+            *super(HashMixin, self).check(**kwargs),
+            *self._check_hash_index(),
+        ]
+
+    def _check_hash_index(self):
+        if not hasattr(self, 'model') or self.has_index():
+            return []
+
+        return [
+            checks.Warning(
+                "'{}' has no index for the `hash_of` lookup.".format(self.name),
+                hint=(
+                    'Set db_index=True or add an index on the field to Meta.indexes '
+                    '(e.g. `django.contrib.postgres.indexes.HashIndex`).'
+                ),
+                obj=self,
+                id='pgcrypto.W001',
+            )
+        ]
+
+    def has_index(self):
+        """Return `True` when an index of the table starts with this field."""
+        if self.db_index or self.unique:
+            return True
+
+        opts = self.model._meta
+        indexed_fields = [
+            *(index.fields for index in opts.indexes),
+            *opts.unique_together,
+            *(
+                constraint.fields for constraint in opts.constraints
+                if isinstance(constraint, UniqueConstraint)
+            ),
+        ]
+        return any(
+            fields and fields[0].lstrip('-') == self.name for fields in indexed_fields
+        )
+
 
 class PGPMixin:
     """PGP encryption for field's value.
@@ -81,41 +466,374 @@ class PGPMixin:
     """
     encrypt_sql = None  # Set in implementation class
     decrypt_sql = None  # Set in implementation class
+    key_sql = None  # Set in implementation class
+    encrypt_key_setting = None  # Set in implementation class
+    decrypt_key_setting = None  # Set in implementation class
     cast_type = None
+    client_decrypt = None  # Set in implementation class
+    key_ring_decrypt_sql = None  # Set in implementation class supporting key ids
+    data_key_field = None
+    is_data_key = False
+
+    def __init__(self, *args, client_encryption=None, options=None, **kwargs):
+        """`max_length` should be set to None as encrypted text size is variable.
+
+        `client_encryption` overrides the `PGCRYPTO_CLIENT_ENCRYPTION` setting and
+        `options` the `PGCRYPTO_OPTIONS` setting.
+        """
+        self.client_encryption = client_encryption
+        self.options = options
 
-    def __init__(self, *args, **kwargs):
-        """`max_length` should be set to None as encrypted text size is variable."""
         super().__init__(*args, **kwargs)
 
+    def check(self, **kwargs):
+        """Check the options of the field and its uniqueness."""
+        return [
+            *super().check(**kwargs),
+            *self._check_options(),
+            *self._check_unique(),
+        ]
+
+    def _check_options(self):
+        if not self.options:
+            return []
+
+        return [
+            checks.Error(
+                "Invalid 'options' of '{}': {}".format(self.name, error),
+                obj=self,
+                id='pgcrypto.E002',
+            )
+            for error in get_options_errors(self.options)
+        ]
+
+    def _check_unique(self):
+        if not self.unique or getattr(self, 'deterministic', False):
+            return []
+
+        return [
+            checks.Warning(
+                "'{}' is unique but its values are encrypted with a random salt "
+                "so duplicates aren't detected.".format(self.name),
+                hint=(
+                    'Remove unique=True and add a BlindIndexField(original={!r}, '
+                    'unique=True) to the model.'.format(self.name)
+                ),
+                obj=self,
+                id='pgcrypto.W002',
+            )
+        ]
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        """Decrypt the values fetched by `decrypt_lazily` on first access."""
+        super().contribute_to_class(cls, name, **kwargs)
+
+        descriptor = cls.__dict__.get(self.attname)
+        if descriptor is not None:
+            setattr(cls, self.attname, LazyDecryptedAttribute(self, descriptor))
+
+    def deconstruct(self):
+        """Add `client_encryption` to the field arguments when set."""
+        name, path, args, kwargs = super().deconstruct()
+        if self.client_encryption is not None:
+            kwargs['client_encryption'] = self.client_encryption
+        if self.options is not None:
+            kwargs['options'] = self.options
+        return name, path, args, kwargs
+
     def db_type(self, connection=None):
         """Value stored in the database is hexadecimal."""
         return 'bytea'
 
-    def get_placeholder(self, value, compiler, connection):
-        """Tell postgres to encrypt this field using PGP."""
-        raise NotImplementedError('The `get_placeholder` needs to be implemented.')
+    def pre_save(self, model_instance, add):
+        """Wrap the value so it is encrypted by `EncryptedValue`."""
+        value = super().pre_save(model_instance, add)
+        if hasattr(value, 'resolve_expression'):
+            return value
+
+        # Ciphertexts computed beforehand by `EncryptedQuerySet.bulk_create`.
+        ciphertexts = getattr(model_instance, '_pgcrypto_ciphertexts', {})
+        plaintext, ciphertext = ciphertexts.pop(self.attname, (None, NOT_SET))
+        if plaintext != value:
+            ciphertext = NOT_SET
+
+        return EncryptedValue(value, self, ciphertext)
+
+    def get_placeholder(self, value=None, compiler=None, connection=None):
+        """Tell postgres to encrypt this field using PGP.
+
+        Values wrapped by `pre_save` are encrypted by `EncryptedValue` itself.
+        Other values (e.g. `QuerySet.update()`) always have the key in the sql.
+        """
+        if isinstance(value, EncryptedValue):
+            return '%s'
+
+        sql = self.get_encrypt_fragment(connection, bind_keys=False)[0]
+        return self.with_data_key(sql, compiler)
 
     def get_cast_sql(self):
         """Get cast sql. This may be overidden by some implementations."""
         return self.cast_type
 
+    def bind_keys(self, connection):
+        """Return `True` when keys are sent as query parameters."""
+        return get_setting(connection, 'PGCRYPTO_BIND_KEYS', False)
+
+    def key_ids(self, connection):
+        """Return `True` when values are decrypted with the key they were encrypted with.
+
+        The keys are the ones of the key ring, set by `PGCRYPTO_KEY_IDS`.
+        """
+        if self.key_ring_decrypt_sql is None:
+            return False
+        return get_setting(connection, 'PGCRYPTO_KEY_IDS', False)
+
+    def prepare_key(self, key):
+        """Get a key as bound as a query parameter."""
+        return key
+
+    def get_key(self, connection, key_setting):
+        """Get the key to bind as a query parameter."""
+        return BoundKey(self.prepare_key(get_setting(connection, key_setting)))
+
+    def encrypt_in_python(self, connection):
+        """Return `True` when values are encrypted in python instead of postgres.
+
+        The values encrypted with options are left to postgres, `pgpy` doesn't
+        take them.
+        """
+        if self.data_key_field is not None or self.key_ids(connection):
+            return False
+        if self.get_options_sql(connection):
+            return False
+        if self.client_encryption is not None:
+            return self.client_encryption
+        return get_setting(connection, 'PGCRYPTO_CLIENT_ENCRYPTION', False)
+
+    def get_ciphertext(self, value, connection):
+        """Encrypt `value` in python so the decrypt sql can read it."""
+        value = self.get_db_prep_save(value, connection=connection)
+        if value is None:
+            return None
+
+        key = get_setting(connection, self.encrypt_key_setting)
+        return self.encrypt_text(client.to_text(value), key)
+
+    def encrypt_text(self, text, key):
+        """Encrypt `text` with `key` in python."""
+        raise NotImplementedError('The `encrypt_text` needs to be implemented.')
+
+    def from_text(self, text, connection):
+        """Get the python value of a text decrypted in python.
+
+        The value is the one postgres returns when casting to `cast_type`.
+        """
+        value = client.from_text(text, self.get_cast_sql())
+        if isinstance(value, datetime) and connection.timezone is not None:
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value, connection.timezone)
+            value = value.astimezone(connection.timezone)
+        return value
+
+    def get_key_sql(self, connection, key_setting, bind_keys):
+        """Get the sql for the key, either inlined or as a query parameter."""
+        if bind_keys:
+            return '%s'
+
+        return self.key_sql.format(get_setting(connection, key_setting))
+
+    def get_encrypt_sql(self, connection, bind_keys=None):
+        """Get encrypt sql."""
+        if bind_keys is None:
+            bind_keys = self.bind_keys(connection)
+        key_sql = self.get_key_sql(connection, self.encrypt_key_setting, bind_keys)
+        return self.encrypt_sql.format(key_sql + self.get_options_sql(connection))
+
+    def get_options(self, connection):
+        """Get the options passed to `pgp_*_encrypt`, if any."""
+        if self.options is not None:
+            return self.options
+        return get_setting(connection, 'PGCRYPTO_OPTIONS', None)
+
+    def get_options_sql(self, connection):
+        """Get the options argument appended to the key of the encrypt sql."""
+        options = self.get_options(connection)
+        if not options:
+            return ''
+        return ", '{}'".format(options)
+
+    def get_encrypt_params(self, connection, bind_keys=None):
+        """Get the params `get_encrypt_sql` needs besides the value."""
+        if bind_keys is None:
+            bind_keys = self.bind_keys(connection)
+        if not bind_keys:
+            return []
+
+        return [self.get_key(connection, self.encrypt_key_setting)]
+
+    def get_key_ring_sql(self, connection, bind_keys):
+        """Get the sql for the array of the key ring of the decrypt key."""
+        if bind_keys:
+            return '%s'
+
+        keys = get_key_ring(connection, self.decrypt_key_setting)
+        return 'ARRAY[{}]'.format(', '.join(self.key_sql.format(key) for key in keys))
+
+    def get_key_ring_key(self, connection):
+        """Get the key ring of the decrypt key to bind as a query parameter."""
+        keys = get_key_ring(connection, self.decrypt_key_setting)
+        return BoundKey([self.prepare_key(key) for key in keys])
+
+    def get_decrypt_key_sql(self, connection, bind_keys):
+        """Get the sql for the decrypt key, the array of the key ring with key ids."""
+        if not self.key_ids(connection):
+            return self.get_key_sql(connection, self.decrypt_key_setting, bind_keys)
+        return self.get_key_ring_sql(connection, bind_keys)
+
+    def get_decrypt_key(self, connection):
+        """Get the decrypt key to bind as a query parameter, or the key ring."""
+        if not self.key_ids(connection):
+            return self.get_key(connection, self.decrypt_key_setting)
+        return self.get_key_ring_key(connection)
+
     def get_decrypt_sql(self, connection):
-        """Get decrypt sql."""
-        raise NotImplementedError('The `get_decrypt_sql` needs to be implemented.')
+        """Get decrypt sql.
+
+        The result is formatted again with the column and the cast so a bound
+        key placeholder has to be escaped.
+        """
+        bind_keys = self.bind_keys(connection)
+        key_sql = self.get_decrypt_key_sql(connection, bind_keys)
+        if self.key_ids(connection):
+            return self.key_ring_decrypt_sql.format(key_sql.replace('%', '%%'))
+        return self.decrypt_sql.format(key_sql.replace('%', '%%'))
+
+    def get_decrypt_params(self, connection):
+        """Get the params `get_decrypt_sql` needs besides the column."""
+        if not self.bind_keys(connection):
+            return []
+
+        return [self.get_decrypt_key(connection)]
+
+    @cached_property
+    def sql_cache(self):
+        """Get the cache of the sql fragments built for each database."""
+        return SQLCache()
+
+    def get_encrypt_fragment(self, connection, bind_keys=None):
+        """Get the encrypt sql and its key params, cached per database."""
+        def build():
+            return (
+                self.get_encrypt_sql(connection, bind_keys),
+                tuple(self.get_encrypt_params(connection, bind_keys)),
+            )
+
+        return self.sql_cache.get(('encrypt', connection.alias, bind_keys), build)
+
+    def get_decrypt_fragment(self, connection):
+        """Get the decrypt sql before and after the column and its key params.
+
+        The result is cached per database.
+        """
+        def build():
+            sql = self.get_decrypt_sql(connection) % (COLUMN_MARKER, self.get_cast_sql())
+            head, tail = sql.split(COLUMN_MARKER)
+            return head, tail, tuple(self.get_decrypt_params(connection))
+
+        return self.sql_cache.get(('decrypt', connection.alias), build)
 
     def get_col(self, alias, output_field=None):
         """Get the decryption for col."""
         if output_field is None:
             output_field = self
         if alias != self.model._meta.db_table or output_field != self:
-            return DecryptedCol(
-                alias,
-                self,
-                output_field
-            )
+            key = (alias, output_field)
+            if key not in self.cached_cols:
+                self.cached_cols[key] = DecryptedCol(alias, self, output_field)
+            return self.cached_cols[key]
         else:
             return self.cached_col
 
+    def with_data_key(self, sql, compiler, alias=None):
+        """Replace the data key marker of `sql` with the column of the data key."""
+        if self.data_key_field is None:
+            return sql
+
+        col = self.data_key_field.get_col(alias or self.model._meta.db_table)
+        col_sql, _ = compiler.compile(col)
+        return sql.replace(DATA_KEY_MARKER, col_sql)
+
+    @cached_property
+    def cached_cols(self):
+        """Get cached versions of decryption for col of other table aliases."""
+        return {}
+
+    def get_current_key_sql(self, connection):
+        """Get the sql telling a column holds a value encrypted with the current key.
+
+        The sql is formatted with the column and returned with its params, or
+        `None` when the key of a value isn't known.
+        """
+        return None
+
+    def get_reencrypt_decrypt_sql(self, column, connection):
+        """Get the sql decrypting the value of `column` to encrypt it again.
+
+        Returns the sql and its params.
+        """
+        sql = self.get_decrypt_sql(connection) % (column, 'TEXT')
+        return sql, self.get_decrypt_params(connection)
+
+    def get_reencrypt_sql(self, column, connection, decrypt_connection=None):
+        """Get the sql encrypting the value of `column` again with the current key.
+
+        The value is decrypted with the keys of `decrypt_connection`, by default
+        the ones of `connection`. Values already encrypted with the current key
+        are kept when `get_current_key_sql` can tell. Returns the sql and its params.
+        """
+        if decrypt_connection is None:
+            decrypt_connection = connection
+
+        decrypt_sql, decrypt_params = self.get_reencrypt_decrypt_sql(
+            column, decrypt_connection
+        )
+        encrypt_params = self.get_encrypt_params(connection)
+        sql = self.get_encrypt_sql(connection) % (
+            (decrypt_sql,) + ('%s',) * len(encrypt_params)
+        )
+        params = [*decrypt_params, *encrypt_params]
+
+        current = self.get_current_key_sql(connection)
+        if current is None:
+            return sql, params
+        current_sql, current_params = current
+        sql = 'CASE WHEN {} THEN {} ELSE {} END'.format(
+            current_sql.format(column), column, sql
+        )
+        return sql, [*current_params, *params]
+
+    def get_index_field(self, flag):
+        """Get the field of the model indexing this field with `flag` set, if any."""
+        for field in self.model._meta.local_concrete_fields:
+            if getattr(field, flag, False) and field.original == self.name:
+                return field
+        return None
+
+    @cached_property
+    def blind_index_field(self):
+        """Get the `BlindIndexField` of this field if the model has one."""
+        return self.get_index_field('is_blind_index')
+
+    @cached_property
+    def bucket_index_field(self):
+        """Get the `BucketIndexField` of this field if the model has one."""
+        return self.get_index_field('is_bucket_index')
+
+    @cached_property
+    def ngram_index_field(self):
+        """Get the `NgramIndexField` of this field if the model has one."""
+        return self.get_index_field('is_ngram_index')
+
     @cached_property
     def cached_col(self):
         """Get cached version of decryption for col."""
@@ -129,30 +847,231 @@ class PGPPublicKeyFieldMixin(PGPMixin):
     """PGP public key encrypted field mixin for postgres."""
     encrypt_sql = PGP_PUB_ENCRYPT_SQL
     decrypt_sql = PGP_PUB_DECRYPT_SQL
+    key_sql = PGP_PUB_KEY_SQL
+    encrypt_key_setting = 'PUBLIC_PGP_KEY'
+    decrypt_key_setting = 'PRIVATE_PGP_KEY'
     cast_type = 'TEXT'
+    client_decrypt = staticmethod(client.pgp_pub_decrypt)
+    key_ring_decrypt_sql = PGP_PUB_DECRYPT_KEY_RING_SQL
 
-    def get_placeholder(self, value=None, compiler=None, connection=None):
-        """Tell postgres to encrypt this field using PGP."""
-        return self.encrypt_sql.format(get_setting(connection, 'PUBLIC_PGP_KEY'))
+    def prepare_key(self, key):
+        """Get the dearmored key to bind as a query parameter."""
+        return dearmor(key)
+
+    @cached_property
+    def data_key_field(self):
+        """Get the `DataKeyField` of the model used to encrypt this field."""
+        if self.is_data_key:
+            return None
+        for field in self.model._meta.local_concrete_fields:
+            if getattr(field, 'is_data_key', False):
+                return field
+        return None
+
+    def pre_save(self, model_instance, add):
+        """Encrypt the value with the data key of the instance when known."""
+        value = super().pre_save(model_instance, add)
+        if self.data_key_field is not None and isinstance(value, EncryptedValue):
+            value.data_key = self.data_key_field.get_data_key(model_instance, add)
+        return value
+
+    def get_current_key_sql(self, connection):
+        """Compare the id of the key of the message with the one of the public key.
+
+        Values encrypted with a data key are left out.
+        """
+        if self.data_key_field is not None:
+            return None
+        key = self.get_key(connection, self.encrypt_key_setting)
+        return PGP_PUB_CURRENT_KEY_SQL, [key]
+
+    def get_encrypt_sql(self, connection, bind_keys=None):
+        """Get encrypt sql, with the data key of the row for envelope encryption.
+
+        The data key is decrypted with the private key, the rows without a data key
+        are encrypted with the public key.
+        """
+        if self.data_key_field is None:
+            return super().get_encrypt_sql(connection, bind_keys)
+        if bind_keys is None:
+            bind_keys = self.bind_keys(connection)
+        return PGP_ENVELOPE_ENCRYPT_SQL.format('{}, {}, {}{}'.format(
+            DATA_KEY_MARKER,
+            self.get_decrypt_key_sql(connection, bind_keys),
+            self.get_key_sql(connection, self.encrypt_key_setting, bind_keys),
+            self.get_options_sql(connection) or ', NULL',
+        ))
+
+    def get_encrypt_params(self, connection, bind_keys=None):
+        """Get the params `get_encrypt_sql` needs besides the value."""
+        if self.data_key_field is None:
+            return super().get_encrypt_params(connection, bind_keys)
+        if bind_keys is None:
+            bind_keys = self.bind_keys(connection)
+        if not bind_keys:
+            return []
+        return [
+            self.get_decrypt_key(connection),
+            self.get_key(connection, self.encrypt_key_setting),
+        ]
 
     def get_decrypt_sql(self, connection):
-        """Get decrypt sql."""
-        return self.decrypt_sql.format(get_setting(connection, 'PRIVATE_PGP_KEY'))
+        """Get decrypt sql, with the data key of the row for envelope encryption.
+
+        The rows without a data key are decrypted with the private key.
+        """
+        if self.data_key_field is None:
+            return super().get_decrypt_sql(connection)
+        key_sql = self.get_decrypt_key_sql(connection, self.bind_keys(connection))
+        return PGP_ENVELOPE_DECRYPT_SQL.format('{}, {}'.format(
+            DATA_KEY_MARKER, key_sql.replace('%', '%%')
+        ))
+
+    def encrypt_text(self, text, key):
+        """Encrypt `text` with the armored public key in python."""
+        return client.pgp_pub_encrypt(text, key)
 
 
 class PGPSymmetricKeyFieldMixin(PGPMixin):
     """PGP symmetric key encrypted field mixin for postgres."""
     encrypt_sql = PGP_SYM_ENCRYPT_SQL
     decrypt_sql = PGP_SYM_DECRYPT_SQL
+    key_sql = PGP_SYM_KEY_SQL
+    encrypt_key_setting = 'PGCRYPTO_KEY'
+    decrypt_key_setting = 'PGCRYPTO_KEY'
     cast_type = 'TEXT'
+    client_decrypt = staticmethod(client.pgp_sym_decrypt)
+    key_ring_decrypt_sql = PGP_SYM_DECRYPT_KEY_RING_SQL
+
+    def encrypt_text(self, text, key):
+        """Encrypt `text` with the password in python."""
+        return client.pgp_sym_encrypt(text, key)
+
+    def session_key(self, connection):
+        """Return `True` when the key is set for the session of the connection.
+
+        The keys of the key ring are always sent with the queries.
+        """
+        if self.key_ids(connection):
+            return False
+        return get_setting(connection, 'PGCRYPTO_SESSION_KEY', False)
+
+    def get_key_id(self, connection):
+        """Get `PGCRYPTO_KEY_ID`, the id of the key prefixing the messages."""
+        key_id = get_setting(connection, 'PGCRYPTO_KEY_ID', None)
+        if key_id is None:
+            raise ImproperlyConfigured(
+                'Set PGCRYPTO_KEY_ID to the id of PGCRYPTO_KEY to use PGCRYPTO_KEY_IDS.'
+            )
+        return int(key_id)
+
+    def get_current_key_sql(self, connection):
+        """Compare the key id prefixing the message with the one of the key.
+
+        Without key ids, the message is decrypted with the current key.
+        """
+        if not self.key_ids(connection):
+            return PGP_SYM_DECRYPTS_SQL, [
+                self.get_key(connection, self.encrypt_key_setting)
+            ]
+        return PGP_SYM_CURRENT_KEY_SQL, [self.get_key_id(connection)]
+
+    def get_reencrypt_decrypt_sql(self, column, connection):
+        """Decrypt with the first key of the key ring which can without key ids."""
+        if self.key_ids(connection) or self.session_key(connection):
+            return super().get_reencrypt_decrypt_sql(column, connection)
+
+        bind_keys = self.bind_keys(connection)
+        key_sql = self.get_key_ring_sql(connection, bind_keys)
+        sql = PGP_SYM_DECRYPT_ANY_SQL.format(key_sql.replace('%', '%%'))
+        params = [self.get_key_ring_key(connection)] if bind_keys else []
+        return sql % (column, 'TEXT'), params
+
+    def get_encrypt_sql(self, connection, bind_keys=None):
+        """Get encrypt sql, prefixing the message with the key id with key ids."""
+        if self.session_key(connection):
+            return PGP_SYM_ENCRYPT_SESSION_SQL.format(self.get_options_sql(connection))
+        if self.key_ids(connection):
+            if bind_keys is None:
+                bind_keys = self.bind_keys(connection)
+            key_sql = self.get_key_sql(connection, self.encrypt_key_setting, bind_keys)
+            return PGP_SYM_ENCRYPT_KEY_ID_SQL.format('{}, {}{}'.format(
+                key_sql, self.get_key_id(connection), self.get_options_sql(connection)
+            ))
+        return super().get_encrypt_sql(connection, bind_keys)
+
+    def get_decrypt_key_sql(self, connection, bind_keys):
+        """Get the sql for the decrypt key, followed by the key ids with key ids."""
+        key_sql = super().get_decrypt_key_sql(connection, bind_keys)
+        if not self.key_ids(connection):
+            return key_sql
 
-    def get_placeholder(self, value, compiler, connection):
-        """Tell postgres to encrypt this field using PGP."""
-        return self.encrypt_sql.format(get_setting(connection, 'PGCRYPTO_KEY'))
+        key_ids = [
+            'NULL' if key_id is None else str(int(key_id))
+            for key_id in get_key_ring_ids(connection)
+        ]
+        return '{}, ARRAY[{}]::integer[]'.format(key_sql, ', '.join(key_ids))
+
+    def get_encrypt_params(self, connection, bind_keys=None):
+        """Get the params `get_encrypt_sql` needs besides the value."""
+        if self.session_key(connection):
+            return []
+        return super().get_encrypt_params(connection, bind_keys)
 
     def get_decrypt_sql(self, connection):
         """Get decrypt sql."""
-        return self.decrypt_sql.format(get_setting(connection, 'PGCRYPTO_KEY'))
+        if self.session_key(connection):
+            return PGP_SYM_DECRYPT_SESSION_SQL
+        return super().get_decrypt_sql(connection)
+
+    def get_decrypt_params(self, connection):
+        """Get the params `get_decrypt_sql` needs besides the column."""
+        if self.session_key(connection):
+            return []
+        return super().get_decrypt_params(connection)
+
+
+class AESFieldMixin(PGPMixin):
+    """AES-256 encrypted field mixin for postgres.
+
+    Encrypts with `encrypt_iv` and a random IV for each value instead of the
+    OpenPGP format, which makes short values faster to encrypt and smaller.
+    The key is the sha256 digest of `PGCRYPTO_KEY`.
+    """
+    encrypt_sql = AES_ENCRYPT_SQL
+    decrypt_sql = AES_DECRYPT_SQL
+    key_sql = AES_KEY_SQL
+    encrypt_key_setting = 'PGCRYPTO_KEY'
+    decrypt_key_setting = 'PGCRYPTO_KEY'
+    cast_type = 'TEXT'
+    client_decrypt = staticmethod(client.aes_decrypt)
+
+    def prepare_key(self, key):
+        """Get the digest of the key to bind as a query parameter."""
+        return hashlib.sha256(key.encode()).digest()
+
+    def get_options_sql(self, connection):
+        """Get no options, they only apply to the PGP functions."""
+        return ''
+
+    def encrypt_text(self, text, key):
+        """Encrypt `text` with the key in python."""
+        return client.aes_encrypt(text, key)
+
+
+class DeterministicAESFieldMixin(AESFieldMixin):
+    """Deterministic AES-256 encrypted field mixin for postgres.
+
+    The IV is derived from the value so equal values have equal ciphertexts and
+    `exact` and `in` lookups, joins, unique constraints and indexes can compare
+    the stored bytes without decrypting them.
+    """
+    encrypt_sql = AES_DETERMINISTIC_ENCRYPT_SQL
+    deterministic = True
+
+    def encrypt_text(self, text, key):
+        """Encrypt `text` with the key in python."""
+        return client.aes_encrypt_deterministic(text, key)
 
 
 class DecimalPGPFieldMixin:
@@ -165,3 +1084,101 @@ class DecimalPGPFieldMixin:
             'max_digits': self.max_digits,
             'decimal_places': self.decimal_places
         }
+
+
+class RecordPGPFieldMixin:
+    """Record of many values encrypted together in one PGP field.
+
+    `fields` maps the name of each value to a field converting it. The values are
+    stored as JSON and each one is available as an attribute of the model.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        """Init the fields of the record."""
+        self.fields = fields or {}
+
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        """Add `fields` to the field arguments."""
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['fields'] = self.fields
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        """Add an attribute to the model for each value of the record."""
+        super().contribute_to_class(cls, name, **kwargs)
+
+        for field_name, field in self.fields.items():
+            setattr(cls, field_name, self.get_attribute(field_name, field))
+
+    def get_attribute(self, field_name, field):
+        """Get the property reading and writing a value of the record."""
+        def get_value(instance):
+            record = getattr(instance, self.attname)
+            return record.get(field_name) if record else None
+
+        def set_value(instance, value):
+            if not getattr(instance, self.attname):
+                setattr(instance, self.attname, {})
+            getattr(instance, self.attname)[field_name] = field.to_python(value)
+
+        return property(get_value, set_value)
+
+    def get_default(self):
+        """Get an empty record instead of an empty string for a non-null field."""
+        if not self.has_default() and not self.null:
+            return {}
+        return super().get_default()
+
+    def check(self, **kwargs):
+        """Check the values of the record don't hide a field of the model."""
+        return [
+            *super().check(**kwargs),
+            *self._check_record_fields(),
+        ]
+
+    def _check_record_fields(self):
+        if not hasattr(self, 'model'):
+            return []
+
+        field_names = {field.name for field in self.model._meta.get_fields()}
+        return [
+            checks.Error(
+                "'{}' of the record '{}' clashes with a field of the model.".format(
+                    field_name, self.name
+                ),
+                obj=self,
+                id='pgcrypto.E001',
+            )
+            for field_name in self.fields if field_name in field_names
+        ]
+
+    def from_db_value(self, value, expression, connection):
+        """Convert the decrypted JSON to a record."""
+        return self.to_python(value)
+
+    def from_text(self, text, connection):
+        """Convert the JSON decrypted in python to a record."""
+        return self.to_python(super().from_text(text, connection))
+
+    def to_python(self, value):
+        """Get the record of a JSON object, converting each value."""
+        if value is None:
+            return None
+        if value == '':
+            return None if self.null else {}
+        if isinstance(value, str):
+            value = json.loads(value)
+
+        return {
+            field_name: self.fields[field_name].to_python(field_value)
+            if field_name in self.fields else field_value
+            for field_name, field_value in value.items()
+        }
+
+    def get_prep_value(self, value):
+        """Get the JSON of the record to encrypt."""
+        if value is None:
+            return None
+        return json.dumps(value, cls=DjangoJSONEncoder)
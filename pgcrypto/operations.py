@@ -0,0 +1,334 @@
+import json
+
+from django.db import transaction
+from django.db.backends.utils import truncate_name
+from django.db.migrations.operations.fields import AlterField
+from django.db.models import CheckConstraint, Q, UniqueConstraint
+
+from pgcrypto.mixins import PGPMixin, PGPPublicKeyFieldMixin
+from pgcrypto.rotation import KeySettings
+
+# Suffix of the column holding the converted values until the columns are swapped.
+TEMPORARY_COLUMN_SUFFIX = '_pgcrypto_new'
+# Session settings holding the keys of the conversion, by position of the key.
+KEY_SETTING = 'pgcrypto_fields.convert_key_{}'
+SET_KEY_SETTING_SQL = 'SELECT set_config(%s, %s, false)'
+
+
+def get_key_setting_sql(name, key):
+    """Get the sql reading the key of a `BoundKey` from the setting `name`.
+
+    Returns the sql and the text of the key to set. Binary keys are set in hex and
+    key rings as a JSON array.
+    """
+    setting_sql = "current_setting('{}')".format(name)
+    if isinstance(key, list):
+        binary = any(isinstance(item, (bytes, memoryview)) for item in key)
+        return (
+            'ARRAY(SELECT {} FROM json_array_elements_text({}::json) '
+            'WITH ORDINALITY AS keys(key, position) ORDER BY position)'.format(
+                "decode(key, 'hex')" if binary else 'key', setting_sql
+            ),
+            json.dumps([bytes(item).hex() if binary else item for item in key]),
+        )
+    if isinstance(key, (bytes, memoryview)):
+        return "decode({}, 'hex')".format(setting_sql), bytes(key).hex()
+    return setting_sql, key
+
+
+def get_constraint_field_names(constraint):
+    """Get the names of the fields a constraint of `Meta.constraints` uses."""
+    if isinstance(constraint, UniqueConstraint):
+        return set(constraint.fields)
+    if isinstance(constraint, CheckConstraint):
+        return get_q_field_names(constraint.check)
+    return set()
+
+
+def get_q_field_names(q):
+    """Get the names of the fields a `Q` of a `CheckConstraint` refers to."""
+    names = set()
+    for child in q.children:
+        if isinstance(child, Q):
+            names |= get_q_field_names(child)
+        else:
+            names.add(child[0].split('__')[0])
+    return names
+
+
+class EncryptColumnInPlace(AlterField):
+    """Alter a plaintext field to a PGP field, encrypting its values in batches.
+
+    A `bytea` column is added next to the plaintext one and filled in batches of
+    `batch_size` rows ordered by primary key, each committed on its own when the
+    migration isn't atomic. A temporary trigger encrypts the values written in the
+    meantime. The columns are then swapped while the table is locked and the
+    indexes and constraints of the field are created again.
+
+    Reversing the operation decrypts the values the same way.
+    """
+
+    def __init__(self, model_name, name, field, batch_size=1000, preserve_default=True):
+        """Init the operation altering `name` of `model_name` to `field`."""
+        self.batch_size = batch_size
+        super().__init__(model_name, name, field, preserve_default)
+
+    def deconstruct(self):
+        """Add `batch_size` to the arguments of `AlterField`."""
+        name, args, kwargs = super().deconstruct()
+        if self.batch_size != 1000:
+            kwargs['batch_size'] = self.batch_size
+        return name, args, kwargs
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        """Encrypt the plaintext column with the new field."""
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            return
+
+        from_model = from_state.apps.get_model(app_label, self.model_name)
+        from_field = from_model._meta.get_field(self.name)
+        to_field = to_model._meta.get_field(self.name)
+        # The public key isn't secret, it is written into the sql.
+        settings = self.get_key_settings(
+            schema_editor, to_field,
+            bind_keys=not isinstance(to_field, PGPPublicKeyFieldMixin),
+        )
+        params = to_field.get_encrypt_params(settings)
+
+        def get_value_sql(column):
+            return to_field.get_encrypt_sql(settings) % (
+                ('{}::text'.format(column),) + ('%s',) * len(params)
+            )
+
+        self.convert_column(
+            schema_editor, to_model, from_field, to_field, get_value_sql, params
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        """Decrypt the encrypted column back to the old field."""
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            return
+
+        from_model = from_state.apps.get_model(app_label, self.model_name)
+        from_field = from_model._meta.get_field(self.name)
+        to_field = to_model._meta.get_field(self.name)
+        settings = self.get_key_settings(schema_editor, from_field)
+
+        def get_value_sql(column):
+            return from_field.get_decrypt_sql(settings) % (
+                column, from_field.get_cast_sql()
+            )
+
+        self.convert_column(
+            schema_editor,
+            to_model,
+            from_field,
+            to_field,
+            get_value_sql,
+            from_field.get_decrypt_params(settings),
+        )
+
+    def get_key_settings(self, schema_editor, field, bind_keys=True):
+        """Get the settings building the sql of `field` with its keys as params.
+
+        Fields encrypted with a data key can't be converted, their data key is
+        generated for each row.
+        """
+        if not isinstance(field, PGPMixin):
+            raise ValueError(
+                '{} only converts to or from a PGP field, not {}.'.format(
+                    self.__class__.__name__, field.__class__.__name__
+                )
+            )
+        if field.data_key_field is not None:
+            raise ValueError(
+                '{} cannot convert {}, it is encrypted with a data key.'.format(
+                    self.__class__.__name__, field.name
+                )
+            )
+        return KeySettings(schema_editor.connection, {}, bind_keys=bind_keys)
+
+    def get_key_settings_sql(self, keys):
+        """Get the sql reading each key from its session setting.
+
+        Returns the sql of the keys, the condition telling the session has them and
+        the values of the settings.
+        """
+        keys_sql, conditions, values = [], [], []
+        for index, key in enumerate(keys):
+            name = KEY_SETTING.format(index)
+            key_sql, value = get_key_setting_sql(name, key.key)
+            keys_sql.append(key_sql)
+            conditions.append("current_setting('{}', true) <> ''".format(name))
+            values.append((name, value))
+        return keys_sql, ' AND '.join(conditions), values
+
+    def convert_column(
+        self, schema_editor, model, from_field, to_field, get_value_sql, keys=(),
+    ):
+        """Replace the column of `from_field` by one of `to_field`.
+
+        `get_value_sql` gets the sql converting the value of a column, with a
+        placeholder for each of the `keys`. The keys are set in settings of the
+        session rather than written into the trigger function, so they can't be
+        read in `pg_proc`. The trigger leaves the rows written by other sessions,
+        which don't have the keys, to be converted once the table is locked.
+        """
+        connection = schema_editor.connection
+        quote_name = schema_editor.quote_name
+        max_length = connection.ops.max_name_length()
+        table = quote_name(model._meta.db_table)
+        pk = quote_name(model._meta.pk.column)
+        column = quote_name(from_field.column)
+        temporary = quote_name(
+            truncate_name(from_field.column + TEMPORARY_COLUMN_SUFFIX, max_length)
+        )
+        function = quote_name(truncate_name(
+            'pgcrypto_convert_{}_{}'.format(model._meta.db_table, from_field.column),
+            max_length,
+        ))
+        keys_sql, has_keys_sql, key_settings = self.get_key_settings_sql(keys)
+
+        def get_sql(column):
+            sql = get_value_sql(column)
+            return sql % tuple(keys_sql) if keys_sql else sql
+
+        self.set_key_settings(schema_editor, key_settings)
+
+        # `None` params keep the sql from being formatted.
+        schema_editor.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+            table, temporary, to_field.db_type(connection)
+        ), None)
+        assignment = 'NEW.{} := {};'.format(temporary, get_sql('NEW.' + column))
+        if has_keys_sql:
+            assignment = 'IF {} THEN {} ELSE NEW.{} := NULL; END IF;'.format(
+                has_keys_sql, assignment, temporary
+            )
+        schema_editor.execute(
+            'CREATE FUNCTION {}() RETURNS trigger AS $$ BEGIN '
+            '{} RETURN NEW; END $$ LANGUAGE plpgsql'.format(function, assignment),
+            None,
+        )
+        schema_editor.execute(
+            'CREATE TRIGGER {0} BEFORE INSERT OR UPDATE OF {1} ON {2} '
+            'FOR EACH ROW EXECUTE PROCEDURE {0}()'.format(function, column, table),
+            None,
+        )
+
+        update_sql = 'UPDATE {table} SET {temporary} = {value}'.format(
+            table=table,
+            temporary=temporary,
+            value=get_sql('{}.{}'.format(table, column)),
+        )
+        if schema_editor.collect_sql:
+            schema_editor.execute(update_sql, None)
+        else:
+            self.backfill(connection, update_sql.replace('%', '%%'), table, pk)
+
+        with transaction.atomic(using=connection.alias):
+            schema_editor.execute(
+                'LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(table), None
+            )
+            if has_keys_sql:
+                schema_editor.execute(
+                    '{} WHERE {} IS NULL AND {} IS NOT NULL'.format(
+                        update_sql, temporary, column
+                    ),
+                    None,
+                )
+            schema_editor.execute('DROP TRIGGER {} ON {}'.format(function, table), None)
+            schema_editor.execute('DROP FUNCTION {}()'.format(function), None)
+            schema_editor.execute(
+                'ALTER TABLE {} DROP COLUMN {}'.format(table, column), None
+            )
+            schema_editor.execute('ALTER TABLE {} RENAME COLUMN {} TO {}'.format(
+                table, temporary, quote_name(to_field.column)
+            ), None)
+            if not to_field.null:
+                schema_editor.execute(
+                    'ALTER TABLE {} ALTER COLUMN {} SET NOT NULL'.format(
+                        table, quote_name(to_field.column)
+                    ),
+                    None,
+                )
+            self.create_constraints(schema_editor, model, to_field)
+
+        self.set_key_settings(schema_editor, [(name, '') for name, _ in key_settings])
+
+    def set_key_settings(self, schema_editor, key_settings):
+        """Set the keys in the settings of the session.
+
+        Unless the sql is collected, they are set by a cursor rather than by
+        `schema_editor` which logs its statements.
+        """
+        for name, value in key_settings:
+            if schema_editor.collect_sql:
+                schema_editor.execute(SET_KEY_SETTING_SQL, [name, value])
+            else:
+                with schema_editor.connection.cursor() as cursor:
+                    cursor.execute(SET_KEY_SETTING_SQL, [name, value])
+
+    def create_constraints(self, schema_editor, model, field):
+        """Create the indexes and constraints of the model which use `field`.
+
+        Dropping the old column dropped the ones using it.
+        """
+        opts = model._meta
+        names = {field.name, field.attname}
+        statements = list(schema_editor._field_indexes_sql(model, field))
+        if field.unique and not field.primary_key:
+            statements.append(schema_editor._create_unique_sql(model, [field.column]))
+        for field_names in opts.unique_together:
+            if names.intersection(field_names):
+                columns = [opts.get_field(name).column for name in field_names]
+                statements.append(schema_editor._create_unique_sql(model, columns))
+        for field_names in opts.index_together:
+            if names.intersection(field_names):
+                fields = [opts.get_field(name) for name in field_names]
+                statements.append(
+                    schema_editor._create_index_sql(model, fields, suffix='_idx')
+                )
+        statements.extend(
+            index.create_sql(model, schema_editor) for index in opts.indexes
+            if names.intersection(name.lstrip('-') for name in index.fields)
+        )
+        statements.extend(
+            constraint.create_sql(model, schema_editor)
+            for constraint in opts.constraints
+            if names & get_constraint_field_names(constraint)
+        )
+
+        for statement in statements:
+            if statement is not None:
+                schema_editor.execute(statement)
+
+    def backfill(self, connection, update_sql, table, pk):
+        """Run `update_sql` on the rows by batch, paginated by primary key."""
+        after = None
+        while True:
+            if after is None:
+                condition, params = 'TRUE', []
+            else:
+                condition, params = '{} > %s'.format(pk), [after]
+            sql = (
+                '{} WHERE {pk} IN (SELECT {pk} FROM {} WHERE {} ORDER BY {pk} LIMIT %s) '
+                'RETURNING {pk}'
+            ).format(update_sql, table, condition, pk=pk)
+
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, params + [self.batch_size])
+                    pks = [row[0] for row in cursor.fetchall()]
+            if not pks:
+                return
+            after = max(pks)
+
+    def describe(self):
+        """Describe the operation in the output of `migrate`."""
+        return 'Encrypt field {} on {} in place'.format(self.name, self.model_name)
+
+    def reduce(self, operation, app_label):
+        """Keep the operation, it can't be merged into a plain `AlterField`."""
+        return super(AlterField, self).reduce(operation, app_label)
@@ -0,0 +1,95 @@
+import threading
+
+from django.db import connections, transaction
+
+from pgcrypto.mixins import get_setting, PGPMixin
+
+
+class PendingRepairs(threading.local):
+    """Primary keys of the rows to encrypt again, by database and model."""
+
+    def __init__(self):
+        """Init the rows of the thread."""
+        self.rows = {}
+
+
+pending = PendingRepairs()
+
+
+def get_repaired_fields(model, connection):
+    """Get the fields of `model` whose values of old keys can be encrypted again.
+
+    Those are the fields using the key ring whose key of a value is known.
+    """
+    return [
+        field for field in model._meta.local_concrete_fields
+        if isinstance(field, PGPMixin) and field.key_ids(connection) and (
+            field.get_current_key_sql(connection) is not None
+        )
+    ]
+
+
+def schedule(model, using, pks):
+    """Encrypt the rows `pks` again at the end of the transaction or request.
+
+    Outside of a transaction the rows are kept until `flush` is called, by the end
+    of the request. The rows of the database are repaired at once when
+    `PGCRYPTO_REPAIR_BATCH_SIZE` of them are pending, so a long running process
+    doesn't collect them forever.
+    """
+    pending.rows.setdefault((using, model), set()).update(pks)
+
+    batch_size = get_setting(connections[using], 'PGCRYPTO_REPAIR_BATCH_SIZE', 1000)
+    count = sum(len(rows) for (alias, _), rows in pending.rows.items() if alias == using)
+    if count >= batch_size:
+        flush(using, batch_size)
+    elif connections[using].in_atomic_block:
+        transaction.on_commit(lambda: flush(using), using=using)
+
+
+def flush(using=None, batch_size=None):
+    """Encrypt again the rows scheduled for the database `using`, or all of them.
+
+    The rows are updated `batch_size` at a time, by default
+    `PGCRYPTO_REPAIR_BATCH_SIZE`.
+    """
+    for key in list(pending.rows):
+        if using is None or key[0] == using:
+            alias, model = key
+            pks = pending.rows.pop(key)
+            size = batch_size or get_setting(
+                connections[alias], 'PGCRYPTO_REPAIR_BATCH_SIZE', 1000
+            )
+            repair(model, alias, sorted(pks), size)
+
+
+def repair(model, using, pks, batch_size=1000):
+    """Encrypt the values of old keys of the rows `pks` again, `batch_size` at a time.
+
+    A value encrypted with the current key since it was read is kept.
+    """
+    connection = connections[using]
+    fields = get_repaired_fields(model, connection)
+    if not fields or not pks:
+        return
+
+    quote_name = connection.ops.quote_name
+    opts = model._meta
+    table = quote_name(opts.db_table)
+    sets, params = [], []
+    for field in fields:
+        column = '{}.{}'.format(table, quote_name(field.column))
+        sql, field_params = field.get_reencrypt_sql(column, connection)
+        sets.append('{} = {}'.format(quote_name(field.column), sql))
+        params.extend(field_params)
+
+    for offset in range(0, len(pks), batch_size):
+        batch = pks[offset:offset + batch_size]
+        sql = 'UPDATE {} SET {} WHERE {} IN ({})'.format(
+            table,
+            ', '.join(sets),
+            quote_name(opts.pk.column),
+            ', '.join(['%s'] * len(batch)),
+        )
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(sql, params + batch)
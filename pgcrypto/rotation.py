@@ -0,0 +1,318 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections, transaction
+from django.db.backends.utils import truncate_name
+from django.db.models import Max, Min
+
+from pgcrypto.mixins import get_setting, PGPMixin, PGPPublicKeyFieldMixin
+
+# Types of the primary keys split in ranges for parallel workers.
+INTEGER_TYPES = {
+    'AutoField', 'BigAutoField', 'SmallAutoField',
+    'IntegerField', 'BigIntegerField', 'SmallIntegerField',
+    'PositiveIntegerField', 'PositiveBigIntegerField', 'PositiveSmallIntegerField',
+}
+
+
+class KeySettings:
+    """Connection whose settings have the given keys, bound as query parameters.
+
+    The fields build their sql with these keys instead of the ones of the database.
+    The keys are written into the sql when `bind_keys` is `False`.
+    """
+
+    def __init__(self, connection, keys, bind_keys=True):
+        """Init the settings of `connection` overridden by `keys`."""
+        self.connection = connection
+        self.settings_dict = {
+            **connection.settings_dict,
+            **keys,
+            'PGCRYPTO_BIND_KEYS': bind_keys,
+            'PGCRYPTO_SESSION_KEY': False,
+        }
+
+    def __getattr__(self, name):
+        """Get the other attributes of the connection."""
+        return getattr(self.connection, name)
+
+
+class Checkpoint:
+    """Progress of a rotation, saved to a JSON file after each batch."""
+
+    def __init__(self, path):
+        """Load the progress saved in `path`, if any."""
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as checkpoint_file:
+                self.progress = json.load(checkpoint_file)
+        except FileNotFoundError:
+            self.progress = {}
+
+    def get(self, key, default=None):
+        """Get the progress saved for `key`."""
+        return self.progress.get(key, default)
+
+    def set(self, key, value):
+        """Save the progress of `key`."""
+        with self.lock:
+            self.progress[key] = value
+            self.save()
+
+    def delete(self, *keys):
+        """Remove the progress of `keys`."""
+        with self.lock:
+            for key in keys:
+                self.progress.pop(key, None)
+            self.save()
+
+    def save(self):
+        """Replace the file at once with the progress."""
+        path = self.path + '.tmp'
+        with open(path, 'w') as checkpoint_file:
+            json.dump(self.progress, checkpoint_file, default=str)
+        os.replace(path, self.path)
+
+
+def get_old_keys(connection):
+    """Get the old keys of `PGCRYPTO_OLD_KEYS` by the name of their setting."""
+    return get_setting(connection, 'PGCRYPTO_OLD_KEYS', {})
+
+
+def get_rotated_fields(model, old_keys):
+    """Get the fields of `model` encrypted with one of the keys of `old_keys`.
+
+    The fields encrypted with a data key are left out, rotating the `DataKeyField`
+    encrypts their data key again.
+    """
+    return [
+        field for field in model._meta.local_concrete_fields
+        if isinstance(field, PGPMixin) and field.data_key_field is None and (
+            field.decrypt_key_setting in old_keys
+        )
+    ]
+
+
+def check_rotated_fields(model, connection, old_keys):
+    """Raise `ValueError` if a rotated field of `model` can't tell the key of a value.
+
+    Rotating such a field again, e.g. after an interruption, would decrypt the
+    values encrypted with the current key with an old one.
+    """
+    names = [
+        field.name for field in get_rotated_fields(model, old_keys)
+        if field.get_current_key_sql(connection) is None
+    ]
+    if names:
+        raise ValueError(
+            "The key of the values of {} of {} isn't known, they can't be "
+            'rotated.'.format(', '.join(names), model._meta.label)
+        )
+
+
+class KeyRotation:
+    """Encrypt the PGP fields of a model again with the current keys.
+
+    The rows are updated in batches ordered by primary key, each by a single
+    `UPDATE` decrypting the values with the old keys and encrypting them with the
+    current ones. The last primary key of each batch is saved to a `Checkpoint`,
+    cleared once the model is rotated.
+
+    Primary keys which aren't integers are copied to a table at the start, the rows
+    added later can't be told apart by their primary key.
+
+    The values already encrypted with the current key are kept, the other ones are
+    decrypted with the old key they need, so a model can be rotated again.
+    """
+
+    def __init__(self, model, using, old_keys, checkpoint):
+        """Init the rotation of `model` in the database `using`."""
+        self.model = model
+        self.using = using
+        self.checkpoint = checkpoint
+        self.fields = get_rotated_fields(model, old_keys)
+        self.key = '{}:{}'.format(using, model._meta.label)
+        self.snapshot = model._meta.pk.get_internal_type() not in INTEGER_TYPES
+
+        connection = connections[using]
+        self.new_settings = KeySettings(connection, {'PGCRYPTO_OLD_KEYS': old_keys})
+        # Public key messages carry the id of their key, the key ring decrypts
+        # them with the private key they need.
+        self.key_ring_settings = KeySettings(connection, {
+            'PGCRYPTO_OLD_KEYS': old_keys, 'PGCRYPTO_KEY_IDS': True,
+        })
+        check_rotated_fields(model, self.new_settings, old_keys)
+
+    def get_set_sql(self, field, table):
+        """Get the sql encrypting the column of `field` again, and its params."""
+        quote_name = self.new_settings.ops.quote_name
+        column = '{}.{}'.format(table, quote_name(field.column))
+
+        if isinstance(field, PGPPublicKeyFieldMixin):
+            decrypt_settings = self.key_ring_settings
+        else:
+            decrypt_settings = self.new_settings
+        sql, params = field.get_reencrypt_sql(column, self.new_settings, decrypt_settings)
+        return '{} = {}'.format(quote_name(field.column), sql), params
+
+    def get_snapshot_table(self):
+        """Get the name of the table of the primary keys to rotate."""
+        ops = self.new_settings.ops
+        return ops.quote_name(truncate_name(
+            'pgcrypto_rotation_{}'.format(self.model._meta.db_table),
+            ops.max_name_length(),
+        ))
+
+    def create_snapshot(self):
+        """Copy the primary keys of the rows to rotate to the snapshot table."""
+        quote_name = self.new_settings.ops.quote_name
+        opts = self.model._meta
+        snapshot = self.get_snapshot_table()
+        pk = quote_name(opts.pk.column)
+
+        with transaction.atomic(using=self.using):
+            with connections[self.using].cursor() as cursor:
+                cursor.execute('DROP TABLE IF EXISTS {}'.format(snapshot))
+                cursor.execute('CREATE TABLE {} AS SELECT {} FROM {}'.format(
+                    snapshot, pk, quote_name(opts.db_table)
+                ))
+                cursor.execute('ALTER TABLE {} ADD PRIMARY KEY ({})'.format(snapshot, pk))
+
+    def get_update_sql(self):
+        """Get the `UPDATE` of a batch of rows and the params of its `SET`.
+
+        The sql is formatted with the bounds of the batch and returns the primary
+        keys of the batch.
+        """
+        quote_name = self.new_settings.ops.quote_name
+        opts = self.model._meta
+        table = quote_name(opts.db_table)
+        source = self.get_snapshot_table() if self.snapshot else table
+        pk = quote_name(opts.pk.column)
+
+        sets, params = [], []
+        for field in self.fields:
+            sql, field_params = self.get_set_sql(field, table)
+            sets.append(sql)
+            params.extend(field_params)
+
+        # The rows of the snapshot deleted since are in the batch but not updated.
+        sql = (
+            'WITH batch AS '
+            '(SELECT {pk} FROM {source} WHERE {{}} ORDER BY {pk} LIMIT %s), '
+            'updated AS (UPDATE {table} SET {sets} FROM batch '
+            'WHERE {table}.{pk} = batch.{pk}) '
+            'SELECT {pk} FROM batch ORDER BY {pk}'
+        ).format(pk=pk, source=source, table=table, sets=', '.join(sets))
+        return sql, params
+
+    def get_ranges(self, workers):
+        """Get the ranges of primary keys to rotate, saved on the first run.
+
+        A range is the primary key its rows follow (`None` from the first row)
+        and its last primary key. Rows added later are encrypted with the current
+        keys already.
+        """
+        ranges = self.checkpoint.get(self.key)
+        if ranges is not None:
+            return ranges
+
+        if self.snapshot:
+            self.create_snapshot()
+        pk = self.model._meta.pk
+        bounds = self.model._base_manager.using(self.using).aggregate(
+            first=Min(pk.attname), last=Max(pk.attname)
+        )
+        first, last = bounds['first'], bounds['last']
+        if last is None:
+            ranges = []
+        elif workers == 1 or self.snapshot:
+            ranges = [[None, last]]
+        else:
+            step = max((last - first + 1) // workers, 1)
+            bounds = list(range(first - 1, last, step))[:workers] + [last]
+            ranges = [[after, end] for after, end in zip(bounds, bounds[1:])]
+            ranges[0][0] = None
+
+        self.checkpoint.set(self.key, ranges)
+        return ranges
+
+    def rotate_range(self, index, batch_size, rate, progress):
+        """Rotate the rows of a range by batch and save the last primary key."""
+        connection = connections[self.using]
+        update_sql, update_params = self.get_update_sql()
+        pk = connection.ops.quote_name(self.model._meta.pk.column)
+        after, last = self.checkpoint.get(self.key)[index]
+        range_key = '{}:{}'.format(self.key, index)
+        after = self.checkpoint.get(range_key, after)
+
+        while True:
+            started = time.monotonic()
+            conditions, params = ['{} <= %s'.format(pk)], [last]
+            if after is not None:
+                conditions.insert(0, '{} > %s'.format(pk))
+                params.insert(0, after)
+
+            with transaction.atomic(using=self.using):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        update_sql.format(' AND '.join(conditions)),
+                        params + [batch_size] + update_params,
+                    )
+                    pks = [row[0] for row in cursor.fetchall()]
+            if not pks:
+                return
+
+            after = pks[-1]
+            self.checkpoint.set(range_key, after)
+            if progress is not None:
+                progress(self.model, len(pks))
+
+            if rate:
+                time.sleep(max(len(pks) / rate - (time.monotonic() - started), 0))
+
+    def rotate(self, batch_size=1000, workers=1, rate=None, progress=None):
+        """Rotate the keys of the rows, `batch_size` rows at a time.
+
+        `workers` threads rotate disjoint ranges of primary keys, together at most
+        `rate` rows per second when set. `progress` is called with the model and
+        the number of rows of each batch.
+        """
+        if not self.fields:
+            return
+
+        ranges = self.get_ranges(workers)
+        if workers == 1:
+            for index in range(len(ranges)):
+                self.rotate_range(index, batch_size, rate, progress)
+        else:
+            workers = min(workers, len(ranges))
+
+            def rotate_range(index):
+                try:
+                    self.rotate_range(
+                        index, batch_size, rate and rate / workers, progress
+                    )
+                finally:
+                    connections[self.using].close()
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(rotate_range, range(len(ranges))):
+                    pass
+
+        self.finish(len(ranges))
+
+    def finish(self, count):
+        """Drop the snapshot table and clear the progress of the `count` ranges."""
+        if self.snapshot:
+            with connections[self.using].cursor() as cursor:
+                cursor.execute(
+                    'DROP TABLE IF EXISTS {}'.format(self.get_snapshot_table())
+                )
+        self.checkpoint.delete(
+            self.key, *('{}:{}'.format(self.key, index) for index in range(count))
+        )
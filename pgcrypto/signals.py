@@ -0,0 +1,39 @@
+from pgcrypto import repair
+from pgcrypto.binding import execute_bound_keys
+from pgcrypto.mixins import get_setting, SQLCache
+
+SET_SESSION_KEY_SQL = "SELECT set_config('pgcrypto_fields.key', %s, false)"
+
+
+def set_session_key(sender, connection, **kwargs):
+    """Set `PGCRYPTO_KEY` for the session of a new connection.
+
+    Only done when `PGCRYPTO_SESSION_KEY` is set for the connection.
+    """
+    if connection.vendor != 'postgresql':
+        return
+
+    if not get_setting(connection, 'PGCRYPTO_SESSION_KEY', False):
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(SET_SESSION_KEY_SQL, [get_setting(connection, 'PGCRYPTO_KEY')])
+
+
+def install_key_binding(sender, connection, **kwargs):
+    """Send the keys bound by `PGCRYPTO_BIND_KEYS` once per statement."""
+    if connection.vendor != 'postgresql':
+        return
+
+    if execute_bound_keys not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_bound_keys)
+
+
+def clear_sql_cache(sender, **kwargs):
+    """Clear the sql cached by the fields when a setting changes."""
+    SQLCache.clear_all()
+
+
+def flush_repairs(sender, **kwargs):
+    """Encrypt again the rows with values of old keys read during the request."""
+    repair.flush()
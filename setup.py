@@ -36,6 +36,9 @@ setup(
     packages=find_packages(exclude=['tests']),
     include_package_data=True,
     version=version,
+    extras_require={
+        'client': ['pgpy'],
+    },
     python_requires='>={}.{}'.format(*REQUIRED_PYTHON),
     license='BSD',
     description='Encrypted fields for Django dealing with pgcrypto postgres extension.',
@@ -12,8 +12,8 @@ class EncryptedDiff(models.Model):
                                              choices=CHOICES, max_length=1)
     sym_field = fields.CharPGPSymmetricKeyField(blank=True, null=True,
                                                 choices=CHOICES, max_length=1)
-    digest_field = fields.TextDigestField(blank=True, null=True)
-    hmac_field = fields.TextHMACField(blank=True, null=True)
+    digest_field = fields.TextDigestField(blank=True, null=True, db_index=True)
+    hmac_field = fields.TextHMACField(blank=True, null=True, db_index=True)
 
     class Meta:
         """Sets up the meta for the test model."""
@@ -1,6 +1,10 @@
+import uuid
+
+from django.contrib.postgres.indexes import GinIndex, HashIndex
 from django.db import models
 
 from pgcrypto import fields
+from pgcrypto.managers import EncryptedManager
 
 
 class EncryptedFKModel(models.Model):
@@ -12,7 +16,7 @@ class EncryptedFKModel(models.Model):
         app_label = 'tests'
 
 
-class EncryptedModelManager(models.Manager):
+class EncryptedModelManager(EncryptedManager):
 
     def get_by_natural_key(self, email_pgp_pub_field):
         """Get by natual key of email pub field."""
@@ -21,9 +25,10 @@ class EncryptedModelManager(models.Manager):
 
 class EncryptedModel(models.Model):
     """Dummy model used for tests to check the fields."""
-    digest_field = fields.TextDigestField(blank=True, null=True)
+    digest_field = fields.TextDigestField(blank=True, null=True, db_index=True)
     digest_with_original_field = fields.TextDigestField(blank=True, null=True,
-                                                        original='pgp_sym_field')
+                                                        original='pgp_sym_field',
+                                                        db_index=True)
     hmac_field = fields.TextHMACField(blank=True, null=True)
     hmac_with_original_field = fields.TextHMACField(blank=True, null=True,
                                                     original='pgp_sym_field')
@@ -68,6 +73,13 @@ class EncryptedModel(models.Model):
     class Meta:
         """Sets up the meta for the test model."""
         app_label = 'tests'
+        indexes = [
+            HashIndex(fields=['hmac_field'], name='hmac_field_hash_of'),
+            HashIndex(
+                fields=['hmac_with_original_field'],
+                name='hmac_with_original_hash_of',
+            ),
+        ]
 
 
 class EncryptedDateTime(models.Model):
@@ -83,3 +95,135 @@ class RelatedDateTime(models.Model):
         EncryptedDateTime, null=True,
         on_delete=models.CASCADE, related_name='related_again'
     )
+
+
+class EncryptedBlindIndex(models.Model):
+    """Dummy model used to test blind indexes."""
+    email_pgp_pub_field = fields.EmailPGPPublicKeyField(blank=True, null=True)
+    email_blind_index = fields.BlindIndexField(
+        original='email_pgp_pub_field', blank=True, null=True
+    )
+
+    objects = EncryptedManager()
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
+
+
+class EncryptedBucketIndex(models.Model):
+    """Dummy model used to test bucket indexes."""
+    date_pgp_sym_field = fields.DatePGPSymmetricKeyField(blank=True, null=True)
+    date_bucket_index = fields.BucketIndexField(
+        original='date_pgp_sym_field', width='month', blank=True, null=True
+    )
+    integer_pgp_sym_field = fields.IntegerPGPSymmetricKeyField(blank=True, null=True)
+    integer_bucket_index = fields.BucketIndexField(
+        original='integer_pgp_sym_field', width=10, blank=True, null=True
+    )
+
+    objects = EncryptedManager()
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
+
+
+class EncryptedNgramIndex(models.Model):
+    """Dummy model used to test n-gram indexes."""
+    email_pgp_pub_field = fields.EmailPGPPublicKeyField(blank=True, null=True)
+    email_ngram_index = fields.NgramIndexField(original='email_pgp_pub_field')
+
+    objects = EncryptedManager()
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
+        indexes = [
+            GinIndex(fields=['email_ngram_index'], name='email_ngram_index_gin'),
+        ]
+
+
+class EncryptedUnique(models.Model):
+    """Dummy model used to test unique blind indexes."""
+    email_pgp_sym_field = fields.EmailPGPSymmetricKeyField()
+    email_blind_index = fields.BlindIndexField(
+        original='email_pgp_sym_field', unique=True
+    )
+    text_pgp_sym_field = fields.TextPGPSymmetricKeyField(blank=True, null=True)
+
+    objects = EncryptedManager()
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
+
+
+class EncryptedEnvelope(models.Model):
+    """Dummy model used to test the envelope encryption of public key fields."""
+    data_key = fields.DataKeyField()
+    pgp_pub_field = fields.TextPGPPublicKeyField(blank=True, null=True)
+    integer_pgp_pub_field = fields.IntegerPGPPublicKeyField(blank=True, null=True)
+    date_pgp_pub_field = fields.DatePGPPublicKeyField(blank=True, null=True)
+    pgp_sym_field = fields.TextPGPSymmetricKeyField(blank=True, null=True)
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
+
+
+class EncryptedRecord(models.Model):
+    """Dummy model used to test record fields."""
+    sym_record = fields.RecordPGPSymmetricKeyField(blank=True, null=True, fields={
+        'age': models.IntegerField(),
+        'birthday': models.DateField(),
+        'active': models.BooleanField(),
+    })
+    pub_record = fields.RecordPGPPublicKeyField(blank=True, null=True, fields={
+        'balance': models.DecimalField(max_digits=8, decimal_places=2),
+        'last_login': models.DateTimeField(),
+    })
+    profile = fields.RecordPGPSymmetricKeyField(fields={
+        'nickname': models.CharField(max_length=50),
+    })
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
+
+
+class EncryptedAES(models.Model):
+    """Dummy model used to test AES fields."""
+    text_aes_field = fields.TextAESField(blank=True, null=True)
+    integer_aes_field = fields.IntegerAESField(blank=True, null=True)
+    date_aes_field = fields.DateAESField(blank=True, null=True)
+    decimal_aes_field = fields.DecimalAESField(
+        max_digits=8, decimal_places=2, null=True, blank=True
+    )
+    boolean_aes_field = fields.BooleanAESField(blank=True, null=True)
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
+
+
+class EncryptedDeterministic(models.Model):
+    """Dummy model used to test deterministic AES fields."""
+    text_field = fields.TextDeterministicAESField(blank=True, null=True)
+    email_field = fields.EmailDeterministicAESField(blank=True, null=True)
+    integer_field = fields.IntegerDeterministicAESField(blank=True, null=True)
+    date_field = fields.DateDeterministicAESField(blank=True, null=True)
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
+
+
+class EncryptedUUID(models.Model):
+    """Dummy model used to test the rotation of a primary key which isn't an integer."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    pgp_sym_field = fields.TextPGPSymmetricKeyField(blank=True, null=True)
+
+    class Meta:
+        """Sets up the meta for the test model."""
+        app_label = 'tests'
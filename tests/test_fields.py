@@ -1,19 +1,39 @@
+import io
+import os
+import tempfile
 from datetime import date, datetime
 from decimal import Decimal
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from django import VERSION as DJANGO_VERSION
 from django.conf import settings
-from django.db import connections, models, reset_queries
-from django.test import TestCase
+from django.core.management import call_command, CommandError
+from django.db import (
+    connections, IntegrityError, migrations, models, reset_queries, transaction,
+)
+from django.db.migrations.state import ProjectState
+from django.test import override_settings, TestCase
+from django.test.utils import CaptureQueriesContext, isolate_apps
 from incuna_test_utils.utils import field_names
 
-from pgcrypto import fields
+from pgcrypto import client, fields, managers, repair
+from pgcrypto.binding import bind_keys_once, BoundKey
+from pgcrypto.checks import check_key_ids, check_options
+from pgcrypto.exporting import export, get_copy_sql, iter_export
+from pgcrypto.hashing import get_recomputed_fields, recompute_hashes
+from pgcrypto.loading import bulk_load
+from pgcrypto.lookups import HashInLookup
+from pgcrypto.mixins import Ciphertext, dearmor, get_options_errors, StaleKey
+from pgcrypto.operations import EncryptColumnInPlace
+from pgcrypto.rotation import Checkpoint, KeyRotation
+from pgcrypto.signals import set_session_key
 from .diff_keys.models import EncryptedDiff
 from .factories import EncryptedFKModelFactory, EncryptedModelFactory
 from .forms import EncryptedForm
-from .models import EncryptedDateTime, EncryptedFKModel, \
-    EncryptedModel, RelatedDateTime
+from .models import EncryptedAES, EncryptedBlindIndex, EncryptedBucketIndex, \
+    EncryptedDateTime, EncryptedDeterministic, EncryptedEnvelope, EncryptedFKModel, \
+    EncryptedModel, EncryptedNgramIndex, EncryptedRecord, EncryptedUnique, \
+    EncryptedUUID, RelatedDateTime
 
 KEYED_FIELDS = (fields.TextDigestField, fields.TextHMACField)
 EMAIL_PGP_FIELDS = (fields.EmailPGPPublicKeyField, fields.EmailPGPSymmetricKeyField)
@@ -38,6 +58,53 @@ class TestTextFieldHash(TestCase):
                 placeholder = field().get_placeholder('\\x')
                 self.assertEqual(placeholder, '%s')
 
+    @isolate_apps('tests')
+    def test_check_index(self):
+        """Assert a warning is returned when the field has no index."""
+        class HashModel(models.Model):
+            digest_field = fields.TextDigestField()
+            hmac_field = fields.TextHMACField(db_index=True)
+
+        errors = HashModel.check()
+        self.assertEqual([error.id for error in errors], ['pgcrypto.W001'])
+        self.assertIs(errors[0].obj, HashModel._meta.get_field('digest_field'))
+
+    def test_hmac_legacy_key(self):
+        """Assert the HMAC is keyed with `'{}'` by default, in postgres and python."""
+        field = EncryptedModel._meta.get_field('hmac_field')
+        sql = field.get_encrypt_sql(connections['default'])
+        self.assertEqual(sql, "hmac(%s, '{}', 'sha512')")
+
+        with connections['default'].cursor() as cursor:
+            cursor.execute("SELECT hmac('bonjour', '{}', 'sha512')::text")
+            expected = cursor.fetchone()[0]
+        self.assertEqual(field.get_hash('bonjour', connections['default']), expected)
+
+    @override_settings(PGCRYPTO_LEGACY_HMAC_KEY=False)
+    def test_hmac_key(self):
+        """Assert the HMAC is keyed with `PGCRYPTO_KEY` without the legacy key."""
+        field = EncryptedModel._meta.get_field('hmac_field')
+        sql = field.get_encrypt_sql(connections['default'])
+        self.assertEqual(sql, "hmac(%s, '{}', 'sha512')".format(settings.PGCRYPTO_KEY))
+
+    def test_lookup_index(self):
+        """Assert `hash_of` compares the column itself so its index can be used."""
+        queryset = EncryptedModel.objects.filter(digest_field__hash_of='bonjour')
+        self.assertIn(
+            '"tests_encryptedmodel"."digest_field" = (digest(',
+            str(queryset.query)
+        )
+
+
+class TestDearmor(TestCase):
+    """Test `dearmor` behave properly."""
+    def test_dearmor(self):
+        """Assert the armored key is decoded to a public key packet."""
+        key = dearmor(settings.PUBLIC_PGP_KEY)
+        self.assertIsInstance(key, bytes)
+        # Old format packet header of a public key packet (tag 6).
+        self.assertEqual(key[0], 0x99)
+
 
 class TestPGPMixin(TestCase):
     databases = '__all__'
@@ -56,6 +123,47 @@ class TestPGPMixin(TestCase):
                 self.assertEqual(field().db_type(), 'bytea')
 
 
+class TestOptions(TestCase):
+    """Test the options of `pgp_*_encrypt` are validated."""
+    def test_get_options_errors(self):
+        """Assert invalid options are reported."""
+        self.assertEqual(get_options_errors('s2k-mode=1, cipher-algo=aes256'), [])
+        self.assertEqual(len(get_options_errors('s2k-mode=2, s2k-count=10, foo=1')), 3)
+
+    def test_check(self):
+        """Assert the check of a field reports invalid options."""
+        field = fields.TextPGPSymmetricKeyField(options='s2k-mode=2')
+        field.name = 'field'
+        self.assertEqual([error.id for error in field.check()], ['pgcrypto.E002'])
+
+    @override_settings(PGCRYPTO_OPTIONS='compress-algo=3')
+    def test_check_setting(self):
+        """Assert the check of the settings reports invalid options."""
+        self.assertEqual([error.id for error in check_options(None)], ['pgcrypto.E003'])
+
+
+class TestSQLCache(TestCase):
+    """Test the sql built by `PGPMixin` is cached."""
+    def test_decrypt_fragment(self):
+        """Assert the decrypt sql is cached until a setting changes."""
+        field = EncryptedModel._meta.get_field('pgp_sym_field')
+        connection = connections['default']
+
+        fragment = field.get_decrypt_fragment(connection)
+        self.assertIs(field.get_decrypt_fragment(connection), fragment)
+
+        with override_settings(PGCRYPTO_BIND_KEYS=True):
+            self.assertNotEqual(field.get_decrypt_fragment(connection), fragment)
+
+        self.assertEqual(field.get_decrypt_fragment(connection), fragment)
+
+    def test_get_col(self):
+        """Assert `get_col` returns the same `DecryptedCol` for a table alias."""
+        field = EncryptedDateTime._meta.get_field('value')
+        self.assertIs(field.get_col('T3'), field.get_col('T3'))
+        self.assertIsNot(field.get_col('T3'), field.get_col('T4'))
+
+
 class TestEmailPGPMixin(TestCase):
     """Test emails fields behave properly."""
     def test_max_length_validator(self):
@@ -249,6 +357,96 @@ class TestEncryptedTextFieldModel(TestCase):
         queryset = EncryptedModel.objects.filter(hmac_with_original_field__hash_of=value)
         self.assertCountEqual(queryset, [expected])
 
+    def test_digest_in_lookup(self):
+        """Assert we can filter a digest value against a list of values."""
+        first = EncryptedModelFactory.create(digest_field='bonjour')
+        second = EncryptedModelFactory.create(digest_field='au revoir')
+        EncryptedModelFactory.create()
+
+        queryset = EncryptedModel.objects.filter(
+            digest_field__hash_of_in=['bonjour', 'au revoir', 'bonjour', 'salut']
+        )
+        self.assertCountEqual(queryset, [first, second])
+
+    def test_hmac_in_lookup(self):
+        """Assert we can filter a hmac value against a list of values."""
+        expected = EncryptedModelFactory.create(pgp_sym_field='bonjour')
+        EncryptedModelFactory.create()
+
+        queryset = EncryptedModel.objects.filter(
+            hmac_with_original_field__hash_of_in=['bonjour', 'salut']
+        )
+        self.assertCountEqual(queryset, [expected])
+
+    def test_in_lookup_chunks(self):
+        """Assert a long list of values is hashed in several arrays."""
+        first = EncryptedModelFactory.create(digest_field='bonjour')
+        second = EncryptedModelFactory.create(digest_field='au revoir')
+        EncryptedModelFactory.create()
+
+        with patch.object(HashInLookup, 'chunk_size', 2):
+            queryset = EncryptedModel.objects.filter(
+                digest_field__hash_of_in=['bonjour', 'salut', 'hello', 'au revoir']
+            )
+            sql, params = queryset.query.sql_with_params()
+            self.assertEqual(sql.count('= ANY(ARRAY['), 2)
+            self.assertIn(' OR ', sql)
+            self.assertCountEqual(queryset, [first, second])
+
+    def test_hash_in_bulk(self):
+        """Assert `hash_in_bulk` maps each value to its object in batches."""
+        first = EncryptedModelFactory.create(hmac_field='bonjour')
+        second = EncryptedModelFactory.create(hmac_field='au revoir')
+
+        with self.assertNumQueries(4):
+            objects = EncryptedModel.objects.hash_in_bulk(
+                ['bonjour', 'au revoir', 'salut', 'bonjour'], 'hmac_field', batch_size=2
+            )
+
+        self.assertEqual(objects, {'bonjour': first, 'au revoir': second})
+
+    def test_python_hashes(self):
+        """Assert hashes computed in python are the ones computed by postgres."""
+        instance = EncryptedModelFactory.create(
+            digest_field='bonjour',
+            hmac_field='bonjour',
+        )
+        instance.refresh_from_db()
+
+        connection = connections['default']
+        for field_name in ('digest_field', 'hmac_field'):
+            field = self.model._meta.get_field(field_name)
+            with self.subTest(field=field_name):
+                self.assertEqual(
+                    field.get_hash('bonjour', connection),
+                    getattr(instance, field_name)
+                )
+
+    @override_settings(PGCRYPTO_PYTHON_HASHES=True)
+    def test_python_hashes_setting(self):
+        """Assert `PGCRYPTO_PYTHON_HASHES` hashes values in python."""
+        reset_queries()
+        expected = EncryptedModelFactory.create(
+            digest_field='bonjour',
+            hmac_field='salut',
+        )
+
+        query = str(connections['default'].queries[0])
+        self.assertNotIn('digest(', query)
+        self.assertNotIn('hmac(', query)
+        EncryptedModelFactory.create()
+
+        queryset = self.model.objects.filter(digest_field__hash_of='bonjour')
+        self.assertNotIn('digest(', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+        queryset = self.model.objects.filter(hmac_field__hash_of_in=['salut', 'hello'])
+        self.assertCountEqual(queryset, [expected])
+
+        with self.assertNumQueries(1):
+            objects = self.model.objects.hash_in_bulk(['bonjour'], 'digest_field')
+        self.assertEqual(objects, {'bonjour': expected})
+
     def test_default_lookup(self):
         """Assert default lookup can be called."""
         queryset = EncryptedModel.objects.filter(hmac_field__isnull=True)
@@ -1546,3 +1744,1602 @@ class TestEncryptedTextFieldModel(TestCase):
             instance.hmac_field,
             expected
         )
+
+    @override_settings(PGCRYPTO_BIND_KEYS=True)
+    def test_bind_keys(self):
+        """Assert keys are sent as query parameters when `PGCRYPTO_BIND_KEYS` is set."""
+        expected = 'bonjour'
+        EncryptedModelFactory.create(pgp_pub_field=expected, pgp_sym_field=expected)
+
+        reset_queries()
+        instance = self.model.objects.get(pgp_sym_field=expected)
+
+        self.assertEqual(instance.pgp_pub_field, expected)
+        self.assertEqual(instance.pgp_sym_field, expected)
+
+        query = str(connections['default'].queries[0])
+        self.assertNotIn('dearmor', query)
+        self.assertNotIn('BEGIN PGP PRIVATE KEY BLOCK', query)
+
+        instance.pgp_pub_field = 'au revoir'
+        instance.save()
+
+        instance = self.model.objects.get()
+        self.assertEqual(instance.pgp_pub_field, 'au revoir')
+
+    @override_settings(PGCRYPTO_BIND_KEYS=True)
+    def test_bind_keys_once(self):
+        """Assert each key is sent once per statement, however many values use it."""
+        connection = connections['default']
+        with CaptureQueriesContext(connection) as queries:
+            self.model.objects.bulk_create([
+                self.model(pgp_pub_field='bonjour', email_pgp_pub_field='a@test.com')
+                for _ in range(3)
+            ])
+        sql = queries[-1]['sql']
+        self.assertEqual(sql.count(dearmor(settings.PUBLIC_PGP_KEY).hex()), 1)
+        self.assertTrue(sql.startswith('WITH pgcrypto_keys AS'))
+
+        with CaptureQueriesContext(connection) as queries:
+            values = list(self.model.objects.values_list(
+                'pgp_pub_field', 'email_pgp_pub_field'
+            ))
+        self.assertEqual(values, [('bonjour', 'a@test.com')] * 3)
+        self.assertEqual(
+            queries[-1]['sql'].count(dearmor(settings.PRIVATE_PGP_KEY).hex()), 1
+        )
+
+    def test_bind_keys_once_sql(self):
+        """Assert the keys are selected by a CTE merged with the one of the sql."""
+        key = BoundKey('secret')
+        sql, params = bind_keys_once(
+            "WITH batch AS (SELECT 1) UPDATE t SET a = pgp_sym_encrypt(%s, %s) "
+            "WHERE b LIKE '%%a' AND c = pgp_sym_decrypt(d, %s)",
+            ['value', key, key],
+        )
+        self.assertEqual(sql, (
+            "WITH pgcrypto_keys AS (SELECT %s::text AS key0), batch AS (SELECT 1) "
+            "UPDATE t SET a = pgp_sym_encrypt(%s, (SELECT key0 FROM pgcrypto_keys)) "
+            "WHERE b LIKE '%%a' "
+            "AND c = pgp_sym_decrypt(d, (SELECT key0 FROM pgcrypto_keys))"
+        ))
+        self.assertEqual(params, [key, 'value'])
+
+        # Statements which can't have a CTE are kept as they are.
+        self.assertEqual(bind_keys_once('SHOW %s', [key]), ('SHOW %s', [key]))
+
+    @override_settings(PGCRYPTO_SESSION_KEY=True)
+    def test_session_key(self):
+        """Assert `PGCRYPTO_SESSION_KEY` reads the key set for the session."""
+        connection = connections['default']
+        set_session_key(sender=connection.__class__, connection=connection)
+
+        expected = 'bonjour'
+        EncryptedModelFactory.create(pgp_sym_field=expected, integer_pgp_sym_field=42)
+
+        reset_queries()
+        instance = self.model.objects.get(pgp_sym_field=expected)
+
+        self.assertEqual(instance.pgp_sym_field, expected)
+        self.assertEqual(instance.integer_pgp_sym_field, 42)
+
+        query = str(connection.queries[0])
+        self.assertIn('pgcrypto_fields.sym_decrypt', query)
+        self.assertNotIn(settings.PGCRYPTO_KEY, query)
+
+    @override_settings(PGCRYPTO_OPTIONS='s2k-mode=1, compress-algo=0')
+    def test_options(self):
+        """Assert `PGCRYPTO_OPTIONS` are passed to `pgp_*_encrypt`."""
+        reset_queries()
+        EncryptedModelFactory.create(pgp_pub_field='bonjour', pgp_sym_field='salut')
+
+        query = str(connections['default'].queries[0])
+        self.assertIn("'s2k-mode=1, compress-algo=0'", query)
+
+        instance = self.model.objects.get()
+        self.assertEqual(instance.pgp_pub_field, 'bonjour')
+        self.assertEqual(instance.pgp_sym_field, 'salut')
+
+    @override_settings(PGCRYPTO_CLIENT_ENCRYPTION=True)
+    def test_client_encryption(self):
+        """Assert values encrypted in python are decrypted by postgres."""
+        values = {
+            'pgp_pub_field': 'bonjour',
+            'integer_pgp_pub_field': 42,
+            'date_pgp_pub_field': date(2016, 9, 1),
+            'decimal_pgp_pub_field': Decimal('12.34'),
+            'boolean_pgp_pub_field': True,
+            'pgp_sym_field': 'salut',
+            'datetime_pgp_sym_field': datetime(2016, 9, 1, 10, 30),
+            'float_pgp_sym_field': 1.5,
+            'boolean_pgp_sym_field': False,
+        }
+
+        reset_queries()
+        EncryptedModelFactory.create(**values)
+
+        query = str(connections['default'].queries[0])
+        self.assertNotIn('pgp_pub_encrypt', query)
+        self.assertNotIn('pgp_sym_encrypt', query)
+
+        instance = self.model.objects.get()
+        for field_name, expected in values.items():
+            with self.subTest(field=field_name):
+                self.assertEqual(getattr(instance, field_name), expected)
+
+    @override_settings(PGCRYPTO_CLIENT_ENCRYPTION=True)
+    def test_client_encryption_bulk_create(self):
+        """Assert `bulk_create` encrypts the values before inserting them."""
+        self.model.objects.bulk_create([
+            self.model(pgp_pub_field='bonjour', integer_pgp_sym_field=1),
+            self.model(pgp_pub_field='salut', integer_pgp_sym_field=2),
+        ])
+
+        queryset = self.model.objects.order_by('integer_pgp_sym_field')
+        self.assertEqual(
+            list(queryset.values_list('pgp_pub_field', 'integer_pgp_sym_field')),
+            [('bonjour', 1), ('salut', 2)]
+        )
+
+    def test_client_encryption_field(self):
+        """Assert `client_encryption` overrides the setting for a field."""
+        field = fields.TextPGPSymmetricKeyField(client_encryption=True)
+        self.assertTrue(field.encrypt_in_python(connections['default']))
+
+        _, _, _, kwargs = field.deconstruct()
+        self.assertEqual(kwargs['client_encryption'], True)
+
+    @override_settings(PGCRYPTO_OPTIONS='cipher-algo=aes256')
+    def test_client_encryption_options(self):
+        """Assert the values encrypted with options are left to postgres."""
+        field = fields.TextPGPSymmetricKeyField(client_encryption=True)
+        self.assertFalse(field.encrypt_in_python(connections['default']))
+
+        field = fields.TextAESField(client_encryption=True)
+        self.assertTrue(field.encrypt_in_python(connections['default']))
+
+    def test_decrypt_client_side(self):
+        """Assert `decrypt_client_side` decrypts the values in python."""
+        values = {
+            'pgp_pub_field': 'bonjour',
+            'integer_pgp_pub_field': 42,
+            'decimal_pgp_pub_field': Decimal('12.30'),
+            'boolean_pgp_pub_field': True,
+            'pgp_sym_field': 'salut',
+            'date_pgp_sym_field': date(2016, 9, 1),
+            'float_pgp_sym_field': 1.5,
+            'boolean_pgp_sym_field': False,
+        }
+        EncryptedModelFactory.create(**values)
+        EncryptedModelFactory.create(pgp_sym_field='au revoir')
+
+        reset_queries()
+        instances = list(
+            self.model.objects.order_by('id').decrypt_client_side(batch_size=1)
+        )
+
+        query = str(connections['default'].queries[0])
+        self.assertNotIn('pgp_pub_decrypt', query)
+        self.assertNotIn('pgp_sym_decrypt', query)
+
+        for field_name, expected in values.items():
+            with self.subTest(field=field_name):
+                self.assertEqual(getattr(instances[0], field_name), expected)
+        self.assertEqual(instances[1].pgp_sym_field, 'au revoir')
+        self.assertIsNone(instances[1].pgp_pub_field)
+
+    def test_decrypt_client_side_pool(self):
+        """Assert the pool of processes is reused and only sent the keys once."""
+        EncryptedModelFactory.create(pgp_sym_field='salut', pgp_pub_field='bonjour')
+        queryset = self.model.objects.decrypt_client_side()
+
+        with patch.object(
+            managers, 'ProcessPoolExecutor', wraps=managers.ProcessPoolExecutor,
+        ) as pool_class, patch.dict(managers.decrypt_pools, clear=True):
+            self.assertEqual(queryset.get().pgp_sym_field, 'salut')
+            self.assertEqual(queryset.all().get().pgp_pub_field, 'bonjour')
+            (pool,) = managers.decrypt_pools.values()
+            pool.shutdown()
+
+        pool_class.assert_called_once()
+        keys = pool_class.call_args[1]['initargs'][0]
+        self.assertEqual(keys['PGCRYPTO_KEY'], settings.PGCRYPTO_KEY)
+        self.assertEqual(keys['PRIVATE_PGP_KEY'], settings.PRIVATE_PGP_KEY)
+
+    def test_decrypt_lazily(self):
+        """Assert `decrypt_lazily` decrypts a field for all instances on access."""
+        EncryptedModelFactory.create(pgp_sym_field='bonjour', pgp_pub_field='hello')
+        EncryptedModelFactory.create(pgp_sym_field='salut', pgp_pub_field='hi')
+
+        reset_queries()
+        first, second = self.model.objects.order_by('id').decrypt_lazily()
+
+        query = str(connections['default'].queries[0])
+        self.assertNotIn('pgp_pub_decrypt', query)
+        self.assertNotIn('pgp_sym_decrypt', query)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(first.pgp_sym_field, 'bonjour')
+            self.assertEqual(second.pgp_sym_field, 'salut')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(second.pgp_pub_field, 'hi')
+            self.assertEqual(first.pgp_pub_field, 'hello')
+
+    def test_decrypt_lazily_client_side(self):
+        """Assert `decrypt_lazily` can decrypt the fields in python."""
+        EncryptedModelFactory.create(pgp_sym_field='bonjour', integer_pgp_pub_field=42)
+
+        instance = self.model.objects.decrypt_lazily(client_side=True).get()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(instance.pgp_sym_field, 'bonjour')
+            self.assertEqual(instance.integer_pgp_pub_field, 42)
+
+
+class TestBlindIndexField(TestCase):
+    """Test `BlindIndexField` is used by the lookups of its original field."""
+    model = EncryptedBlindIndex
+
+    def test_exact(self):
+        """Assert `exact` compares the blind index before decrypting."""
+        expected = self.model.objects.create(email_pgp_pub_field='Peter@Test.com')
+        self.model.objects.create(email_pgp_pub_field='jessica@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field='Peter@Test.com')
+        self.assertIn('"email_blind_index" IN', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+        queryset = self.model.objects.filter(email_pgp_pub_field='peter@test.com')
+        self.assertCountEqual(queryset, [])
+
+    def test_iexact(self):
+        """Assert `iexact` uses the blind index."""
+        expected = self.model.objects.create(email_pgp_pub_field='Peter@Test.com')
+        self.model.objects.create(email_pgp_pub_field='jessica@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field__iexact='peter@test.com')
+        self.assertCountEqual(queryset, [expected])
+
+    def test_in(self):
+        """Assert `in` uses the blind index."""
+        expected = self.model.objects.create(email_pgp_pub_field='peter@test.com')
+        self.model.objects.create(email_pgp_pub_field='jessica@test.com')
+
+        queryset = self.model.objects.filter(
+            email_pgp_pub_field__in=['peter@test.com', 'paul@test.com']
+        )
+        self.assertCountEqual(queryset, [expected])
+
+    def test_update(self):
+        """Assert the blind index follows the original field."""
+        instance = self.model.objects.create(email_pgp_pub_field='peter@test.com')
+        instance.email_pgp_pub_field = 'paul@test.com'
+        instance.save()
+
+        queryset = self.model.objects.filter(email_pgp_pub_field='paul@test.com')
+        self.assertCountEqual(queryset, [instance])
+
+    def test_queryset_update(self):
+        """Assert `update()` computes the blind index of the new value."""
+        instance = self.model.objects.create(email_pgp_pub_field='peter@test.com')
+        self.model.objects.update(email_pgp_pub_field='paul@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field='paul@test.com')
+        self.assertCountEqual(queryset, [instance])
+        queryset = self.model.objects.filter(email_pgp_pub_field='peter@test.com')
+        self.assertCountEqual(queryset, [])
+
+    def test_bulk_update(self):
+        """Assert `bulk_update()` computes the blind index of the new values."""
+        peter = self.model.objects.create(email_pgp_pub_field='peter@test.com')
+        jessica = self.model.objects.create(email_pgp_pub_field='jessica@test.com')
+        peter.email_pgp_pub_field = 'paul@test.com'
+        jessica.email_pgp_pub_field = 'jane@test.com'
+        self.model.objects.bulk_update([peter, jessica], ['email_pgp_pub_field'])
+
+        queryset = self.model.objects.filter(
+            email_pgp_pub_field__in=['paul@test.com', 'jane@test.com']
+        )
+        self.assertCountEqual(queryset, [peter, jessica])
+
+    def test_update_expression(self):
+        """Assert a field with a blind index can't be updated with an expression."""
+        with self.assertRaises(ValueError):
+            self.model.objects.update(email_pgp_pub_field=models.F('email_pgp_pub_field'))
+
+    def test_null_index(self):
+        """Assert the rows without a blind index, saved before it, are compared."""
+        expected = self.model.objects.create(email_pgp_pub_field='peter@test.com')
+        self.model.objects.create(email_pgp_pub_field='jessica@test.com')
+        self.model.objects.update(email_blind_index=None)
+
+        queryset = self.model.objects.filter(email_pgp_pub_field='peter@test.com')
+        self.assertIn('"email_blind_index" IS NULL', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+    @override_settings(PGCRYPTO_PYTHON_HASHES=True)
+    def test_python_hashes(self):
+        """Assert the blind index can be computed in python."""
+        expected = self.model.objects.create(email_pgp_pub_field='Peter@Test.com')
+        self.model.objects.create(email_pgp_pub_field='jessica@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field__iexact='peter@test.com')
+        self.assertNotIn('hmac(', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+    @isolate_apps('tests')
+    def test_non_text_original(self):
+        """Assert a blind index of a non text field is reported and not used."""
+        class DecimalModel(models.Model):
+            decimal = fields.DecimalPGPSymmetricKeyField(max_digits=5, decimal_places=2)
+            decimal_blind_index = fields.BlindIndexField(original='decimal')
+
+        errors = DecimalModel.check()
+        self.assertEqual([error.id for error in errors], ['pgcrypto.W003'])
+
+        queryset = DecimalModel.objects.filter(decimal=Decimal('12.3'))
+        where = str(queryset.query).split('WHERE')[1]
+        self.assertNotIn('"decimal_blind_index"', where)
+
+
+class TestBucketIndexField(TestCase):
+    """Test `BucketIndexField` is used by the `range` lookup of its original field."""
+    model = EncryptedBucketIndex
+
+    def test_get_buckets(self):
+        """Assert the buckets covering a range are listed."""
+        field = self.model._meta.get_field('date_bucket_index')
+        buckets = field.get_buckets(date(2016, 11, 30), date(2017, 1, 1))
+        self.assertEqual(buckets, ['2016-11-01', '2016-12-01', '2017-01-01'])
+
+        field = self.model._meta.get_field('integer_bucket_index')
+        self.assertEqual(field.get_buckets(-5, 19), ['-1', '0', '1'])
+        self.assertIsNone(field.get_buckets(0, 100000))
+
+    @override_settings(USE_TZ=True, TIME_ZONE='America/New_York')
+    def test_naive_datetime(self):
+        """Assert a naive datetime is in the current time zone, like when saved."""
+        field = self.model._meta.get_field('date_bucket_index')
+
+        # 2016-10-01 02:00 in UTC.
+        self.assertEqual(field.to_bucket(datetime(2016, 9, 30, 22)), date(2016, 10, 1))
+
+    def test_date_range(self):
+        """Assert `range` compares the bucket index before decrypting."""
+        expected = self.model.objects.create(date_pgp_sym_field=date(2016, 9, 15))
+        self.model.objects.create(date_pgp_sym_field=date(2016, 9, 1))
+        self.model.objects.create(date_pgp_sym_field=date(2016, 12, 1))
+
+        queryset = self.model.objects.filter(
+            date_pgp_sym_field__range=(date(2016, 9, 10), date(2016, 10, 10))
+        )
+        self.assertIn('"date_bucket_index" IN', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+    def test_integer_range(self):
+        """Assert `range` uses the bucket index of numbers."""
+        expected = self.model.objects.create(integer_pgp_sym_field=42)
+        self.model.objects.create(integer_pgp_sym_field=38)
+        self.model.objects.create(integer_pgp_sym_field=51)
+
+        queryset = self.model.objects.filter(integer_pgp_sym_field__range=(40, 45))
+        self.assertIn('"integer_bucket_index" IN', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+    def test_queryset_update(self):
+        """Assert `update()` computes the bucket of the new value."""
+        instance = self.model.objects.create(integer_pgp_sym_field=42)
+        self.model.objects.update(integer_pgp_sym_field=57)
+
+        queryset = self.model.objects.filter(integer_pgp_sym_field__range=(55, 60))
+        self.assertCountEqual(queryset, [instance])
+
+    def test_null_index(self):
+        """Assert the rows without a bucket index, saved before it, are compared."""
+        expected = self.model.objects.create(integer_pgp_sym_field=42)
+        self.model.objects.update(integer_bucket_index=None)
+
+        queryset = self.model.objects.filter(integer_pgp_sym_field__range=(40, 45))
+        self.assertCountEqual(queryset, [expected])
+
+    def test_wide_range(self):
+        """Assert a range with too many buckets only decrypts the values."""
+        expected = self.model.objects.create(integer_pgp_sym_field=42)
+
+        queryset = self.model.objects.filter(integer_pgp_sym_field__range=(0, 100000))
+        self.assertNotIn('"integer_bucket_index" IN', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+    @override_settings(PGCRYPTO_PYTHON_HASHES=True)
+    def test_python_hashes(self):
+        """Assert the bucket index can be computed in python."""
+        expected = self.model.objects.create(date_pgp_sym_field=date(2016, 9, 15))
+
+        queryset = self.model.objects.filter(
+            date_pgp_sym_field__range=(date(2016, 9, 1), date(2016, 9, 30))
+        )
+        self.assertNotIn('hmac(', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+    @isolate_apps('tests')
+    def test_check_width(self):
+        """Assert an error is returned when the width doesn't suit the field."""
+        class BucketModel(models.Model):
+            date_field = fields.DatePGPSymmetricKeyField()
+            date_bucket_index = fields.BucketIndexField(original='date_field', width=3)
+
+        errors = BucketModel.check()
+        self.assertEqual([error.id for error in errors], ['pgcrypto.E004'])
+
+
+class TestNgramIndexField(TestCase):
+    """Test `NgramIndexField` is used by the pattern lookups of its original field."""
+    model = EncryptedNgramIndex
+
+    def test_get_ngrams(self):
+        """Assert the n-grams of a prefix start with the start marker."""
+        field = self.model._meta.get_field('email_ngram_index')
+        self.assertEqual(field.get_ngrams('ABab', prefix=False), ['aba', 'bab'])
+        self.assertEqual(field.get_ngrams('Ab'), ['\x02ab'])
+
+    def test_stored_tokens(self):
+        """Assert the keyed hash of each n-gram is stored."""
+        self.model.objects.create(email_pgp_pub_field='a@b.c')
+
+        tokens = self.model.objects.values_list('email_ngram_index', flat=True).get()
+        self.assertEqual(len(tokens), 4)
+        self.assertNotIn('a@b', tokens)
+
+    def test_icontains(self):
+        """Assert `icontains` compares the n-gram index before decrypting."""
+        expected = self.model.objects.create(email_pgp_pub_field='Peter@Test.com')
+        self.model.objects.create(email_pgp_pub_field='jessica@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field__icontains='peter@')
+        self.assertIn('"email_ngram_index" @>', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+    def test_contains(self):
+        """Assert `contains` still checks the case of the decrypted value."""
+        expected = self.model.objects.create(email_pgp_pub_field='Peter@Test.com')
+        self.model.objects.create(email_pgp_pub_field='peter@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field__contains='Test')
+        self.assertCountEqual(queryset, [expected])
+
+    def test_startswith(self):
+        """Assert `startswith` only matches the n-grams of the start."""
+        expected = self.model.objects.create(email_pgp_pub_field='peter@test.com')
+        self.model.objects.create(email_pgp_pub_field='jessica@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field__startswith='pet')
+        self.assertCountEqual(queryset, [expected])
+        queryset = self.model.objects.filter(email_pgp_pub_field__istartswith='test')
+        self.assertCountEqual(queryset, [])
+
+    def test_queryset_update(self):
+        """Assert `update()` computes the n-grams of the new value."""
+        instance = self.model.objects.create(email_pgp_pub_field='peter@test.com')
+        self.model.objects.update(email_pgp_pub_field='paul@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field__icontains='paul@')
+        self.assertCountEqual(queryset, [instance])
+
+    def test_short_value(self):
+        """Assert a value shorter than the n-grams only decrypts the values."""
+        expected = self.model.objects.create(email_pgp_pub_field='peter@test.com')
+
+        queryset = self.model.objects.filter(email_pgp_pub_field__contains='@')
+        self.assertNotIn('"email_ngram_index" @>', str(queryset.query))
+        self.assertCountEqual(queryset, [expected])
+
+
+class TestUniqueBlindIndex(TestCase):
+    """Test a unique `BlindIndexField` enforces the uniqueness of its field."""
+    model = EncryptedUnique
+
+    def test_check(self):
+        """Assert a warning is returned for a unique PGP field."""
+        field = fields.EmailPGPPublicKeyField(unique=True)
+        field.name = 'field'
+        self.assertEqual([error.id for error in field.check()], ['pgcrypto.W002'])
+
+        field = fields.EmailDeterministicAESField(unique=True)
+        field.name = 'field'
+        self.assertEqual(field.check(), [])
+
+    def test_unique(self):
+        """Assert duplicate values are rejected by the unique index."""
+        self.model.objects.create(email_pgp_sym_field='peter@test.com')
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.model.objects.create(email_pgp_sym_field='Peter@Test.com')
+
+    def test_get_or_create(self):
+        """Assert `get_or_create` finds the row with the blind index."""
+        expected = self.model.objects.create(email_pgp_sym_field='peter@test.com')
+
+        instance, created = self.model.objects.get_or_create(
+            email_pgp_sym_field='peter@test.com'
+        )
+        self.assertFalse(created)
+        self.assertEqual(instance, expected)
+
+    def test_bulk_create_update_conflicts(self):
+        """Assert `bulk_create` updates the rows conflicting on the blind index."""
+        self.model.objects.create(
+            email_pgp_sym_field='peter@test.com', text_pgp_sym_field='bonjour'
+        )
+
+        self.model.objects.bulk_create(
+            [
+                self.model(email_pgp_sym_field='peter@test.com', text_pgp_sym_field='hi'),
+                self.model(email_pgp_sym_field='paul@test.com', text_pgp_sym_field='yo'),
+            ],
+            update_conflicts=True,
+            update_fields=['text_pgp_sym_field'],
+            unique_fields=['email_pgp_sym_field'],
+        )
+
+        values = self.model.objects.values_list(
+            'email_pgp_sym_field', 'text_pgp_sym_field'
+        )
+        self.assertCountEqual(
+            values, [('peter@test.com', 'hi'), ('paul@test.com', 'yo')]
+        )
+
+    def test_bulk_create_conflict_target(self):
+        """Assert a PGP field without unique blind index can't be a conflict target."""
+        with self.assertRaises(ValueError):
+            self.model.objects.bulk_create(
+                [self.model(email_pgp_sym_field='peter@test.com')],
+                update_conflicts=True,
+                update_fields=['email_pgp_sym_field'],
+                unique_fields=['text_pgp_sym_field'],
+            )
+
+
+class TestBulkLoad(TestCase):
+    """Test `bulk_load` copies rows and encrypts them in postgres."""
+
+    def test_bulk_load(self):
+        """Assert the values are encrypted and the hashes computed."""
+        progress = []
+        count = bulk_load(
+            EncryptedBlindIndex,
+            ({'email_pgp_pub_field': 'user{}@test.com'.format(i)} for i in range(5)),
+            batch_size=2,
+            progress=progress.append,
+        )
+
+        self.assertEqual(count, 5)
+        self.assertEqual(progress, [2, 4, 5])
+        instance = EncryptedBlindIndex.objects.get(email_pgp_pub_field='user3@test.com')
+        self.assertIsNotNone(instance.email_blind_index)
+        self.assertEqual(EncryptedBlindIndex.objects.count(), 5)
+
+    def test_escaped_values(self):
+        """Assert values with tabs, new lines and backslashes are copied as is."""
+        values = {
+            'text_aes_field': 'a\tb\nc\\d\\N',
+            'integer_aes_field': None,
+            'date_aes_field': date(2016, 9, 1),
+            'decimal_aes_field': Decimal('12.34'),
+            'boolean_aes_field': False,
+        }
+        bulk_load(EncryptedAES, [values])
+
+        instance = EncryptedAES.objects.get()
+        for field_name, value in values.items():
+            with self.subTest(field=field_name):
+                self.assertEqual(getattr(instance, field_name), value)
+
+    def test_envelope(self):
+        """Assert the fields of a data key are encrypted with the data key of the row."""
+        bulk_load(EncryptedEnvelope, [EncryptedEnvelope(pgp_pub_field='bonjour')])
+
+        self.assertEqual(EncryptedEnvelope.objects.get().pgp_pub_field, 'bonjour')
+
+    def test_command(self):
+        """Assert the command loads a CSV file."""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as csv_file:
+            csv_file.write('email_pgp_pub_field\npeter@test.com\n\n')
+            csv_file.flush()
+            stdout = io.StringIO()
+            call_command(
+                'pgcrypto_load', 'tests.EncryptedBlindIndex', csv_file.name, stdout=stdout
+            )
+
+        self.assertIn('Loaded 1 rows into tests.EncryptedBlindIndex', stdout.getvalue())
+        self.assertEqual(
+            EncryptedBlindIndex.objects.get().email_pgp_pub_field, 'peter@test.com'
+        )
+
+
+class TestExport(TestCase):
+    """Test `export` and `iter_export` copy the decrypted values of a queryset."""
+
+    def setUp(self):
+        """Create rows with values to escape in csv."""
+        EncryptedBlindIndex.objects.create(email_pgp_pub_field='peter@test.com')
+        EncryptedBlindIndex.objects.create(email_pgp_pub_field='"paul"@test.com')
+
+    def test_export(self):
+        """Assert the values are decrypted and written with a header."""
+        output = io.StringIO()
+        export(
+            EncryptedBlindIndex.objects.order_by('id'),
+            output,
+            fields=['email_pgp_pub_field'],
+        )
+
+        self.assertEqual(
+            output.getvalue(),
+            'email_pgp_pub_field\npeter@test.com\n"""paul""@test.com"\n',
+        )
+
+    def test_export_filtered(self):
+        """Assert the rows of a filtered queryset are exported."""
+        output = io.StringIO()
+        export(
+            EncryptedBlindIndex.objects.filter(email_pgp_pub_field='peter@test.com'),
+            output,
+            fields=['email_pgp_pub_field'],
+            header=False,
+        )
+
+        self.assertEqual(output.getvalue(), 'peter@test.com\n')
+
+    def test_iter_export(self):
+        """Assert the chunks are yielded as bytes."""
+        chunks = iter_export(
+            EncryptedBlindIndex.objects.order_by('id'),
+            fields=['email_pgp_pub_field'],
+            format='text',
+        )
+
+        self.assertEqual(b''.join(chunks), b'peter@test.com\n"paul"@test.com\n')
+
+    def test_iter_export_closed(self):
+        """Assert closing the generator early cancels the copy."""
+        chunks = iter_export(EncryptedBlindIndex.objects.all())
+        next(chunks)
+        chunks.close()
+
+        with self.assertRaises(StopIteration):
+            next(chunks)
+
+    def test_all_fields(self):
+        """Assert all the concrete fields are exported by default."""
+        sql = get_copy_sql(EncryptedBlindIndex.objects.all())
+
+        self.assertIn('"email_pgp_pub_field"', sql)
+        self.assertIn('"email_blind_index"', sql)
+        self.assertTrue(sql.endswith('TO STDOUT WITH (FORMAT csv, HEADER)'))
+
+    def test_invalid_format(self):
+        """Assert an unknown format is rejected."""
+        with self.assertRaises(ValueError):
+            get_copy_sql(EncryptedBlindIndex.objects.all(), format='json')
+
+
+class TestKeyRing(TestCase):
+    """Test `PGCRYPTO_KEY_IDS` decrypts each value with the key it needs."""
+
+    def setUp(self):
+        """Get the keys of the `diff_keys` database as the old keys."""
+        settings_dict = connections['diff_keys'].settings_dict
+        self.old_settings = {
+            'PGCRYPTO_KEY': settings_dict['PGCRYPTO_KEY'],
+            'PUBLIC_PGP_KEY': settings_dict['PUBLIC_PGP_KEY'],
+            'PRIVATE_PGP_KEY': settings_dict['PRIVATE_PGP_KEY'],
+        }
+        self.key_ring = override_settings(
+            PGCRYPTO_KEY_IDS=True,
+            PGCRYPTO_KEY_ID=2,
+            PGCRYPTO_OLD_KEYS={
+                'PGCRYPTO_KEY': settings_dict['PGCRYPTO_KEY'],
+                'PRIVATE_PGP_KEY': settings_dict['PRIVATE_PGP_KEY'],
+            },
+        )
+
+    def test_old_and_current_keys(self):
+        """Assert values encrypted with the old and current keys are decrypted."""
+        with override_settings(**self.old_settings):
+            EncryptedModel.objects.create(pgp_sym_field='old', pgp_pub_field='old')
+        with self.key_ring:
+            EncryptedModel.objects.create(pgp_sym_field='new', pgp_pub_field='new')
+
+            values = EncryptedModel.objects.order_by('id').values_list(
+                'pgp_sym_field', 'pgp_pub_field'
+            )
+            self.assertEqual(list(values), [('old', 'old'), ('new', 'new')])
+            self.assertTrue(EncryptedModel.objects.filter(pgp_sym_field='old').exists())
+
+    def test_bind_keys(self):
+        """Assert the key ring can be sent as a query parameter."""
+        with override_settings(**self.old_settings):
+            EncryptedModel.objects.create(pgp_sym_field='old', integer_pgp_pub_field=1)
+        with self.key_ring, override_settings(PGCRYPTO_BIND_KEYS=True):
+            EncryptedModel.objects.create(pgp_sym_field='new', integer_pgp_pub_field=2)
+
+            values = EncryptedModel.objects.order_by('id').values_list(
+                'pgp_sym_field', 'integer_pgp_pub_field'
+            )
+            self.assertEqual(list(values), [('old', 1), ('new', 2)])
+
+    def test_key_id(self):
+        """Assert symmetric messages are prefixed with the key id."""
+        with self.key_ring:
+            EncryptedModel.objects.create(pgp_sym_field='new')
+
+        data = EncryptedModel.objects.annotate(
+            data=Ciphertext('pgp_sym_field')
+        ).values_list('data', flat=True).get()
+        self.assertEqual(bytes(data[:5]), b'\x01\x00\x00\x00\x02')
+        self.assertEqual(client.pgp_sym_decrypt(data[5:], settings.PGCRYPTO_KEY), 'new')
+
+    def test_old_key_ids(self):
+        """Assert the old keys with an id decrypt the messages prefixed with it."""
+        old_key = connections['diff_keys'].settings_dict['PGCRYPTO_KEY']
+        with self.key_ring, override_settings(
+            PGCRYPTO_KEY=old_key, PGCRYPTO_KEY_ID=1, PGCRYPTO_OLD_KEYS={}
+        ):
+            EncryptedModel.objects.create(pgp_sym_field='old')
+        with self.key_ring, override_settings(
+            PGCRYPTO_OLD_KEYS={'PGCRYPTO_KEY': {1: old_key, 0: 'unused'}}
+        ):
+            EncryptedModel.objects.create(pgp_sym_field='new')
+
+            values = EncryptedModel.objects.order_by('id').values_list(
+                'pgp_sym_field', flat=True
+            )
+            self.assertEqual(list(values), ['old', 'new'])
+
+    def test_check_key_ids(self):
+        """Assert the check reports a missing, invalid or shared key id."""
+        with override_settings(PGCRYPTO_KEY_IDS=True):
+            self.assertTrue(check_key_ids(None))
+        for key_id, old_keys in ((1, {1: 'old'}), (-1, {}), ('2', {})):
+            with self.subTest(key_id=key_id), override_settings(
+                PGCRYPTO_KEY_IDS=True,
+                PGCRYPTO_KEY_ID=key_id,
+                PGCRYPTO_OLD_KEYS={'PGCRYPTO_KEY': old_keys},
+            ):
+                errors = check_key_ids(None)
+                self.assertTrue(errors)
+                self.assertEqual({error.id for error in errors}, {'pgcrypto.E005'})
+
+        with self.key_ring:
+            self.assertEqual(check_key_ids(None), [])
+
+    def test_envelope(self):
+        """Assert the data key is decrypted with the key it was encrypted with."""
+        with override_settings(**self.old_settings):
+            EncryptedEnvelope.objects.create(pgp_pub_field='old')
+        with self.key_ring:
+            EncryptedEnvelope.objects.create(pgp_pub_field='new')
+
+            values = EncryptedEnvelope.objects.order_by('id').values_list(
+                'pgp_pub_field', flat=True
+            )
+            self.assertEqual(list(values), ['old', 'new'])
+
+    def test_not_decrypted_in_python(self):
+        """Assert the fields using the key ring are left to postgres."""
+        with self.key_ring:
+            EncryptedModel.objects.create(pgp_sym_field='new')
+
+            instance = EncryptedModel.objects.decrypt_client_side().get()
+            self.assertEqual(instance.pgp_sym_field, 'new')
+
+    def test_rotation(self):
+        """Assert the rotation reads values with both keys and keeps the current ones."""
+        with override_settings(**self.old_settings):
+            EncryptedModel.objects.create(pgp_sym_field='old')
+        with self.key_ring:
+            EncryptedModel.objects.create(pgp_sym_field='new')
+
+            directory = tempfile.TemporaryDirectory()
+            self.addCleanup(directory.cleanup)
+            KeyRotation(
+                EncryptedModel,
+                'default',
+                settings.PGCRYPTO_OLD_KEYS,
+                Checkpoint(os.path.join(directory.name, 'rotation.json')),
+            ).rotate()
+
+            values = EncryptedModel.objects.order_by('id').values_list(
+                'pgp_sym_field', flat=True
+            )
+            self.assertEqual(list(values), ['old', 'new'])
+
+
+class TestRepairStale(TestCase):
+    """Test `repair_stale` encrypts the rows of old keys again with the current keys."""
+
+    def setUp(self):
+        """Create rows encrypted with the keys of the `diff_keys` database."""
+        settings_dict = connections['diff_keys'].settings_dict
+        with override_settings(
+            PGCRYPTO_KEY=settings_dict['PGCRYPTO_KEY'],
+            PUBLIC_PGP_KEY=settings_dict['PUBLIC_PGP_KEY'],
+            PRIVATE_PGP_KEY=settings_dict['PRIVATE_PGP_KEY'],
+        ):
+            for i in range(2):
+                EncryptedModel.objects.create(
+                    pgp_sym_field='sym {}'.format(i), pgp_pub_field='pub {}'.format(i)
+                )
+
+        key_ring = override_settings(
+            PGCRYPTO_KEY_IDS=True,
+            PGCRYPTO_KEY_ID=2,
+            PGCRYPTO_OLD_KEYS={
+                'PGCRYPTO_KEY': settings_dict['PGCRYPTO_KEY'],
+                'PRIVATE_PGP_KEY': settings_dict['PRIVATE_PGP_KEY'],
+            },
+        )
+        key_ring.enable()
+        self.addCleanup(key_ring.disable)
+        self.addCleanup(repair.pending.rows.clear)
+
+    def get_stale(self):
+        """Get whether each row has values of old keys."""
+        return list(
+            EncryptedModel.objects.order_by('id').annotate(
+                stale=StaleKey('pgp_sym_field', 'pgp_pub_field')
+            ).values_list('stale', flat=True)
+        )
+
+    def test_repair(self):
+        """Assert the rows read are encrypted again with the current keys."""
+        self.assertEqual(self.get_stale(), [True, True])
+
+        instances = list(EncryptedModel.objects.order_by('id').repair_stale())
+        self.assertEqual(instances[0].pgp_sym_field, 'sym 0')
+        self.assertFalse(hasattr(instances[0], 'pgcrypto_stale'))
+        repair.flush()
+
+        self.assertEqual(self.get_stale(), [False, False])
+        values = EncryptedModel.objects.order_by('id').values_list(
+            'pgp_sym_field', 'pgp_pub_field'
+        )
+        self.assertEqual(list(values), [('sym 0', 'pub 0'), ('sym 1', 'pub 1')])
+
+    def test_only_rows_read(self):
+        """Assert only the rows read are repaired."""
+        list(EncryptedModel.objects.order_by('id').repair_stale()[:1])
+        repair.flush()
+
+        self.assertEqual(self.get_stale(), [False, True])
+
+    def test_current_keys(self):
+        """Assert rows with the current keys aren't scheduled."""
+        EncryptedModel.objects.create(pgp_sym_field='new', pgp_pub_field='new')
+
+        EncryptedModel.objects.repair_stale().get(pgp_sym_field='new')
+
+        self.assertEqual(repair.pending.rows, {})
+
+    def test_without_key_ids(self):
+        """Assert values are only repaired with key ids."""
+        with override_settings(PGCRYPTO_KEY_IDS=False):
+            queryset = EncryptedModel.objects.repair_stale()
+
+        self.assertIsNot(queryset._iterable_class, managers.RepairIterable)
+
+    def test_values(self):
+        """Assert `values()` doesn't return whether the row is stale."""
+        values = EncryptedModel.objects.order_by('id').repair_stale().values('id')
+
+        self.assertEqual(list(values[0]), ['id'])
+        self.assertEqual(repair.pending.rows, {})
+
+    @override_settings(PGCRYPTO_REPAIR_BATCH_SIZE=2)
+    def test_batch_size(self):
+        """Assert the rows are repaired once `PGCRYPTO_REPAIR_BATCH_SIZE` are pending."""
+        list(EncryptedModel.objects.order_by('id').repair_stale()[:1])
+        self.assertEqual(self.get_stale(), [True, True])
+
+        list(EncryptedModel.objects.order_by('-id').repair_stale()[:1])
+
+        self.assertEqual(repair.pending.rows, {})
+        self.assertEqual(self.get_stale(), [False, False])
+
+
+class TestKeyRotation(TestCase):
+    """Test `KeyRotation` encrypts the PGP fields again with the current keys."""
+
+    def setUp(self):
+        """Create rows encrypted with the keys of the `diff_keys` database."""
+        settings_dict = connections['diff_keys'].settings_dict
+        self.old_keys = {
+            'PGCRYPTO_KEY': settings_dict['PGCRYPTO_KEY'],
+            'PRIVATE_PGP_KEY': settings_dict['PRIVATE_PGP_KEY'],
+        }
+        with override_settings(
+            PGCRYPTO_KEY=settings_dict['PGCRYPTO_KEY'],
+            PUBLIC_PGP_KEY=settings_dict['PUBLIC_PGP_KEY'],
+            PRIVATE_PGP_KEY=settings_dict['PRIVATE_PGP_KEY'],
+        ):
+            for i in range(5):
+                EncryptedModel.objects.create(
+                    pgp_sym_field='sym {}'.format(i),
+                    pgp_pub_field='pub {}'.format(i),
+                    integer_pgp_pub_field=i,
+                )
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rotation.json')
+
+    def rotate(self, **kwargs):
+        """Rotate the keys of `EncryptedModel` and return the sizes of the batches."""
+        batches = []
+        rotation = KeyRotation(
+            EncryptedModel, 'default', self.old_keys, Checkpoint(self.path)
+        )
+        rotation.rotate(progress=lambda model, count: batches.append(count), **kwargs)
+        return batches
+
+    def test_rotate(self):
+        """Assert the values are decrypted with the current keys."""
+        batches = self.rotate(batch_size=2)
+
+        self.assertEqual(batches, [2, 2, 1])
+        values = EncryptedModel.objects.order_by('id').values_list(
+            'pgp_sym_field', 'pgp_pub_field', 'integer_pgp_pub_field'
+        )
+        self.assertEqual(
+            list(values),
+            [('sym {}'.format(i), 'pub {}'.format(i), i) for i in range(5)],
+        )
+
+    def test_current_public_key(self):
+        """Assert values encrypted with the current public key are kept."""
+        obj = EncryptedModel.objects.order_by('id').first()
+        EncryptedModel.objects.filter(pk=obj.pk).update(pgp_pub_field='current')
+
+        self.rotate()
+
+        obj.refresh_from_db()
+        self.assertEqual(obj.pgp_pub_field, 'current')
+
+    def test_current_symmetric_key(self):
+        """Assert values encrypted with the current symmetric key are kept."""
+        obj = EncryptedModel.objects.order_by('id').first()
+        EncryptedModel.objects.filter(pk=obj.pk).update(pgp_sym_field='current')
+
+        self.rotate()
+
+        obj.refresh_from_db()
+        self.assertEqual(obj.pgp_sym_field, 'current')
+
+    def test_rotate_again(self):
+        """Assert a rotated model can be rotated again."""
+        self.rotate(batch_size=2)
+
+        self.assertEqual(self.rotate(batch_size=2), [2, 2, 1])
+        self.assertEqual(EncryptedModel.objects.filter(pgp_sym_field='sym 4').count(), 1)
+        self.assertEqual(EncryptedModel.objects.filter(pgp_pub_field='pub 4').count(), 1)
+
+    def test_old_keys(self):
+        """Assert the values are decrypted with any of the old keys."""
+        self.old_keys = {
+            setting: ['unused', key] if setting == 'PGCRYPTO_KEY' else key
+            for setting, key in self.old_keys.items()
+        }
+
+        self.rotate()
+
+        self.assertEqual(EncryptedModel.objects.filter(pgp_sym_field='sym 2').count(), 1)
+
+    def test_aes(self):
+        """Assert the AES fields, whose key of a value isn't known, aren't rotated."""
+        with self.assertRaises(ValueError):
+            KeyRotation(EncryptedAES, 'default', self.old_keys, Checkpoint(self.path))
+
+        with self.assertRaises(CommandError):
+            with override_settings(PGCRYPTO_OLD_KEYS=self.old_keys):
+                call_command(
+                    'rotate_pgcrypto_keys', 'tests.EncryptedModel', 'tests.EncryptedAES',
+                    databases=['default'], checkpoint=self.path,
+                )
+        self.assertEqual(Checkpoint(self.path).progress, {})
+
+    def test_resume(self):
+        """Assert the rows rotated before an interruption are skipped."""
+        def interrupt(model, count):
+            raise KeyboardInterrupt
+
+        rotation = KeyRotation(
+            EncryptedModel, 'default', self.old_keys, Checkpoint(self.path)
+        )
+        with self.assertRaises(KeyboardInterrupt):
+            rotation.rotate(batch_size=2, progress=interrupt)
+
+        self.assertEqual(self.rotate(batch_size=2), [2, 1])
+        self.assertEqual(EncryptedModel.objects.filter(pgp_sym_field='sym 4').count(), 1)
+
+    def test_clear_checkpoint(self):
+        """Assert the progress of a model is cleared once it is rotated."""
+        self.rotate(batch_size=2, workers=2)
+
+        self.assertEqual(Checkpoint(self.path).progress, {})
+
+    def test_snapshot(self):
+        """Assert the rows added after the start are skipped without integer keys."""
+        settings_dict = connections['diff_keys'].settings_dict
+        with override_settings(PGCRYPTO_KEY=settings_dict['PGCRYPTO_KEY']):
+            for i in range(3):
+                EncryptedUUID.objects.create(pgp_sym_field='old {}'.format(i))
+        rotation = KeyRotation(
+            EncryptedUUID, 'default', self.old_keys, Checkpoint(self.path)
+        )
+        rotation.get_ranges(workers=2)
+        for i in range(3):
+            EncryptedUUID.objects.create(pgp_sym_field='new {}'.format(i))
+
+        batches = []
+        rotation.rotate(batch_size=2, progress=lambda model, count: batches.append(count))
+
+        self.assertEqual(batches, [2, 1])
+        self.assertCountEqual(
+            EncryptedUUID.objects.values_list('pgp_sym_field', flat=True),
+            ['old 0', 'old 1', 'old 2', 'new 0', 'new 1', 'new 2'],
+        )
+        tables = connections['default'].introspection.table_names()
+        self.assertNotIn('pgcrypto_rotation_tests_encrypteduuid', tables)
+
+    def test_ranges(self):
+        """Assert the primary keys are split in disjoint ranges."""
+        pks = list(EncryptedModel.objects.order_by('id').values_list('id', flat=True))
+        rotation = KeyRotation(
+            EncryptedModel, 'default', self.old_keys, Checkpoint(self.path)
+        )
+
+        ranges = rotation.get_ranges(workers=2)
+
+        self.assertEqual(len(ranges), 2)
+        self.assertIsNone(ranges[0][0])
+        self.assertEqual(ranges[0][1], ranges[1][0])
+        self.assertEqual(ranges[1][1], pks[-1])
+        checkpoint = Checkpoint(self.path)
+        self.assertEqual(checkpoint.get('default:tests.EncryptedModel'), ranges)
+
+    def test_command(self):
+        """Assert the command rotates the keys of the given models."""
+        stdout = io.StringIO()
+        with override_settings(PGCRYPTO_OLD_KEYS=self.old_keys):
+            call_command(
+                'rotate_pgcrypto_keys', 'tests.EncryptedModel',
+                databases=['default'], checkpoint=self.path, stdout=stdout,
+            )
+
+        self.assertIn('Rotated tests.EncryptedModel in default', stdout.getvalue())
+        self.assertEqual(EncryptedModel.objects.filter(pgp_pub_field='pub 3').count(), 1)
+
+    def test_command_without_old_keys(self):
+        """Assert the command needs the old keys."""
+        with self.assertRaises(CommandError):
+            call_command(
+                'rotate_pgcrypto_keys', databases=['default'], checkpoint=self.path
+            )
+
+
+class TestEncryptColumnInPlace(TestCase):
+    """Test `EncryptColumnInPlace` encrypts a plaintext column by batch."""
+
+    def setUp(self):
+        """Create a table with plaintext columns and rows."""
+        self.state = ProjectState()
+        self.apply(migrations.CreateModel('Plain', [
+            ('id', models.AutoField(primary_key=True)),
+            ('text', models.TextField(null=True)),
+            ('number', models.IntegerField()),
+        ]))
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO tests_plain (text, number) "
+                "VALUES ('un', 1), ('deux', 2), (NULL, 3)"
+            )
+
+    def apply(self, operation):
+        """Run `operation` on the database and the state."""
+        new_state = self.state.clone()
+        operation.state_forwards('tests', new_state)
+        with connections['default'].schema_editor() as schema_editor:
+            operation.database_forwards('tests', schema_editor, self.state, new_state)
+        self.state = new_state
+
+    def unapply(self, operation, state):
+        """Reverse `operation` back to `state`."""
+        with connections['default'].schema_editor() as schema_editor:
+            operation.database_backwards('tests', schema_editor, self.state, state)
+        self.state = state
+
+    def get_values(self, name):
+        """Get the values of the column `name` by primary key."""
+        model = self.state.apps.get_model('tests', 'Plain')
+        return list(model.objects.order_by('id').values_list(name, flat=True))
+
+    def get_columns(self):
+        """Get the columns of the table and their type."""
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                "SELECT column_name, data_type FROM information_schema.columns "
+                "WHERE table_name = 'tests_plain'"
+            )
+            return dict(cursor.fetchall())
+
+    def test_encrypt(self):
+        """Assert the values are encrypted in batches and decrypted back."""
+        operations = [
+            EncryptColumnInPlace(
+                'plain', 'text', fields.TextPGPSymmetricKeyField(null=True), batch_size=2
+            ),
+            EncryptColumnInPlace(
+                'plain', 'number', fields.IntegerPGPPublicKeyField(), batch_size=2
+            ),
+        ]
+        states = []
+        for operation in operations:
+            states.append(self.state)
+            self.apply(operation)
+
+        self.assertEqual(self.get_values('text'), ['un', 'deux', None])
+        self.assertEqual(self.get_values('number'), [1, 2, 3])
+        columns = self.get_columns()
+        self.assertEqual(columns['text'], 'bytea')
+        self.assertEqual(columns['number'], 'bytea')
+        self.assertEqual(len(columns), 3)
+
+        for operation, state in reversed(list(zip(operations, states))):
+            self.unapply(operation, state)
+        self.assertEqual(self.get_values('text'), ['un', 'deux', None])
+        self.assertEqual(self.get_columns(), {
+            'id': 'integer', 'text': 'text', 'number': 'integer',
+        })
+
+    def test_trigger(self):
+        """Assert the values written after the backfill are encrypted by the trigger."""
+        operation = EncryptColumnInPlace(
+            'plain', 'text', fields.TextPGPSymmetricKeyField(null=True)
+        )
+        backfill = operation.backfill
+
+        def backfill_then_write(connection, *args):
+            backfill(connection, *args)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT prosrc FROM pg_proc WHERE proname LIKE 'pgcrypto_convert_%'"
+                )
+                self.assertNotIn(settings.PGCRYPTO_KEY, cursor.fetchone()[0])
+                cursor.execute("UPDATE tests_plain SET text = 'trois' WHERE number = 3")
+                # A session without the keys leaves the row to convert once locked.
+                cursor.execute(
+                    "SELECT set_config('pgcrypto_fields.convert_key_0', '', false)"
+                )
+                cursor.execute(
+                    "INSERT INTO tests_plain (text, number) VALUES ('quatre', 4)"
+                )
+                cursor.execute(
+                    "SELECT set_config('pgcrypto_fields.convert_key_0', %s, false)",
+                    [settings.PGCRYPTO_KEY],
+                )
+
+        operation.backfill = backfill_then_write
+        self.apply(operation)
+
+        self.assertEqual(self.get_values('text'), ['un', 'deux', 'trois', 'quatre'])
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_trigger WHERE tgname LIKE 'pgcrypto_%'"
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def get_constraints(self, column):
+        """Get the unique and index flags of the constraints of the column `column`."""
+        connection = connections['default']
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, 'tests_plain')
+        return sorted(
+            (constraint['unique'], constraint['index'])
+            for constraint in constraints.values()
+            if constraint['columns'] == [column]
+        )
+
+    def test_constraints(self):
+        """Assert the indexes and constraints of the field are created again."""
+        self.apply(migrations.AddField(
+            'plain', 'code', models.TextField(null=True, unique=True),
+        ))
+        self.apply(migrations.AddIndex(
+            'plain', models.Index(fields=['number'], name='plain_number_idx'),
+        ))
+        plain = self.get_constraints('code')
+        operations = [
+            EncryptColumnInPlace(
+                'plain', 'code', fields.TextPGPSymmetricKeyField(null=True, unique=True)
+            ),
+            EncryptColumnInPlace('plain', 'number', fields.IntegerPGPPublicKeyField()),
+        ]
+        states = []
+        for operation in operations:
+            states.append(self.state)
+            self.apply(operation)
+
+        self.assertEqual(self.get_constraints('code'), [(True, True)])
+        self.assertEqual(self.get_constraints('number'), [(False, True)])
+
+        for operation, state in reversed(list(zip(operations, states))):
+            self.unapply(operation, state)
+        self.assertEqual(self.get_constraints('code'), plain)
+        self.assertEqual(self.get_constraints('number'), [(False, True)])
+
+    def test_data_key(self):
+        """Assert fields encrypted with a data key aren't supported."""
+        self.apply(migrations.AddField(
+            'plain', 'data_key', fields.DataKeyField(null=True),
+        ))
+        operation = EncryptColumnInPlace(
+            'plain', 'text', fields.TextPGPPublicKeyField(null=True)
+        )
+        with self.assertRaises(ValueError):
+            self.apply(operation)
+
+    def test_deconstruct(self):
+        """Assert the batch size is kept in the migration."""
+        operation = EncryptColumnInPlace(
+            'plain', 'text', fields.TextPGPSymmetricKeyField(null=True), batch_size=10
+        )
+        name, args, kwargs = operation.deconstruct()
+        self.assertEqual(name, 'EncryptColumnInPlace')
+        self.assertEqual(kwargs['batch_size'], 10)
+        self.assertEqual(kwargs['name'], 'text')
+
+
+class TestRecomputeHashes(TestCase):
+    """Test `recompute_hashes` computes the hash fields again in postgres."""
+
+    def test_recompute(self):
+        """Assert the hashes left stale by `update()` are computed again."""
+        for _ in range(3):
+            EncryptedModel.objects.create(pgp_sym_field='bonjour', digest_field='a')
+        EncryptedModel.objects.update(pgp_sym_field='salut')
+        self.assertFalse(
+            EncryptedModel.objects.filter(hmac_with_original_field__hash_of='salut')
+        )
+
+        counts = []
+        recompute_hashes(
+            EncryptedModel, batch_size=2,
+            progress=lambda model, count: counts.append(count),
+        )
+
+        self.assertEqual(counts, [2, 1])
+        for field_name in ('digest_with_original_field', 'hmac_with_original_field'):
+            with self.subTest(field=field_name):
+                queryset = EncryptedModel.objects.filter(
+                    **{field_name + '__hash_of': 'salut'}
+                )
+                self.assertEqual(queryset.count(), 3)
+        self.assertEqual(
+            EncryptedModel.objects.filter(digest_field__hash_of='a').count(), 3
+        )
+
+    def test_blind_index(self):
+        """Assert the blind index is computed from the decrypted value."""
+        EncryptedBlindIndex.objects.create(email_pgp_pub_field='peter@test.com')
+        EncryptedBlindIndex.objects.update(email_pgp_pub_field='paul@test.com')
+
+        recompute_hashes(EncryptedBlindIndex)
+
+        queryset = EncryptedBlindIndex.objects.filter(email_pgp_pub_field='paul@test.com')
+        self.assertEqual(queryset.count(), 1)
+
+    @isolate_apps('tests')
+    def test_non_text_original(self):
+        """Assert the hashes of values which aren't text are left out."""
+        class Hashes(models.Model):
+            text = fields.TextPGPSymmetricKeyField()
+            integer = fields.IntegerPGPSymmetricKeyField()
+            boolean = models.BooleanField()
+            text_hmac = fields.TextHMACField(original='text')
+            integer_hmac = fields.TextHMACField(original='integer')
+            boolean_digest = fields.TextDigestField(original='boolean')
+
+        recomputed = get_recomputed_fields(Hashes)
+
+        self.assertEqual([field.name for field in recomputed], ['text_hmac'])
+
+    def test_command(self):
+        """Assert the command recomputes the hashes of the given models."""
+        EncryptedModel.objects.create(pgp_sym_field='bonjour')
+        EncryptedModel.objects.update(pgp_sym_field='salut')
+
+        stdout = io.StringIO()
+        call_command(
+            'recompute_pgcrypto_hashes', 'tests.EncryptedModel',
+            databases=['default'], stdout=stdout,
+        )
+
+        self.assertIn('Recomputed tests.EncryptedModel in default', stdout.getvalue())
+        self.assertTrue(
+            EncryptedModel.objects.filter(hmac_with_original_field__hash_of='salut')
+        )
+
+
+class TestDataKeyField(TestCase):
+    """Test `DataKeyField` encrypts the public key fields of its model."""
+    model = EncryptedEnvelope
+
+    def test_envelope(self):
+        """Assert public key fields are encrypted with the data key of the row."""
+        expected = self.model.objects.create(
+            pgp_pub_field='bonjour',
+            integer_pgp_pub_field=42,
+            date_pgp_pub_field=date(2016, 9, 1),
+            pgp_sym_field='salut',
+        )
+        self.model.objects.create(pgp_pub_field='au revoir')
+
+        reset_queries()
+        instance = self.model.objects.get(pgp_pub_field='bonjour')
+
+        self.assertEqual(instance, expected)
+        self.assertEqual(instance.pgp_pub_field, 'bonjour')
+        self.assertEqual(instance.integer_pgp_pub_field, 42)
+        self.assertEqual(instance.date_pgp_pub_field, date(2016, 9, 1))
+        self.assertEqual(instance.pgp_sym_field, 'salut')
+
+        query = str(connections['default'].queries[0])
+        self.assertIn('pgcrypto_fields.envelope_decrypt', query)
+        self.assertNotIn('pgp_pub_decrypt', query)
+
+    def test_update(self):
+        """Assert a saved row keeps its data key when updated."""
+        instance = self.model.objects.create(pgp_pub_field='bonjour')
+        data_key = self.model.objects.values_list('data_key', flat=True).get()
+
+        instance = self.model.objects.get()
+        instance.pgp_pub_field = 'au revoir'
+        instance.save()
+        self.model.objects.update(integer_pgp_pub_field=42)
+
+        instance = self.model.objects.get()
+        self.assertEqual(instance.pgp_pub_field, 'au revoir')
+        self.assertEqual(instance.integer_pgp_pub_field, 42)
+        self.assertEqual(instance.data_key, data_key)
+
+    def create_without_data_key(self, value):
+        """Create a row saved before the `DataKeyField` was added."""
+        instance = self.model.objects.create()
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                'UPDATE tests_encryptedenvelope SET data_key = NULL, '
+                'pgp_pub_field = pgp_pub_encrypt(%s, dearmor(%s)) WHERE id = %s',
+                [value, settings.PUBLIC_PGP_KEY, instance.pk],
+            )
+        return instance
+
+    def test_without_data_key(self):
+        """Assert a row without a data key is decrypted and saved with the public key."""
+        self.create_without_data_key('bonjour')
+
+        instance = self.model.objects.get()
+        self.assertEqual(instance.pgp_pub_field, 'bonjour')
+
+        instance.pgp_pub_field = 'au revoir'
+        instance.save()
+        self.model.objects.update(integer_pgp_pub_field=42)
+
+        instance = self.model.objects.get()
+        self.assertIsNone(instance.data_key)
+        self.assertEqual(instance.pgp_pub_field, 'au revoir')
+        self.assertEqual(instance.integer_pgp_pub_field, 42)
+
+    def test_wrap_data_keys(self):
+        """Assert the command gives a data key to the rows without one."""
+        self.create_without_data_key('bonjour')
+        self.model.objects.create(pgp_pub_field='salut')
+
+        stdout = io.StringIO()
+        call_command(
+            'wrap_pgcrypto_data_keys', 'tests.EncryptedEnvelope',
+            databases=['default'], batch_size=1, stdout=stdout,
+        )
+
+        self.assertIn('Wrapped 1 data keys of tests.EncryptedEnvelope', stdout.getvalue())
+        self.assertFalse(self.model.objects.filter(data_key__isnull=True))
+        self.assertEqual(
+            sorted(self.model.objects.values_list('pgp_pub_field', flat=True)),
+            ['bonjour', 'salut'],
+        )
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                'SELECT pgp_key_id(pgp_pub_field) FROM tests_encryptedenvelope'
+            )
+            self.assertEqual({key_id for key_id, in cursor.fetchall()}, {'SYMKEY'})
+
+
+class TestRecordField(TestCase):
+    """Test record fields encrypt their values together."""
+    model = EncryptedRecord
+
+    def test_record(self):
+        """Assert the values of a record are attributes of the model."""
+        self.model.objects.create(
+            age=42,
+            birthday=date(1976, 9, 1),
+            active=True,
+            balance=Decimal('12.34'),
+            last_login=datetime(2016, 9, 1, 10, 30),
+        )
+
+        reset_queries()
+        instance = self.model.objects.get()
+
+        self.assertEqual(instance.age, 42)
+        self.assertEqual(instance.birthday, date(1976, 9, 1))
+        self.assertIs(instance.active, True)
+        self.assertEqual(instance.balance, Decimal('12.34'))
+        self.assertEqual(instance.last_login, datetime(2016, 9, 1, 10, 30))
+
+        query = str(connections['default'].queries[0])
+        self.assertEqual(query.count('pgp_sym_decrypt'), 1)
+        self.assertEqual(query.count('pgp_pub_decrypt'), 1)
+
+    def test_update(self):
+        """Assert a value of a record can be updated."""
+        instance = self.model.objects.create(age=42)
+        instance.age = '43'
+        instance.save()
+
+        instance = self.model.objects.get()
+        self.assertEqual(instance.age, 43)
+        self.assertIsNone(instance.birthday)
+        self.assertIsNone(instance.pub_record)
+
+    def test_non_null(self):
+        """Assert the values of a non-null record can be set and read."""
+        instance = self.model(age=42)
+        self.assertEqual(instance.profile, {})
+        self.assertIsNone(instance.nickname)
+
+        instance.nickname = 'Bob'
+        instance.save()
+
+        instance = self.model.objects.get()
+        self.assertEqual(instance.nickname, 'Bob')
+        self.assertEqual(instance.age, 42)
+
+    def test_empty_string(self):
+        """Assert an empty string is an empty record."""
+        instance = self.model(profile='')
+        self.assertIsNone(instance.nickname)
+
+        instance.nickname = 'Bob'
+        self.assertEqual(instance.profile, {'nickname': 'Bob'})
+        self.assertEqual(self.model._meta.get_field('profile').to_python(''), {})
+
+    @isolate_apps('tests')
+    def test_check(self):
+        """Assert the values of a record can't hide a field of the model."""
+        class Clash(models.Model):
+            age = models.IntegerField()
+            record = fields.RecordPGPSymmetricKeyField(fields={
+                'age': models.IntegerField(),
+            })
+
+        errors = Clash._meta.get_field('record').check()
+        self.assertEqual([error.id for error in errors], ['pgcrypto.E001'])
+
+
+class TestAESField(TestCase):
+    """Test AES fields encrypt with `encrypt_iv`."""
+    model = EncryptedAES
+
+    def test_aes(self):
+        """Assert AES fields are encrypted and decrypted by postgres."""
+        values = {
+            'text_aes_field': 'bonjour',
+            'integer_aes_field': 42,
+            'date_aes_field': date(2016, 9, 1),
+            'decimal_aes_field': Decimal('12.34'),
+            'boolean_aes_field': True,
+        }
+        expected = self.model.objects.create(**values)
+        self.model.objects.create(text_aes_field='au revoir')
+
+        instance = self.model.objects.get(text_aes_field='bonjour')
+        self.assertEqual(instance, expected)
+        for field_name, value in values.items():
+            with self.subTest(field=field_name):
+                self.assertEqual(getattr(instance, field_name), value)
+
+    def test_stored_format(self):
+        """Assert the IV is stored before the ciphertext of a single block."""
+        self.model.objects.create(text_aes_field='bonjour')
+
+        data = self.model.objects.annotate(
+            data=Ciphertext('text_aes_field')
+        ).values_list('data', flat=True).get()
+        self.assertEqual(len(data), 32)
+        self.assertEqual(client.aes_decrypt(data, settings.PGCRYPTO_KEY), 'bonjour')
+
+
+class TestDeterministicAESField(TestCase):
+    """Test deterministic AES fields compare ciphertexts."""
+    model = EncryptedDeterministic
+
+    def get_ciphertexts(self, field_name):
+        """Get the stored bytes of a field, ordered by primary key."""
+        return [
+            bytes(data) for data in self.model.objects.annotate(
+                data=Ciphertext(field_name)
+            ).order_by('pk').values_list('data', flat=True)
+        ]
+
+    def test_equal_ciphertexts(self):
+        """Assert equal values have equal ciphertexts which decrypt to the value."""
+        self.model.objects.create(text_field='bonjour', date_field=date(2016, 9, 1))
+        self.model.objects.create(text_field='bonjour', date_field=date(2016, 9, 2))
+
+        first, second = self.get_ciphertexts('text_field')
+        self.assertEqual(first, second)
+        self.assertEqual(client.aes_decrypt(first, settings.PGCRYPTO_KEY), 'bonjour')
+        first, second = self.get_ciphertexts('date_field')
+        self.assertNotEqual(first, second)
+
+    def test_client_encryption(self):
+        """Assert values encrypted in python have the ciphertext of postgres."""
+        self.model.objects.create(text_field='bonjour', integer_field=42)
+        with override_settings(PGCRYPTO_CLIENT_ENCRYPTION=True):
+            self.model.objects.create(text_field='bonjour', integer_field=42)
+
+        for field_name in ('text_field', 'integer_field'):
+            with self.subTest(field=field_name):
+                first, second = self.get_ciphertexts(field_name)
+                self.assertEqual(first, second)
+
+    def test_exact(self):
+        """Assert `exact` compares the column without decrypting it."""
+        expected = self.model.objects.create(integer_field=42)
+        self.model.objects.create(integer_field=43)
+
+        queryset = self.model.objects.filter(integer_field=42)
+        where = str(queryset.query).split('WHERE')[1]
+        self.assertNotIn('aes_decrypt', where)
+        self.assertCountEqual(queryset, [expected])
+
+    def test_in(self):
+        """Assert `in` compares the column with each ciphertext."""
+        first = self.model.objects.create(text_field='un')
+        second = self.model.objects.create(text_field='deux')
+        self.model.objects.create(text_field='trois')
+
+        queryset = self.model.objects.filter(text_field__in=['un', 'deux', 'un'])
+        self.assertCountEqual(queryset, [first, second])
+
+    def test_compare_columns(self):
+        """Assert two deterministic fields are compared without decryption."""
+        expected = self.model.objects.create(
+            text_field='peter@test.com', email_field='peter@test.com'
+        )
+        self.model.objects.create(text_field='peter', email_field='peter@test.com')
+
+        queryset = self.model.objects.filter(text_field=models.F('email_field'))
+        self.assertNotIn('aes_decrypt', str(queryset.query).split('WHERE')[1])
+        self.assertCountEqual(queryset, [expected])
+
+    def test_group_by(self):
+        """Assert values are grouped by their ciphertext."""
+        for text in ('un', 'un', 'deux'):
+            self.model.objects.create(text_field=text)
+
+        counts = self.model.objects.values(
+            data=Ciphertext('text_field')
+        ).annotate(count=models.Count('id')).values_list('count', flat=True)
+        self.assertCountEqual(counts, [2, 1])